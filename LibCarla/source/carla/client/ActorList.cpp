@@ -8,6 +8,7 @@
 
 #include "carla/StringUtil.h" // 引入字符串工具类的头文件
 #include "carla/client/detail/ActorFactory.h" // 引入参与者工厂类的头文件
+#include "carla/client/detail/Simulator.h" // 引入模拟器类的头文件
 
 #include <iterator> // 引入迭代器相关的标准库
 
@@ -39,6 +40,34 @@ namespace client {
     return filtered; // 返回过滤后的参与者列表
   }
 
+  std::vector<ActorId> ActorList::GetIds() const { // 获取所有参与者的 id
+    std::vector<ActorId> result;
+    result.reserve(_actors.size());
+    for (auto &actor : _actors) {
+      result.emplace_back(actor.GetId());
+    }
+    return result;
+  }
+
+  std::vector<boost::optional<ActorSnapshot>> ActorList::GetSnapshots() const { // 获取所有参与者的快照
+    const auto snapshot = _episode.Lock()->GetWorldSnapshot(); // 只读取一次片段状态
+    std::vector<boost::optional<ActorSnapshot>> result;
+    result.reserve(_actors.size());
+    for (auto &actor : _actors) {
+      result.emplace_back(snapshot.Find(actor.GetId())); // 已销毁的参与者为空值
+    }
+    return result;
+  }
+
+  std::vector<geom::BoundingBox> ActorList::GetBoundingBoxes() const { // 获取所有参与者的包围盒
+    std::vector<geom::BoundingBox> result;
+    result.reserve(_actors.size());
+    for (auto &actor : _actors) {
+      result.emplace_back(actor.Serialize().bounding_box);
+    }
+    return result;
+  }
+
 } // namespace client
 } // namespace carla
 
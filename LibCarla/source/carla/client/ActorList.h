@@ -6,9 +6,12 @@
 
 #pragma once // 确保该头文件只被包含一次
 
+#include "carla/client/ActorSnapshot.h" // 包含 ActorSnapshot 的定义
 #include "carla/client/detail/ActorVariant.h" // 包含 ActorVariant 的定义
+#include "carla/geom/BoundingBox.h" // 包含 BoundingBox 的定义
 
 #include <boost/iterator/transform_iterator.hpp> // 引入 Boost 库中的变换迭代器
+#include <boost/optional.hpp> // 引入 Boost 库中的可选值
 
 #include <vector> // 引入标准库中的 vector 容器
 
@@ -34,6 +37,17 @@ namespace client { // 开始 client 命名空间
     /// 过滤类型 ID 与 @a wildcard_pattern 匹配的参与者列表。
     SharedPtr<ActorList> Filter(const std::string &wildcard_pattern) const; // 根据通配符模式过滤参与者列表
 
+    /// 按列表顺序返回参与者的 id，不实例化参与者。
+    std::vector<ActorId> GetIds() const;
+
+    /// 按列表顺序返回参与者在片段当前状态中的快照。整个列表只读取一次状态，
+    /// 也不实例化参与者，代替对每个参与者调用 GetTransform、GetVelocity 等。
+    /// 已经不在状态中的参与者（例如已被销毁）返回空值。
+    std::vector<boost::optional<ActorSnapshot>> GetSnapshots() const;
+
+    /// 按列表顺序返回参与者的包围盒（相对于参与者），不实例化参与者。
+    std::vector<geom::BoundingBox> GetBoundingBoxes() const;
+
     SharedPtr<Actor> operator[](size_t pos) const { // 重载 [] 运算符
       return _actors[pos].Get(_episode); // 获取指定位置的参与者
     }
@@ -10,14 +10,16 @@ It can also make use of the global route planner to follow a specified route
 """
 
 import carla
-from shapely.geometry import Polygon
 
 from agents.navigation.local_planner import LocalPlanner, RoadOption
 from agents.navigation.global_route_planner import GlobalRoutePlanner
-from agents.tools.misc import (get_speed, is_within_distance,
-                               get_trafficlight_trigger_location)
+from agents.tools.misc import get_speed, is_within_distance
 
+from agents.tools.actor_registry import ActorRegistry
 from agents.tools.hints import ObstacleDetectionResult, TrafficLightDetectionResult
+from agents.tools.perception import SnapshotPerception
+from agents.tools.route_corridor import RouteCorridor, actor_box_corners
+from agents.tools.traffic_light_index import TrafficLightIndex
 
 
 class BasicAgent:
@@ -64,6 +66,10 @@ class BasicAgent:
         self._speed_ratio = 1
         self._max_brake = 0.5
         self._offset = 0
+        self._graph_cache_dir = None
+        self._compact_route_graph = False
+        self._route_path_search = 'astar'
+        self._perception = None  # type: SnapshotPerception | None
 
         # Change parameters according to the dictionary
         opt_dict['target_speed'] = target_speed
@@ -87,21 +93,39 @@ class BasicAgent:
             self._max_brake = opt_dict['max_brake']
         if 'offset' in opt_dict:
             self._offset = opt_dict['offset']
+        if 'graph_cache_dir' in opt_dict:
+            self._graph_cache_dir = opt_dict['graph_cache_dir']
+        if 'compact_route_graph' in opt_dict:
+            self._compact_route_graph = opt_dict['compact_route_graph']
+        if 'route_path_search' in opt_dict:
+            self._route_path_search = opt_dict['route_path_search']
+        if 'snapshot_perception' in opt_dict:
+            # Either a SnapshotPerception or True to use the one shared by all the agents of the world
+            if isinstance(opt_dict['snapshot_perception'], SnapshotPerception):
+                self._perception = opt_dict['snapshot_perception']
+            elif opt_dict['snapshot_perception']:
+                self._perception = SnapshotPerception.for_world(self._world, self._map)
 
         # Initialize the planners
         self._local_planner = LocalPlanner(self._vehicle, opt_dict=opt_dict, map_inst=self._map)
+        self._route_corridor = RouteCorridor(self._local_planner.get_plan())
         if grp_inst:
             if isinstance(grp_inst, GlobalRoutePlanner):
                 self._global_planner = grp_inst
             else:
                 print("Warning: Ignoring the given map as it is not a 'carla.Map'")
-                self._global_planner = GlobalRoutePlanner(self._map, self._sampling_resolution)
+                self._global_planner = GlobalRoutePlanner(
+                    self._map, self._sampling_resolution, self._graph_cache_dir, self._compact_route_graph,
+                    path_search=self._route_path_search)
         else:
-            self._global_planner = GlobalRoutePlanner(self._map, self._sampling_resolution)
+            self._global_planner = GlobalRoutePlanner(
+                self._map, self._sampling_resolution, self._graph_cache_dir, self._compact_route_graph,
+                path_search=self._route_path_search)
 
-        # Get the static elements of the scene
-        self._lights_list = self._world.get_actors().filter("*traffic_light*")
-        self._lights_map = {}  # Dictionary mapping a traffic light to a wp corresponding to its trigger volume location
+        # Lists of the actors of the scene, shared by all the agents and only rebuilt
+        # when actors are spawned or destroyed
+        self._actor_registry = ActorRegistry.for_world(self._world)
+        self._traffic_light_index = TrafficLightIndex.for_world(self._world, self._map)
 
     def add_emergency_stop(self, control):
         """
@@ -198,8 +222,13 @@ class BasicAgent:
         """Execute one step of navigation."""
         hazard_detected = False
 
-        # Retrieve all relevant actors
-        vehicle_list = self._world.get_actors().filter("*vehicle*")
+        # Retrieve all relevant actors. The perception only gives the nearby ones, see _vehicle_obstacle_detected
+        self._actor_registry.update()
+        if self._perception:
+            self._perception.tick()
+            vehicle_list = None
+        else:
+            vehicle_list = self._actor_registry.vehicles
 
         vehicle_speed = get_speed(self._vehicle) / 3.6
 
@@ -211,7 +240,7 @@ class BasicAgent:
 
         # Check if the vehicle is affected by a red traffic light
         max_tlight_distance = self._base_tlight_threshold + self._speed_ratio * vehicle_speed
-        affected_by_tlight, _ = self._affected_by_traffic_light(self._lights_list, max_tlight_distance)
+        affected_by_tlight, _ = self._affected_by_traffic_light(max_distance=max_tlight_distance)
         if affected_by_tlight:
             hazard_detected = True
 
@@ -263,21 +292,19 @@ class BasicAgent:
 
         self.set_global_plan(path)
 
-    def _affected_by_traffic_light(self, lights_list=None, max_distance=None):
+    def _affected_by_traffic_light(self, lights_list=None, max_distance=None, ego=None):
         """
         Method to check if there is a red light affecting the vehicle.
 
             :param lights_list (list of carla.TrafficLight): list containing TrafficLight objects.
-                If None, all traffic lights in the scene are used
+                If None, the traffic lights of the lanes of the vehicle and its plan are used
             :param max_distance (float): max distance for traffic lights to be considered relevant.
                 If None, the base threshold value is used
+            :param ego (EgoContext): state of the vehicle in this step. If None, it is retrieved
         """
         if self._ignore_traffic_lights:
             return TrafficLightDetectionResult(False, None)
 
-        if not lights_list:
-            lights_list = self._world.get_actors().filter("*traffic_light*")
-
         if not max_distance:
             max_distance = self._base_tlight_threshold
 
@@ -287,123 +314,131 @@ class BasicAgent:
             else:
                 return TrafficLightDetectionResult(True, self._last_traffic_light)
 
-        ego_vehicle_location = self._vehicle.get_location()
-        ego_vehicle_waypoint = self._map.get_waypoint(ego_vehicle_location)
+        if ego is not None:
+            ego_vehicle_transform = ego.transform
+            ego_vehicle_location = ego.location
+            ego_vehicle_waypoint = ego.waypoint
+        else:
+            ego_vehicle_transform = self._get_transform(self._vehicle)
+            ego_vehicle_location = ego_vehicle_transform.location
+            ego_vehicle_waypoint = self._get_waypoint(self._vehicle, location=ego_vehicle_location)
 
-        for traffic_light in lights_list:
-            if traffic_light.id in self._lights_map:
-                trigger_wp = self._lights_map[traffic_light.id]
-            else:
-                trigger_location = get_trafficlight_trigger_location(traffic_light)
-                trigger_wp = self._map.get_waypoint(trigger_location)
-                self._lights_map[traffic_light.id] = trigger_wp
+        # Lanes the vehicle is going to drive through before being farther than max_distance
+        plan = self._local_planner.get_plan()
+        lane_waypoints = [ego_vehicle_waypoint]
+        lane_waypoints.extend(plan[i][0] for i in range(plan.count_within(ego_vehicle_location, max_distance)))
+        road_ids = set(waypoint.road_id for waypoint in lane_waypoints)
 
-            if trigger_wp.transform.location.distance(ego_vehicle_location) > max_distance:
+        self._traffic_light_index.update()
+        if not lights_list:
+            candidates = self._traffic_light_index.lookup(lane_waypoints)
+        else:
+            lanes = set((waypoint.road_id, waypoint.lane_id) for waypoint in lane_waypoints)
+            candidates = [self._traffic_light_index.entry(traffic_light) for traffic_light in lights_list]
+            candidates = [entry for entry in candidates if lanes.intersection(entry.lanes)]
+
+        ve_dir = ego_vehicle_waypoint.transform.get_forward_vector()
+        for entry in candidates:
+            trigger_wp = entry.trigger_waypoint
+            if trigger_wp.road_id not in road_ids:
                 continue
 
-            if trigger_wp.road_id != ego_vehicle_waypoint.road_id:
+            x, y, z = entry.trigger_location
+            dx, dy, dz = x - ego_vehicle_location.x, y - ego_vehicle_location.y, z - ego_vehicle_location.z
+            if dx * dx + dy * dy + dz * dz > max_distance * max_distance:
                 continue
 
-            ve_dir = ego_vehicle_waypoint.transform.get_forward_vector()
-            wp_dir = trigger_wp.transform.get_forward_vector()
-            dot_ve_wp = ve_dir.x * wp_dir.x + ve_dir.y * wp_dir.y + ve_dir.z * wp_dir.z
-
+            wp_dir = entry.trigger_direction
+            dot_ve_wp = ve_dir.x * wp_dir[0] + ve_dir.y * wp_dir[1] + ve_dir.z * wp_dir[2]
             if dot_ve_wp < 0:
                 continue
 
+            traffic_light = entry.traffic_light
             if traffic_light.state != carla.TrafficLightState.Red:
                 continue
 
-            if is_within_distance(trigger_wp.transform, self._vehicle.get_transform(), max_distance, [0, 90]):
+            if is_within_distance(trigger_wp.transform, ego_vehicle_transform, max_distance, [0, 90]):
                 self._last_traffic_light = traffic_light
                 return TrafficLightDetectionResult(True, traffic_light)
 
         return TrafficLightDetectionResult(False, None)
 
-    def _vehicle_obstacle_detected(self, vehicle_list=None, max_distance=None, up_angle_th=90, low_angle_th=0, lane_offset=0):
+    def _vehicle_obstacle_detected(self, vehicle_list=None, max_distance=None, up_angle_th=90, low_angle_th=0,
+                                   lane_offset=0, ego=None):
         """
         Method to check if there is a vehicle in front of the agent blocking its path.
 
             :param vehicle_list (list of carla.Vehicle): list containing vehicle objects.
-                If None, all vehicle in the scene are used
+                If None, all vehicle in the scene are used, or only the ones within max_distance
+                of the front of the vehicle if the snapshot perception is enabled
             :param max_distance: max freespace to check for obstacles.
                 If None, the base threshold value is used
+            :param ego (EgoContext): state of the vehicle in this step. If None, it is retrieved
         """
-        def get_route_polygon():
-            route_bb = []
-            extent_y = self._vehicle.bounding_box.extent.y
-            r_ext = extent_y + self._offset
-            l_ext = -extent_y + self._offset
-            r_vec = ego_transform.get_right_vector()
-            p1 = ego_location + carla.Location(r_ext * r_vec.x, r_ext * r_vec.y)
-            p2 = ego_location + carla.Location(l_ext * r_vec.x, l_ext * r_vec.y)
-            route_bb.extend([[p1.x, p1.y, p1.z], [p2.x, p2.y, p2.z]])
-
-            for wp, _ in self._local_planner.get_plan():
-                if ego_location.distance(wp.transform.location) > max_distance:
-                    break
-
-                r_vec = wp.transform.get_right_vector()
-                p1 = wp.transform.location + carla.Location(r_ext * r_vec.x, r_ext * r_vec.y)
-                p2 = wp.transform.location + carla.Location(l_ext * r_vec.x, l_ext * r_vec.y)
-                route_bb.extend([[p1.x, p1.y, p1.z], [p2.x, p2.y, p2.z]])
-
-            # Two points don't create a polygon, nothing to check
-            if len(route_bb) < 3:
-                return None
-
-            return Polygon(route_bb)
-
         if self._ignore_vehicles:
             return ObstacleDetectionResult(False, None, -1)
 
-        if vehicle_list is None:
-            vehicle_list = self._world.get_actors().filter("*vehicle*")
-        if len(vehicle_list) == 0:
-            return ObstacleDetectionResult(False, None, -1)
-
         if not max_distance:
             max_distance = self._base_vehicle_threshold
 
-        ego_transform = self._vehicle.get_transform()
+        if ego is not None:
+            ego_transform = ego.transform
+        else:
+            if self._perception:
+                self._perception.tick()
+            ego_transform = self._get_transform(self._vehicle)
         ego_location = ego_transform.location
-        ego_wpt = self._map.get_waypoint(ego_location)
+
+        # Get the transform of the front of the ego, from which the distances are measured.
+        # A new location is created, as moving 'ego_transform.location' would also move 'ego_location'
+        ego_forward_vector = ego_transform.get_forward_vector()
+        ego_extent = self._vehicle.bounding_box.extent.x
+        ego_front_location = carla.Location(
+            x=ego_location.x + ego_extent * ego_forward_vector.x,
+            y=ego_location.y + ego_extent * ego_forward_vector.y,
+            z=ego_location.z + ego_extent * ego_forward_vector.z)
+        ego_front_transform = carla.Transform(ego_front_location, ego_transform.rotation)
+
+        if vehicle_list is None:
+            if self._perception:
+                # Broad phase, using the neighbor index of the snapshot
+                vehicle_list = self._perception.vehicles_within(ego_front_location, max_distance)
+            else:
+                self._actor_registry.update()
+                vehicle_list = self._actor_registry.vehicles
+        if len(vehicle_list) == 0:
+            return ObstacleDetectionResult(False, None, -1)
+
+        ego_wpt = ego.waypoint if ego is not None else self._get_waypoint(self._vehicle, location=ego_location)
 
         # Get the right offset
         if ego_wpt.lane_id < 0 and lane_offset != 0:
             lane_offset *= -1
 
-        # Get the transform of the front of the ego
-        ego_front_transform = ego_transform
-        ego_front_transform.location += carla.Location(
-            self._vehicle.bounding_box.extent.x * ego_transform.get_forward_vector())
-
         opposite_invasion = abs(self._offset) + self._vehicle.bounding_box.extent.y > ego_wpt.lane_width / 2
         use_bbs = self._use_bbs_detection or opposite_invasion or ego_wpt.is_junction
 
-        # Get the route bounding box
-        route_polygon = get_route_polygon()
+        # Get the area swept by the route. Without plan waypoints there is nothing to check
+        has_route_corridor = self._route_corridor.update(
+            ego_front_transform, max_distance, self._vehicle.bounding_box.extent.y, self._offset)
 
         for target_vehicle in vehicle_list:
             if target_vehicle.id == self._vehicle.id:
                 continue
 
-            target_transform = target_vehicle.get_transform()
-            if target_transform.location.distance(ego_location) > max_distance:
+            target_transform = self._get_transform(target_vehicle)
+            if target_transform.location.distance(ego_front_location) > max_distance:
                 continue
 
-            target_wpt = self._map.get_waypoint(target_transform.location, lane_type=carla.LaneType.Any)
+            target_wpt = self._get_waypoint(target_vehicle, carla.LaneType.Any, target_transform.location)
 
             # General approach for junctions and vehicles invading other lanes due to the offset
-            if (use_bbs or target_wpt.is_junction) and route_polygon:
-
-                target_bb = target_vehicle.bounding_box
-                target_vertices = target_bb.get_world_vertices(target_vehicle.get_transform())
-                target_list = [[v.x, v.y, v.z] for v in target_vertices]
-                target_polygon = Polygon(target_list)
+            if (use_bbs or target_wpt.is_junction) and has_route_corridor:
 
-                if route_polygon.intersects(target_polygon):
-                    return ObstacleDetectionResult(True, target_vehicle, target_vehicle.get_location().distance(ego_location))
+                target_corners = actor_box_corners([target_vehicle], [target_transform])
+                if self._route_corridor.intersects(target_corners)[0]:
+                    return ObstacleDetectionResult(
+                        True, target_vehicle, target_transform.location.distance(ego_front_location))
 
             # Simplified approach, using only the plan waypoints (similar to TM)
             else:
@@ -415,19 +450,45 @@ class BasicAgent:
                     if target_wpt.road_id != next_wpt.road_id or target_wpt.lane_id != next_wpt.lane_id  + lane_offset:
                         continue
 
+                target_location = target_transform.location
                 target_forward_vector = target_transform.get_forward_vector()
                 target_extent = target_vehicle.bounding_box.extent.x
-                target_rear_transform = target_transform
-                target_rear_transform.location -= carla.Location(
-                    x=target_extent * target_forward_vector.x,
-                    y=target_extent * target_forward_vector.y,
-                )
+                target_rear_location = carla.Location(
+                    x=target_location.x - target_extent * target_forward_vector.x,
+                    y=target_location.y - target_extent * target_forward_vector.y,
+                    z=target_location.z)
+                target_rear_transform = carla.Transform(target_rear_location, target_transform.rotation)
 
-                if is_within_distance(target_rear_transform, ego_front_transform, max_distance, [low_angle_th, up_angle_th]):
-                    return ObstacleDetectionResult(True, target_vehicle, target_transform.location.distance(ego_transform.location))
+                if is_within_distance(target_rear_transform, ego_front_transform, max_distance,
+                                      [low_angle_th, up_angle_th]):
+                    return ObstacleDetectionResult(
+                        True, target_vehicle, target_rear_location.distance(ego_front_location))
 
         return ObstacleDetectionResult(False, None, -1)
 
+    def _get_transform(self, actor):
+        """Returns the transform of an actor, from the snapshot if the perception is enabled"""
+        if self._perception:
+            return self._perception.get_transform(actor)
+        return actor.get_transform()
+
+    def _get_velocity(self, actor):
+        """Returns the velocity of an actor, from the snapshot if the perception is enabled"""
+        if self._perception:
+            return self._perception.get_velocity(actor)
+        return actor.get_velocity()
+
+    def _get_waypoint(self, actor, lane_type=carla.LaneType.Driving, location=None):
+        """
+        Returns the waypoint of an actor, from the shared per tick cache if the perception is enabled.
+        Otherwise, it is computed from the given location, or the actor's one if None
+        """
+        if self._perception:
+            return self._perception.get_waypoint(actor, lane_type)
+        if location is None:
+            location = actor.get_location()
+        return self._map.get_waypoint(location, lane_type=lane_type)
+
     @staticmethod
     def _generate_lane_change_path(waypoint, direction='left', distance_same_lane=10,
                                 distance_other_lane=25, lane_change_distance=25,
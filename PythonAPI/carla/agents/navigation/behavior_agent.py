@@ -14,6 +14,7 @@ from agents.navigation.basic_agent import BasicAgent
 from agents.navigation.local_planner import RoadOption
 from agents.navigation.behavior_types import Cautious, Aggressive, Normal
 
+from agents.tools.ego_context import EgoContext
 from agents.tools.misc import get_speed, positive
 
 class BehaviorAgent(BasicAgent):
@@ -64,9 +65,13 @@ class BehaviorAgent(BasicAgent):
         """
         This method updates the information regarding the ego
         vehicle based on the surrounding world.
+
+            :return ego: EgoContext with the state of the vehicle in this step
         """
-        self._speed = get_speed(self._vehicle)
-        self._speed_limit = self._vehicle.get_speed_limit()
+        ego = self._ego_context()
+
+        self._speed = ego.speed
+        self._speed_limit = ego.speed_limit
         self._local_planner.set_speed(self._speed_limit)
         self._direction = self._local_planner.target_road_option
         if self._direction is None:
@@ -79,24 +84,51 @@ class BehaviorAgent(BasicAgent):
         if self._incoming_direction is None:
             self._incoming_direction = RoadOption.LANEFOLLOW
 
-    def traffic_light_manager(self):
+        ego.direction = self._direction
+        ego.incoming_waypoint = self._incoming_waypoint
+        ego.incoming_direction = self._incoming_direction
+        return ego
+
+    def _ego_context(self, waypoint=None):
+        """
+        Updates the actors of the world and retrieves the state of the vehicle into an EgoContext. Outside of
+        run_step, the directions are the ones of the last call to _update_information.
+
+            :param waypoint: carla.Waypoint of the vehicle. If None, the one at its location
+            :return ego: EgoContext with the current state of the vehicle
+        """
+        self._actor_registry.update()
+        if self._perception:
+            self._perception.tick()
+        transform = self._get_transform(self._vehicle)
+        if waypoint is None:
+            waypoint = self._get_waypoint(self._vehicle, location=transform.location)
+        ego = EgoContext(
+            self._vehicle, transform, self._get_velocity(self._vehicle), waypoint,
+            self._vehicle.get_speed_limit(), self._actor_registry, self._perception)
+        ego.direction = self._direction
+        ego.incoming_waypoint = self._incoming_waypoint
+        ego.incoming_direction = self._incoming_direction
+        return ego
+
+    def traffic_light_manager(self, ego=None):
         """
         This method is in charge of behaviors for red lights.
+
+            :param ego: EgoContext of this step. If None, the state of the vehicle is retrieved
         """
-        actor_list = self._world.get_actors()
-        lights_list = actor_list.filter("*traffic_light*")
-        affected, _ = self._affected_by_traffic_light(lights_list)
+        affected, _ = self._affected_by_traffic_light(ego=ego)
 
         return affected
 
-    def _tailgating(self, waypoint, vehicle_list):
+    def _tailgating(self, ego, vehicle_list):
         """
         This method is in charge of tailgating behaviors.
 
-            :param location: current location of the agent
-            :param waypoint: current waypoint of the agent
+            :param ego: EgoContext of this step
             :param vehicle_list: list of all the nearby vehicles
         """
+        waypoint = ego.waypoint
 
         left_turn = waypoint.left_lane_marking.lane_change
         right_turn = waypoint.right_lane_marking.lane_change
@@ -105,12 +137,13 @@ class BehaviorAgent(BasicAgent):
         right_wpt = waypoint.get_right_lane()
 
         behind_vehicle_state, behind_vehicle, _ = self._vehicle_obstacle_detected(vehicle_list, max(
-            self._behavior.min_proximity_threshold, self._speed_limit / 2), up_angle_th=180, low_angle_th=160)
+            self._behavior.min_proximity_threshold, self._speed_limit / 2), up_angle_th=180, low_angle_th=160, ego=ego)
         if behind_vehicle_state and self._speed < get_speed(behind_vehicle):
             if (right_turn == carla.LaneChange.Right or right_turn ==
                     carla.LaneChange.Both) and waypoint.lane_id * right_wpt.lane_id > 0 and right_wpt.lane_type == carla.LaneType.Driving:
                 new_vehicle_state, _, _ = self._vehicle_obstacle_detected(vehicle_list, max(
-                    self._behavior.min_proximity_threshold, self._speed_limit / 2), up_angle_th=180, lane_offset=1)
+                    self._behavior.min_proximity_threshold, self._speed_limit / 2), up_angle_th=180, lane_offset=1,
+                    ego=ego)
                 if not new_vehicle_state:
                     print("Tailgating, moving to the right!")
                     end_waypoint = self._local_planner.target_waypoint
@@ -119,7 +152,8 @@ class BehaviorAgent(BasicAgent):
                                          right_wpt.transform.location)
             elif left_turn == carla.LaneChange.Left and waypoint.lane_id * left_wpt.lane_id > 0 and left_wpt.lane_type == carla.LaneType.Driving:
                 new_vehicle_state, _, _ = self._vehicle_obstacle_detected(vehicle_list, max(
-                    self._behavior.min_proximity_threshold, self._speed_limit / 2), up_angle_th=180, lane_offset=-1)
+                    self._behavior.min_proximity_threshold, self._speed_limit / 2), up_angle_th=180, lane_offset=-1,
+                    ego=ego)
                 if not new_vehicle_state:
                     print("Tailgating, moving to the left!")
                     end_waypoint = self._local_planner.target_waypoint
@@ -127,68 +161,72 @@ class BehaviorAgent(BasicAgent):
                     self.set_destination(end_waypoint.transform.location,
                                          left_wpt.transform.location)
 
-    def collision_and_car_avoid_manager(self, waypoint):
+    def collision_and_car_avoid_manager(self, ego=None):
         """
         This module is in charge of warning in case of a collision
         and managing possible tailgating chances.
 
-            :param location: current location of the agent
-            :param waypoint: current waypoint of the agent
+            :param ego: EgoContext of this step. If None, or a carla.Waypoint of the vehicle as in
+                previous versions, the state of the vehicle is retrieved
             :return vehicle_state: True if there is a vehicle nearby, False if not
             :return vehicle: nearby vehicle
             :return distance: distance to nearby vehicle
         """
 
-        vehicle_list = self._world.get_actors().filter("*vehicle*")
-        def dist(v): return v.get_location().distance(waypoint.transform.location)
-        vehicle_list = [v for v in vehicle_list if dist(v) < 45 and v.id != self._vehicle.id]
+        if not isinstance(ego, EgoContext):
+            ego = self._ego_context(waypoint=ego)
+
+        vehicle_list = ego.vehicles_within(45)
 
         if self._direction == RoadOption.CHANGELANELEFT:
             vehicle_state, vehicle, distance = self._vehicle_obstacle_detected(
                 vehicle_list, max(
-                    self._behavior.min_proximity_threshold, self._speed_limit / 2), up_angle_th=180, lane_offset=-1)
+                    self._behavior.min_proximity_threshold, self._speed_limit / 2), up_angle_th=180, lane_offset=-1,
+                ego=ego)
         elif self._direction == RoadOption.CHANGELANERIGHT:
             vehicle_state, vehicle, distance = self._vehicle_obstacle_detected(
                 vehicle_list, max(
-                    self._behavior.min_proximity_threshold, self._speed_limit / 2), up_angle_th=180, lane_offset=1)
+                    self._behavior.min_proximity_threshold, self._speed_limit / 2), up_angle_th=180, lane_offset=1,
+                ego=ego)
         else:
             vehicle_state, vehicle, distance = self._vehicle_obstacle_detected(
                 vehicle_list, max(
-                    self._behavior.min_proximity_threshold, self._speed_limit / 3), up_angle_th=30)
+                    self._behavior.min_proximity_threshold, self._speed_limit / 3), up_angle_th=30, ego=ego)
 
             # Check for tailgating
             if not vehicle_state and self._direction == RoadOption.LANEFOLLOW \
-                    and not waypoint.is_junction and self._speed > 10 \
+                    and not ego.waypoint.is_junction and self._speed > 10 \
                     and self._behavior.tailgate_counter == 0:
-                self._tailgating(waypoint, vehicle_list)
+                self._tailgating(ego, vehicle_list)
 
         return vehicle_state, vehicle, distance
 
-    def pedestrian_avoid_manager(self, waypoint):
+    def pedestrian_avoid_manager(self, ego=None):
         """
         This module is in charge of warning in case of a collision
         with any pedestrian.
 
-            :param location: current location of the agent
-            :param waypoint: current waypoint of the agent
+            :param ego: EgoContext of this step. If None, or a carla.Waypoint of the vehicle as in
+                previous versions, the state of the vehicle is retrieved
             :return vehicle_state: True if there is a walker nearby, False if not
             :return vehicle: nearby walker
             :return distance: distance to nearby walker
         """
 
-        walker_list = self._world.get_actors().filter("*walker.pedestrian*")
-        def dist(w): return w.get_location().distance(waypoint.transform.location)
-        walker_list = [w for w in walker_list if dist(w) < 10]
+        if not isinstance(ego, EgoContext):
+            ego = self._ego_context(waypoint=ego)
+
+        walker_list = ego.walkers_within(10)
 
         if self._direction == RoadOption.CHANGELANELEFT:
             walker_state, walker, distance = self._vehicle_obstacle_detected(walker_list, max(
-                self._behavior.min_proximity_threshold, self._speed_limit / 2), up_angle_th=90, lane_offset=-1)
+                self._behavior.min_proximity_threshold, self._speed_limit / 2), up_angle_th=90, lane_offset=-1, ego=ego)
         elif self._direction == RoadOption.CHANGELANERIGHT:
             walker_state, walker, distance = self._vehicle_obstacle_detected(walker_list, max(
-                self._behavior.min_proximity_threshold, self._speed_limit / 2), up_angle_th=90, lane_offset=1)
+                self._behavior.min_proximity_threshold, self._speed_limit / 2), up_angle_th=90, lane_offset=1, ego=ego)
         else:
             walker_state, walker, distance = self._vehicle_obstacle_detected(walker_list, max(
-                self._behavior.min_proximity_threshold, self._speed_limit / 3), up_angle_th=60)
+                self._behavior.min_proximity_threshold, self._speed_limit / 3), up_angle_th=60, ego=ego)
 
         return walker_state, walker, distance
 
@@ -242,21 +280,18 @@ class BehaviorAgent(BasicAgent):
             :param debug: boolean for debugging
             :return control: carla.VehicleControl
         """
-        self._update_information()
+        ego = self._update_information()
 
         control = None
         if self._behavior.tailgate_counter > 0:
             self._behavior.tailgate_counter -= 1
 
-        ego_vehicle_loc = self._vehicle.get_location()
-        ego_vehicle_wp = self._map.get_waypoint(ego_vehicle_loc)
-
         # 1: Red lights and stops behavior
-        if self.traffic_light_manager():
+        if self.traffic_light_manager(ego):
             return self.emergency_stop()
 
         # 2.1: Pedestrian avoidance behaviors
-        walker_state, walker, w_distance = self.pedestrian_avoid_manager(ego_vehicle_wp)
+        walker_state, walker, w_distance = self.pedestrian_avoid_manager(ego)
 
         if walker_state:
             # Distance is computed from the center of the two cars,
@@ -270,7 +305,7 @@ class BehaviorAgent(BasicAgent):
                 return self.emergency_stop()
 
         # 2.2: Car following behaviors
-        vehicle_state, vehicle, distance = self.collision_and_car_avoid_manager(ego_vehicle_wp)
+        vehicle_state, vehicle, distance = self.collision_and_car_avoid_manager(ego)
 
         if vehicle_state:
             # Distance is computed from the center of the two cars,
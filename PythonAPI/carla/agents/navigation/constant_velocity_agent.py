@@ -85,9 +85,8 @@ class ConstantVelocityAgent(BasicAgent):
         hazard_detected = False
 
         # Retrieve all relevant actors
-        actor_list = self._world.get_actors()
-        vehicle_list = actor_list.filter("*vehicle*")
-        lights_list = actor_list.filter("*traffic_light*")
+        self._actor_registry.update()
+        vehicle_list = self._actor_registry.vehicles
 
         vehicle_speed = self._vehicle.get_velocity().length()
 
@@ -103,7 +102,7 @@ class ConstantVelocityAgent(BasicAgent):
 
         # Check if the vehicle is affected by a red traffic light
         max_tlight_distance = self._base_tlight_threshold + 0.3 * vehicle_speed
-        affected_by_tlight, _ = self._affected_by_traffic_light(lights_list, max_tlight_distance)
+        affected_by_tlight, _ = self._affected_by_traffic_light(max_distance=max_tlight_distance)
         if affected_by_tlight:
             hazard_speed = 0
             hazard_detected = True
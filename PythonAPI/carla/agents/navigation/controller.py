@@ -264,3 +264,200 @@ class PIDLateralController:
         self._k_i = K_I
         self._k_d = K_D
         self._dt = dt
+
+
+class FleetPIDController:
+    """
+    FleetPIDController performs the same lateral and longitudinal PID control than
+    VehiclePIDController, but for a whole fleet of vehicles at once. The state of all the
+    vehicles is read from a single world snapshot, the error buffers are (N, 10) arrays and
+    the PID equations are evaluated for all the vehicles with vectorized operations. The
+    resulting controls are applied in a single batch of commands.
+
+    All the vehicles share the PID parameters and the control limits, but each has its own offset.
+    """
+
+    _BUFFER_SIZE = 10
+
+    def __init__(self, client, args_lateral, args_longitudinal, max_throttle=0.75, max_brake=0.3,
+                 max_steering=0.8):
+        """
+        Constructor method.
+
+        :param client: carla.Client used to get the world snapshots and to apply the controls
+        :param args_lateral: dictionary of arguments to set the lateral PID controller
+        using the following semantics:
+            K_P -- Proportional term
+            K_D -- Differential term
+            K_I -- Integral term
+            dt -- time differential in seconds
+        :param args_longitudinal: dictionary of arguments to set the longitudinal
+        PID controller, with the same semantics as args_lateral
+        """
+        self.max_brake = max_brake
+        self.max_throt = max_throttle
+        self.max_steer = max_steering
+
+        self._client = client
+        self._world = client.get_world()
+        self._lat_params = (0.0, 0.0, 0.0, 0.03)
+        self._lon_params = (0.0, 0.0, 0.0, 0.03)
+        self.change_lateral_PID(args_lateral)
+        self.change_longitudinal_PID(args_longitudinal)
+
+        self._actor_ids = []  # type: list[int]
+        self._offsets = np.zeros(0)
+        self._past_steering = np.zeros(0)
+        self._lon_errors = np.zeros((0, self._BUFFER_SIZE))
+        self._lat_errors = np.zeros((0, self._BUFFER_SIZE))
+        self._num_errors = np.zeros(0, dtype=np.int64)
+        self._cursor = 0  # Column of the error buffers written by the next step
+
+    @property
+    def actor_ids(self):
+        """Ids of the controlled vehicles, in the order expected by `run_step`"""
+        return list(self._actor_ids)
+
+    def add_vehicle(self, vehicle, offset=0):
+        """
+        Adds a vehicle to the fleet, with empty error buffers.
+
+            :param vehicle: carla.Vehicle to control
+            :param offset: If different than zero, the vehicle will drive displaced from the center line.
+                Positive values imply a right offset while negative ones mean a left one.
+        """
+        self._actor_ids.append(vehicle.id)
+        self._offsets = np.append(self._offsets, offset)
+        self._past_steering = np.append(self._past_steering, vehicle.get_control().steer)
+        self._lon_errors = np.vstack((self._lon_errors, np.zeros(self._BUFFER_SIZE)))
+        self._lat_errors = np.vstack((self._lat_errors, np.zeros(self._BUFFER_SIZE)))
+        self._num_errors = np.append(self._num_errors, 0)
+
+    def remove_vehicle(self, actor_id):
+        """Removes a vehicle, given its id, from the fleet"""
+        index = self._actor_ids.index(actor_id)
+        del self._actor_ids[index]
+        self._offsets = np.delete(self._offsets, index)
+        self._past_steering = np.delete(self._past_steering, index)
+        self._lon_errors = np.delete(self._lon_errors, index, axis=0)
+        self._lat_errors = np.delete(self._lat_errors, index, axis=0)
+        self._num_errors = np.delete(self._num_errors, index)
+
+    def set_offset(self, actor_id, offset):
+        """Changes the offset of a vehicle"""
+        self._offsets[self._actor_ids.index(actor_id)] = offset
+
+    def change_longitudinal_PID(self, args_longitudinal):
+        """Changes the parameters of the longitudinal PID"""
+        self._lon_params = _pid_parameters(args_longitudinal)
+
+    def change_lateral_PID(self, args_lateral):
+        """Changes the parameters of the lateral PID"""
+        self._lat_params = _pid_parameters(args_lateral)
+
+    def run_step(self, target_speeds, waypoints, snapshot=None, apply=True):
+        """
+        Execute one step of control of all the vehicles of the fleet.
+
+            :param target_speeds: desired speed of the vehicles in Km/h, either a single value
+                or one per vehicle, in the order of `actor_ids`
+            :param waypoints: target waypoint of each vehicle, in the order of `actor_ids`
+            :param snapshot: carla.WorldSnapshot with the current state of the vehicles.
+                If None, the one of the last tick is retrieved from the world
+            :param apply: whether or not to apply the controls with a batch of commands
+            :return: list with the carla.VehicleControl of each vehicle, or None for the
+                vehicles missing from the snapshot, which aren't controlled
+        """
+        if snapshot is None:
+            snapshot = self._world.get_snapshot()
+        num_vehicles = len(self._actor_ids)
+        if len(waypoints) != num_vehicles:
+            raise ValueError("Expected {} waypoints, got {}".format(num_vehicles, len(waypoints)))
+
+        # Read the state of the vehicles and their targets
+        state = np.zeros((num_vehicles, 7))  # x, y, yaw, pitch, vx, vy, vz
+        target = np.zeros((num_vehicles, 5))  # x, y, yaw, pitch, roll
+        found = np.zeros(num_vehicles, dtype=bool)
+        for i, (actor_id, waypoint) in enumerate(zip(self._actor_ids, waypoints)):
+            actor_snapshot = snapshot.find(actor_id)
+            if actor_snapshot is None:
+                continue
+            found[i] = True
+            transform = actor_snapshot.get_transform()
+            velocity = actor_snapshot.get_velocity()
+            w_tran = waypoint.transform
+            state[i] = (transform.location.x, transform.location.y, transform.rotation.yaw,
+                        transform.rotation.pitch, velocity.x, velocity.y, velocity.z)
+            target[i] = (w_tran.location.x, w_tran.location.y, w_tran.rotation.yaw,
+                         w_tran.rotation.pitch, w_tran.rotation.roll)
+
+        column, previous = self._cursor, (self._cursor - 1) % self._BUFFER_SIZE
+        self._cursor = (self._cursor + 1) % self._BUFFER_SIZE
+        self._num_errors = np.minimum(self._num_errors + 1, self._BUFFER_SIZE)
+
+        # Longitudinal control
+        speeds = 3.6 * np.linalg.norm(state[:, 4:7], axis=1)
+        self._lon_errors[:, column] = np.asarray(target_speeds, dtype=np.float64) - speeds
+        acceleration = self._pid_control(self._lon_errors, self._lon_params, column, previous)
+
+        # Lateral control, with the target displaced to the side by the offset
+        yaw, pitch = np.radians(state[:, 2]), np.radians(state[:, 3])
+        v_vec = np.stack((np.cos(yaw) * np.cos(pitch), np.sin(yaw) * np.cos(pitch)), axis=1)
+        w_yaw, w_pitch, w_roll = np.radians(target[:, 2]), np.radians(target[:, 3]), np.radians(target[:, 4])
+        right_x = np.cos(w_yaw) * np.sin(w_pitch) * np.sin(w_roll) - np.sin(w_yaw) * np.cos(w_roll)
+        right_y = np.sin(w_yaw) * np.sin(w_pitch) * np.sin(w_roll) + np.cos(w_yaw) * np.cos(w_roll)
+        w_vec = np.stack((target[:, 0] + self._offsets * right_x - state[:, 0],
+                          target[:, 1] + self._offsets * right_y - state[:, 1]), axis=1)
+
+        wv_linalg = np.linalg.norm(w_vec, axis=1) * np.linalg.norm(v_vec, axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cosine = np.clip(np.sum(w_vec * v_vec, axis=1) / wv_linalg, -1.0, 1.0)
+        _dot = np.where(wv_linalg == 0, 1.0, np.arccos(np.where(wv_linalg == 0, 1.0, cosine)))
+        _cross = v_vec[:, 0] * w_vec[:, 1] - v_vec[:, 1] * w_vec[:, 0]
+        _dot = np.where(_cross < 0, -_dot, _dot)
+        self._lat_errors[:, column] = _dot
+        steering = self._pid_control(self._lat_errors, self._lat_params, column, previous)
+
+        # Steering regulation: changes cannot happen abruptly, can't steer too much.
+        steering = np.clip(steering, self._past_steering - 0.1, self._past_steering + 0.1)
+        steering = np.clip(steering, -self.max_steer, self.max_steer)
+        self._past_steering = np.where(found, steering, self._past_steering)
+
+        # Vehicles missing from the snapshot start over with empty buffers
+        self._lon_errors[~found] = 0.0
+        self._lat_errors[~found] = 0.0
+        self._num_errors[~found] = 0
+
+        throttle = np.where(acceleration >= 0.0, np.minimum(acceleration, self.max_throt), 0.0)
+        brake = np.where(acceleration >= 0.0, 0.0, np.minimum(np.abs(acceleration), self.max_brake))
+
+        controls = []
+        batch = []
+        for i, actor_id in enumerate(self._actor_ids):
+            if not found[i]:
+                controls.append(None)
+                continue
+            control = carla.VehicleControl(throttle=float(throttle[i]), steer=float(steering[i]),
+                                           brake=float(brake[i]), hand_brake=False, manual_gear_shift=False)
+            controls.append(control)
+            batch.append(carla.command.ApplyVehicleControl(actor_id, control))
+
+        if apply and batch:
+            self._client.apply_batch(batch)
+        return controls
+
+    def _pid_control(self, errors, parameters, column, previous):
+        """
+        Evaluates the PID equations for all the vehicles, given their (N, 10) error buffers.
+        Vehicles with less than two errors in their buffer only use the proportional term.
+        """
+        k_p, k_i, k_d, dt = parameters
+        enough = self._num_errors >= 2
+        _de = np.where(enough, (errors[:, column] - errors[:, previous]) / dt, 0.0)
+        _ie = np.where(enough, errors.sum(axis=1) * dt, 0.0)
+        return np.clip((k_p * errors[:, column]) + (k_d * _de) + (k_i * _ie), -1.0, 1.0)
+
+
+def _pid_parameters(args):
+    """Returns the (K_P, K_I, K_D, dt) tuple of a dictionary of PID arguments"""
+    return (args.get('K_P', 1.0), args.get('K_I', 0.0), args.get('K_D', 0.0), args.get('dt', 0.03))
@@ -8,12 +8,18 @@
 This module provides GlobalRoutePlanner implementation.
 """
 
+import hashlib
 import math
+import multiprocessing
+import os
+import pickle
 import numpy as np
 import networkx as nx
 
 import carla
 from agents.navigation.local_planner import RoadOption
+from agents.navigation.path_search import PATH_SEARCH_BACKENDS, PathSearch
+from agents.tools.spatial_index import GridIndex
 
 # Python 2 compatibility
 TYPE_CHECKING = False
@@ -39,9 +45,11 @@ if TYPE_CHECKING:
     EdgeDict = TypedDict('EdgeDict',
         {
             'length': int,
-            'path': list[carla.Waypoint],
-            'entry_waypoint': carla.Waypoint,
-            'exit_waypoint': carla.Waypoint,
+            'edge_id': int,
+            # The waypoint attributes are dropped by compact planners
+            'path': NotRequired[list[carla.Waypoint]],
+            'entry_waypoint': NotRequired[carla.Waypoint],
+            'exit_waypoint': NotRequired[carla.Waypoint],
             'entry_vector': np.ndarray,
             'exit_vector': np.ndarray,
             'net_vector': list[float],
@@ -50,28 +58,114 @@ if TYPE_CHECKING:
             'change_waypoint': NotRequired[carla.Waypoint]
         })
 
+# Bump whenever the layout of the serialized graph changes, so stale caches are ignored
+_GRAPH_CACHE_VERSION = 3
+_GRAPH_CACHE_KEYS = ('point_xyz', 'point_yaw', 'point_lane', 'point_s', 'edge_bounds', 'edge_has_change',
+                     'nodes', 'edges', 'id_map', 'road_id_to_edge')
+
 class GlobalRoutePlanner:
     """
     This class provides a very high level route plan.
+
+    Besides the networkx graph, the geometry of every edge (its entry waypoint, the path
+    and its exit waypoint) is kept in contiguous NumPy arrays of "graph points", and each
+    edge stores the slice of points that belongs to it. Route tracing works on these arrays,
+    and only the points that end up in the route are turned into carla.Waypoint objects.
     """
 
-    def __init__(self, wmap, sampling_resolution):
-        # type: (carla.Map, float) -> None
+    def __init__(self, wmap, sampling_resolution, cache_dir=None, compact=False, localization_tolerance=None,
+                 path_search='astar'):
+        # type: (carla.Map, float, str | None, bool, float | None, str | PathSearch) -> None
+        """
+        :param wmap: carla.Map instance used to build the road graph
+        :param sampling_resolution: distance between the waypoints of the graph edges
+        :param cache_dir: if given, the road graph is stored in (and loaded from) this folder,
+            keyed by the OpenDRIVE content of the map and the sampling resolution
+        :param compact: if True, the edges don't keep any carla.Waypoint. Their geometry only
+            lives in the point arrays and waypoints are recreated when a route is traced.
+            This greatly reduces the memory used by big maps.
+        :param localization_tolerance: if given, locations are localized with a spatial index over
+            the graph points instead of with carla.Map.get_waypoint, as long as the closest point is
+            within this distance (in meters) and no point of another lane is within this distance
+            of the closest one. Otherwise, it falls back to carla.Map.get_waypoint.
+        :param path_search: shortest path engine, either one of the names of
+            agents.navigation.path_search.PATH_SEARCH_BACKENDS or a PathSearch instance.
+            See `set_path_search`.
+        """
         self._sampling_resolution = sampling_resolution
         self._wmap = wmap
+        self._compact = compact
         self._topology = []    # type: list[TopologyDict]
         self._graph = None     # type: nx.DiGraph # type: ignore[assignment]
         self._id_map = None    # type: dict[tuple[float, float, float], int] # type: ignore[assignment]
         self._road_id_to_edge = None  # type: dict[int, dict[int, dict[int, tuple[int, int]]]] # type: ignore[assignment]
 
+        # Geometry of the graph points, indexed by point id
+        self._point_xyz = None        # type: np.ndarray # (M, 3) float64 location
+        self._point_yaw = None        # type: np.ndarray # (M,) float32 yaw, in degrees
+        self._point_lane = None       # type: np.ndarray # (M, 3) int32 road, section and lane ids
+        self._point_s = None          # type: np.ndarray # (M,) float64 OpenDRIVE s coordinate
+        self._point_waypoints = None  # type: list[carla.Waypoint] | None # only when not compact
+        # Slice [start, stop) of the graph points belonging to each edge, indexed by edge id
+        self._edge_bounds = None      # type: np.ndarray # (E, 2) int64
+        # Whether each edge is a lane change, whose exit waypoint is its 'change_waypoint', indexed by edge id
+        self._edge_has_change = None  # type: np.ndarray # (E,) bool
+        self._point_index = None      # type: GridIndex | None # built on first use
+
+        self._localization_tolerance = localization_tolerance
+        self._path_searcher = None    # type: PathSearch # type: ignore[assignment]
+
         self._intersection_end_node = -1
         self._previous_decision = RoadOption.VOID
 
-        # Build the graph
-        self._build_topology()
-        self._build_graph()
-        self._find_loose_ends()
-        self._lane_change_link()
+        # Build the graph, unless a previous execution already cached it
+        cache_path = self._graph_cache_path(cache_dir) if cache_dir else None
+        if cache_path is None or not self._load_graph_cache(cache_path):
+            self._build_topology()
+            self._build_graph()
+            self._find_loose_ends()
+            self._lane_change_link()
+            self._build_edge_arrays()
+            if cache_path is not None:
+                self._save_graph_cache(cache_path)
+
+        self.set_path_search(path_search)
+
+    def set_path_search(self, path_search, **kwargs):
+        # type: (str | PathSearch, ...) -> None
+        """
+        Changes the engine used to find the shortest path between graph nodes.
+
+            :param path_search: either a PathSearch instance or the name of one of the engines:
+                'astar' (default), 'bidirectional_dijkstra', 'contraction_hierarchies' or 'alt'.
+                The last two precompute data from the graph, which takes a while on big maps.
+            :param kwargs: extra parameters of the engine, when given by name
+        """
+        if isinstance(path_search, PathSearch):
+            self._path_searcher = path_search
+        elif path_search in PATH_SEARCH_BACKENDS:
+            self._path_searcher = PATH_SEARCH_BACKENDS[path_search](self._graph, **kwargs)
+        else:
+            raise ValueError("Unknown path search '{}', expected one of {}".format(
+                path_search, sorted(PATH_SEARCH_BACKENDS)))
+
+    def get_path_search(self):
+        # type: () -> PathSearch
+        """Returns the engine used to find the shortest path between graph nodes"""
+        return self._path_searcher
+
+    def get_graph(self):
+        # type: () -> nx.DiGraph
+        """Returns the road graph, whose edges have a 'length' attribute"""
+        return self._graph
+
+    def localize(self, location):
+        # type: (carla.Location) -> None | tuple[int, int]
+        """
+        Returns the (entry node, exit node) of the graph edge of the road segment
+        the location is part of, or None if it isn't part of any
+        """
+        return self._localize(location)
 
     def trace_route(self, origin, destination):
         # type: (carla.Location, carla.Location) -> list[tuple[carla.Waypoint, RoadOption]]
@@ -79,46 +173,199 @@ class GlobalRoutePlanner:
         This method returns list of (carla.Waypoint, RoadOption)
         from origin to destination
         """
-        route_trace = []  # type: list[tuple[carla.Waypoint, RoadOption]]
-        route = self._path_search(origin, destination)
-        current_waypoint = self._wmap.get_waypoint(origin)
-        destination_waypoint = self._wmap.get_waypoint(destination)
+        start, origin_item, origin_xyz, _ = self._localize_endpoint(origin)
+        end, _, destination_wp_xyz, destination_lane = self._localize_endpoint(destination)
+        route = self._shortest_route(start[0], end)
+
+        point_trace = self._trace_route_points(
+            route, origin_xyz, _location_to_xyz(destination), destination_wp_xyz, destination_lane)
+        return self._points_to_route_trace(point_trace, origin_item)
+
+    def trace_routes(self,
+                     pairs,  # type: list[tuple[carla.Location, carla.Location]]
+                     processes=None  # type: int | None
+                     ):
+        # type: (...) -> list[list[tuple[carla.Waypoint, RoadOption]]]
+        """
+        Batch version of `trace_route`. Returns the route trace of every (origin, destination)
+        pair, in the same order as the input.
+
+        All the endpoints are localized in a single pass, each distinct location only once.
+        Pairs going from the same graph node to the same edge share a single search, done
+        with the engine of `trace_route`, so both methods return the same routes.
+
+            :param pairs: list of (carla.Location, carla.Location) pairs
+            :param processes: if given, the searches are spread over a pool with this amount of
+                worker processes, all of them sharing a read-only copy of the graph
+        """
+        pairs = list(pairs)
+
+        # Localize every distinct endpoint once
+        localized = dict()  # type: dict[tuple[float, float, float], tuple]
+        for location in (location for pair in pairs for location in pair):
+            key = (location.x, location.y, location.z)
+            if key not in localized:
+                localized[key] = self._localize_endpoint(location)
+
+        # Group the pairs by the node their search starts from
+        groups = dict()  # type: dict[int, list[tuple]]
+        origin_items = []  # type: list[carla.Waypoint | int]
+        for index, (origin, destination) in enumerate(pairs):
+            start, origin_item, origin_xyz, _ = localized[(origin.x, origin.y, origin.z)]
+            end, _, destination_wp_xyz, destination_lane = localized[(destination.x, destination.y, destination.z)]
+            origin_items.append(origin_item)
+            groups.setdefault(start[0], []).append((
+                index, end, origin_xyz, _location_to_xyz(destination), destination_wp_xyz, destination_lane))
+
+        tasks = list(groups.items())
+        if processes:
+            pool = multiprocessing.Pool(processes, initializer=_init_trace_routes_worker,
+                                        initargs=(self._read_only_state(),))
+            try:
+                results = pool.map(_trace_routes_worker, tasks, chunksize=max(1, len(tasks) // (4 * processes)))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [self._trace_route_group(task) for task in tasks]
+
+        route_traces = [None] * len(pairs)  # type: list
+        for group_result in results:
+            for index, point_trace in group_result:
+                route_traces[index] = self._points_to_route_trace(point_trace, origin_items[index])
+        return route_traces
+
+    def _trace_route_group(self, task):
+        # type: (tuple[int, list[tuple]]) -> list[tuple[int, list[tuple[int, RoadOption]]]]
+        """
+        Traces all the routes starting at the same graph node, searching the route
+        to each distinct end edge only once.
+        """
+        source, requests = task
+        routes = dict()  # type: dict[tuple[int, int], list[int]]
+
+        results = []
+        for index, end, origin_xyz, destination_xyz, destination_wp_xyz, destination_lane in requests:
+            route = routes.get(end)
+            if route is None:
+                route = routes[end] = self._shortest_route(source, end)
+            point_trace = self._trace_route_points(
+                route, origin_xyz, destination_xyz, destination_wp_xyz, destination_lane)
+            results.append((index, point_trace))
+        return results
+
+    def _read_only_state(self):
+        # type: () -> dict
+        """
+        Returns the attributes needed to search and trace routes without the carla.Map,
+        stripped of every carla.Waypoint so it can be sent to worker processes
+        """
+        graph = self._graph
+        if not self._compact:
+            graph = nx.DiGraph()
+            graph.add_nodes_from(self._graph.nodes(data=True))
+            for n1, n2, data in self._graph.edges(data=True):
+                graph.add_edge(n1, n2, **{name: value for name, value in data.items() if name not in
+                                          ('path', 'entry_waypoint', 'exit_waypoint', 'change_waypoint')})
+        return {
+            '_sampling_resolution': self._sampling_resolution,
+            '_graph': graph,
+            '_road_id_to_edge': self._road_id_to_edge,
+            '_point_xyz': self._point_xyz,
+            '_point_lane': self._point_lane,
+            '_edge_bounds': self._edge_bounds,
+            '_path_searcher': self._path_searcher,
+        }
+
+    def _points_to_route_trace(self, point_trace, origin):
+        # type: (list[tuple[int, RoadOption]], carla.Waypoint | int) -> list[tuple[carla.Waypoint, RoadOption]]
+        """
+        Turns a route trace of graph point ids into one of carla.Waypoint.
+        The origin is either its waypoint or, if it was localized locally, its graph point id.
+        """
+        if not isinstance(origin, carla.Waypoint):
+            origin = self._point_to_waypoint(origin)
+        return [(origin if point < 0 else self._point_to_waypoint(point), road_option)
+                for point, road_option in point_trace]
+
+    def _trace_route_points(self, route, origin_xyz, destination_xyz, destination_wp_xyz, destination_lane):
+        # type: (list[int], np.ndarray, np.ndarray, np.ndarray, tuple[int, int, int]) -> list[tuple[int, RoadOption]]
+        """
+        Computes the route trace as a list of (point id, RoadOption). The point id -1
+        stands for the origin waypoint, which isn't part of the graph. It only uses
+        the graph and its point arrays, so it can also run on worker processes.
+
+            :param route: list of graph nodes of the route
+            :param origin_xyz: location of the origin waypoint
+            :param destination_xyz: destination location
+            :param destination_wp_xyz: location of the destination waypoint
+            :param destination_lane: (road_id, section_id, lane_id) of the destination waypoint
+        """
+        # The turn decisions of a route must not depend on the previously traced ones
+        self._intersection_end_node = -1
+        self._previous_decision = RoadOption.VOID
+
+        route_trace = []  # type: list[tuple[int, RoadOption]]
+        current_point = -1
+        current_xyz = origin_xyz
 
         for i in range(len(route) - 1):
             road_option = self._turn_decision(i, route)
             edge = self._graph.edges[route[i], route[i + 1]]  # type: EdgeDict
-            path = []  # type: list[carla.Waypoint]
+            start, stop = self._edge_bounds[edge['edge_id']].tolist()
 
             if edge['type'] != RoadOption.LANEFOLLOW and edge['type'] != RoadOption.VOID:
-                route_trace.append((current_waypoint, road_option))
-                exit_wp = edge['exit_waypoint']
-                n1, n2 = self._road_id_to_edge[exit_wp.road_id][exit_wp.section_id][exit_wp.lane_id]
+                route_trace.append((current_point, road_option))
+                road_id, section_id, lane_id = self._point_lane[stop - 1].tolist()
+                n1, n2 = self._road_id_to_edge[road_id][section_id][lane_id]
                 next_edge = self._graph.edges[n1, n2]  # type: EdgeDict
-                if next_edge['path']:
-                    closest_index = self._find_closest_in_list(current_waypoint, next_edge['path'])
-                    closest_index = min(len(next_edge['path']) - 1, closest_index + 5)
-                    current_waypoint = next_edge['path'][closest_index]
+                next_start, next_stop = self._edge_bounds[next_edge['edge_id']].tolist()
+                # The path of an edge excludes its entry and exit points
+                if next_stop - next_start > 2:
+                    closest_index = self._find_closest_point(current_xyz, next_start + 1, next_stop - 1)
+                    closest_index = min(next_stop - next_start - 3, closest_index + 5)
+                    current_point = next_start + 1 + closest_index
                 else:
-                    current_waypoint = next_edge['exit_waypoint']
-                route_trace.append((current_waypoint, road_option))
+                    current_point = next_stop - 1
+                current_xyz = self._point_xyz[current_point]
+                route_trace.append((current_point, road_option))
 
             else:
-                path = path + [edge['entry_waypoint']] + edge['path'] + [edge['exit_waypoint']]
-                closest_index = self._find_closest_in_list(current_waypoint, path)
-                for waypoint in path[closest_index:]:
-                    current_waypoint = waypoint
-                    route_trace.append((current_waypoint, road_option))
-                    if len(route) - i <= 2 and waypoint.transform.location.distance(
-                            destination) < 2 * self._sampling_resolution:
+                closest_index = self._find_closest_point(current_xyz, start, stop)
+                for point in range(start + closest_index, stop):
+                    current_point = point
+                    current_xyz = self._point_xyz[current_point]
+                    route_trace.append((current_point, road_option))
+                    if len(route) - i <= 2 and np.linalg.norm(
+                            current_xyz - destination_xyz) < 2 * self._sampling_resolution:
                         break
-                    elif len(
-                            route) - i <= 2 and current_waypoint.road_id == destination_waypoint.road_id and current_waypoint.section_id == destination_waypoint.section_id and current_waypoint.lane_id == destination_waypoint.lane_id:
-                        destination_index = self._find_closest_in_list(destination_waypoint, path)
+                    elif len(route) - i <= 2 and tuple(self._point_lane[current_point].tolist()) == destination_lane:
+                        destination_index = self._find_closest_point(destination_wp_xyz, start, stop)
                         if closest_index > destination_index:
                             break
 
         return route_trace
 
+    def _find_closest_point(self, xyz, start, stop):
+        # type: (np.ndarray, int, int) -> int
+        """
+        Returns the index, relative to `start`, of the graph point
+        in [start, stop) that is closest to the given location
+        """
+        distances = np.linalg.norm(self._point_xyz[start:stop] - xyz, axis=1)
+        return int(np.argmin(distances))
+
+    def _point_to_waypoint(self, point):
+        # type: (int) -> carla.Waypoint
+        """
+        Returns the carla.Waypoint of a graph point. Compact graphs don't store them,
+        so the waypoint is recreated from its OpenDRIVE coordinates.
+        """
+        if self._point_waypoints is not None:
+            return self._point_waypoints[point]
+        road_id, _, lane_id = self._point_lane[point].tolist()
+        return self._wmap.get_waypoint_xodr(road_id, lane_id, float(self._point_s[point]))
+
     def _build_topology(self):
         """
         This function retrieves topology from the server as a list of
@@ -301,44 +548,241 @@ class GlobalRoutePlanner:
                 if left_found and right_found:
                     break
 
+    def _graph_cache_path(self, cache_dir):
+        # type: (str) -> str
+        """
+        Returns the path of the graph cache file of this map. The name depends on the
+        OpenDRIVE content and the sampling resolution, so an edited map or a different
+        resolution never reuses an outdated graph. Compact and regular planners share it.
+        """
+        hash_func = hashlib.sha1()
+        hash_func.update(self._wmap.to_opendrive().encode("UTF-8"))
+        hash_func.update(repr((_GRAPH_CACHE_VERSION, float(self._sampling_resolution))).encode("UTF-8"))
+        filename = self._wmap.name.split('/')[-1] + "_" + hash_func.hexdigest() + ".pkl"
+        return os.path.join(cache_dir, filename)
+
+    def _build_edge_arrays(self):
+        """
+        This function copies the geometry of every edge (entry waypoint, path and
+        exit waypoint) into the graph point arrays and stores in each edge the id
+        of its slice. Compact graphs then drop all the carla.Waypoint attributes.
+        """
+        waypoints = []  # type: list[carla.Waypoint]
+        bounds = []  # type: list[tuple[int, int]]
+        has_change = []  # type: list[bool]
+        for edge_id, (_, _, data) in enumerate(self._graph.edges(data=True)):
+            data['edge_id'] = edge_id
+            start = len(waypoints)
+            waypoints.append(data['entry_waypoint'])
+            waypoints.extend(data['path'])
+            waypoints.append(data['exit_waypoint'])
+            bounds.append((start, len(waypoints)))
+            has_change.append('change_waypoint' in data)
+
+        self._point_xyz = np.array(
+            [[wp.transform.location.x, wp.transform.location.y, wp.transform.location.z] for wp in waypoints],
+            dtype=np.float64).reshape(-1, 3)
+        self._point_yaw = np.array([wp.transform.rotation.yaw for wp in waypoints], dtype=np.float32)
+        self._point_lane = np.array(
+            [[wp.road_id, wp.section_id, wp.lane_id] for wp in waypoints], dtype=np.int32).reshape(-1, 3)
+        self._point_s = np.array([wp.s for wp in waypoints], dtype=np.float64)
+        self._edge_bounds = np.array(bounds, dtype=np.int64).reshape(-1, 2)
+        self._edge_has_change = np.array(has_change, dtype=bool)
+
+        if self._compact:
+            self._point_waypoints = None
+            for _, _, data in self._graph.edges(data=True):
+                for name in ('path', 'entry_waypoint', 'exit_waypoint', 'change_waypoint'):
+                    data.pop(name, None)
+        else:
+            self._point_waypoints = waypoints
+
+    def _save_graph_cache(self, cache_path):
+        # type: (str) -> None
+        """
+        Serializes the graph to disk. Waypoints can't be pickled, so only the graph point
+        arrays are stored, which hold the (road_id, lane_id, s) key of every waypoint.
+        """
+        edges = []
+        for n1, n2, data in self._graph.edges(data=True):
+            attributes = {name: value for name, value in data.items()
+                          if name not in ('path', 'entry_waypoint', 'exit_waypoint', 'change_waypoint')}
+            attributes['type'] = int(data['type'])
+            edges.append((n1, n2, attributes))
+
+        graph_cache = {
+            'version': _GRAPH_CACHE_VERSION,
+            'point_xyz': self._point_xyz,
+            'point_yaw': self._point_yaw,
+            'point_lane': self._point_lane,
+            'point_s': self._point_s,
+            'edge_bounds': self._edge_bounds,
+            'edge_has_change': self._edge_has_change,
+            'nodes': list(self._graph.nodes(data='vertex')),
+            'edges': edges,
+            'id_map': self._id_map,
+            'road_id_to_edge': self._road_id_to_edge,
+        }
+
+        dirname = os.path.dirname(cache_path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        # Write to a temporary file first so concurrent agents never read a partial cache
+        tmp_path = "{}.{}.tmp".format(cache_path, os.getpid())
+        with open(tmp_path, 'wb') as cache_file:
+            pickle.dump(graph_cache, cache_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+
+    def _load_graph_cache(self, cache_path):
+        # type: (str) -> bool
+        """
+        Restores the graph stored by `_save_graph_cache`. Unless the planner is compact,
+        the edge waypoints are recreated from their keys. Returns False if the cache
+        is missing or can't be used.
+        """
+        if not os.path.isfile(cache_path):
+            return False
+        try:
+            with open(cache_path, 'rb') as cache_file:
+                graph_cache = pickle.load(cache_file)
+        except (OSError, EOFError, AttributeError, ImportError, IndexError, ValueError, pickle.UnpicklingError):
+            return False
+        if not isinstance(graph_cache, dict) or graph_cache.get('version') != _GRAPH_CACHE_VERSION:
+            return False
+        if any(key not in graph_cache for key in _GRAPH_CACHE_KEYS):
+            return False
+        try:
+            return self._restore_graph_cache(graph_cache)
+        except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+            # A damaged cache, the graph is built again
+            return False
+
+    def _restore_graph_cache(self, graph_cache):
+        # type: (dict) -> bool
+        """
+        Restores the graph from the contents of a cache file. Returns False if the
+        waypoints of the graph can't be recreated from the map.
+        """
+        self._point_xyz = graph_cache['point_xyz']
+        self._point_yaw = graph_cache['point_yaw']
+        self._point_lane = graph_cache['point_lane']
+        self._point_s = graph_cache['point_s']
+        self._edge_bounds = graph_cache['edge_bounds']
+        self._edge_has_change = graph_cache['edge_has_change']
+
+        waypoints = None  # type: list[carla.Waypoint] | None
+        if not self._compact:
+            # Several edges share their entry and exit waypoints, only create them once
+            restored = dict()  # type: dict[tuple[int, int, float], carla.Waypoint]
+            waypoints = []
+            for (road_id, _, lane_id), s in zip(self._point_lane.tolist(), self._point_s.tolist()):
+                key = (road_id, lane_id, s)
+                if key not in restored:
+                    waypoint = self._wmap.get_waypoint_xodr(road_id, lane_id, s)
+                    if waypoint is None:
+                        return False
+                    restored[key] = waypoint
+                waypoints.append(restored[key])
+
+        graph = nx.DiGraph()
+        for node, vertex in graph_cache['nodes']:
+            graph.add_node(node, vertex=vertex)
+        for n1, n2, attributes in graph_cache['edges']:
+            attributes['type'] = RoadOption(attributes['type'])
+            if waypoints is not None:
+                start, stop = self._edge_bounds[attributes['edge_id']].tolist()
+                attributes['entry_waypoint'] = waypoints[start]
+                attributes['path'] = waypoints[start + 1:stop - 1]
+                attributes['exit_waypoint'] = waypoints[stop - 1]
+                if self._edge_has_change[attributes['edge_id']]:
+                    attributes['change_waypoint'] = waypoints[stop - 1]
+            graph.add_edge(n1, n2, **attributes)
+
+        self._graph = graph
+        self._id_map = graph_cache['id_map']
+        self._road_id_to_edge = graph_cache['road_id_to_edge']
+        self._point_waypoints = waypoints
+        return True
+
     def _localize(self, location):
         # type: (carla.Location) -> None | tuple[int, int]
         """
         This function finds the road segment that a given location
         is part of, returning the edge it belongs to
         """
+        point = self._closest_graph_point(location)
+        if point is not None:
+            edge = self._lane_to_edge(*self._point_lane[point].tolist())
+            if edge is not None:
+                return edge
+        return self._waypoint_to_edge(self._wmap.get_waypoint(location))
+
+    def _localize_endpoint(self,
+                           location  # type: carla.Location
+                           ):
+        # type: (...) -> tuple[None | tuple[int, int], carla.Waypoint | int, np.ndarray, tuple[int, int, int]]
+        """
+        This function localizes a route endpoint, returning its edge, the endpoint itself
+        (its waypoint or, if localized locally, its graph point id) and the location
+        and (road_id, section_id, lane_id) of that endpoint
+        """
+        point = self._closest_graph_point(location)
+        if point is not None:
+            lane = tuple(self._point_lane[point].tolist())
+            edge = self._lane_to_edge(*lane)
+            if edge is not None:
+                return edge, point, self._point_xyz[point], lane
         waypoint = self._wmap.get_waypoint(location)
-        edge = None  # type: None | tuple[int, int]
+        return (self._waypoint_to_edge(waypoint), waypoint,
+                _location_to_xyz(waypoint.transform.location), _waypoint_lane(waypoint))
+
+    def _closest_graph_point(self, location):
+        # type: (carla.Location) -> int | None
+        """
+        Returns the graph point closest to the location, if it can be trusted to belong to the
+        same lane as carla.Map.get_waypoint would return. That is, if it is within the localization
+        tolerance and there are no points of other lanes close enough to make it ambiguous.
+        Returns None if local localization is disabled or the answer isn't good enough.
+        """
+        if self._localization_tolerance is None or self._point_xyz is None:
+            return None
+        if self._point_index is None:
+            self._point_index = GridIndex(self._point_xyz, max(self._localization_tolerance, 1.0) * 4)
+
+        tolerance = self._localization_tolerance
+        points, distances = self._point_index.query(_location_to_xyz(location), 2 * tolerance)
+        if len(points) == 0 or distances[0] > tolerance:
+            return None
+        close = points[distances <= distances[0] + tolerance]
+        if np.any(self._point_lane[close] != self._point_lane[points[0]]):
+            return None
+        return int(points[0])
+
+    def _lane_to_edge(self, road_id, section_id, lane_id):
+        # type: (int, int, int) -> None | tuple[int, int]
+        """
+        This function returns the edge of the given lane of a road section
+        """
         try:
-            edge = self._road_id_to_edge[waypoint.road_id][waypoint.section_id][waypoint.lane_id]
+            return self._road_id_to_edge[road_id][section_id][lane_id]
         except KeyError:
-            pass
-        return edge
+            return None
 
-    def _distance_heuristic(self, n1, n2):
+    def _waypoint_to_edge(self, waypoint):
+        # type: (carla.Waypoint) -> None | tuple[int, int]
         """
-        Distance heuristic calculator for path searching
-        in self._graph
+        This function returns the edge of the road segment the given waypoint is part of
         """
-        l1 = np.array(self._graph.nodes[n1]['vertex'])
-        l2 = np.array(self._graph.nodes[n2]['vertex'])
-        return np.linalg.norm(l1 - l2)
+        return self._lane_to_edge(waypoint.road_id, waypoint.section_id, waypoint.lane_id)
 
-    def _path_search(self, origin, destination):
-        # type: (carla.Location, carla.Location) -> list[int]
+    def _shortest_route(self, source, end):
+        # type: (int, tuple[int, int]) -> list[int]
         """
-        This function finds the shortest path connecting origin and destination
-        using A* search with distance heuristic.
-        origin      :   carla.Location object of start position
-        destination :   carla.Location object of of end position
-        return      :   path as list of node ids (as int) of the graph self._graph
-        connecting origin and destination
+        This function returns the shortest path from the source node to the
+        given end edge, as a list of node ids ending at the exit of that edge
         """
-        start, end = self._localize(origin), self._localize(destination)
-
-        route = nx.astar_path(
-            self._graph, source=start[0], target=end[0],
-            heuristic=self._distance_heuristic, weight='length')
+        route = self._path_searcher.search(source, end[0])
         route.append(end[1])
         return route
 
@@ -428,14 +872,35 @@ class GlobalRoutePlanner:
         self._previous_decision = decision
         return decision
 
-    def _find_closest_in_list(self, current_waypoint, waypoint_list):
-        min_distance = float('inf')
-        closest_index = -1
-        for i, waypoint in enumerate(waypoint_list):
-            distance = waypoint.transform.location.distance(
-                current_waypoint.transform.location)
-            if distance < min_distance:
-                min_distance = distance
-                closest_index = i
-
-        return closest_index
+
+def _location_to_xyz(location):
+    # type: (carla.Location) -> np.ndarray
+    """Returns the coordinates of a carla.Location as an array"""
+    return np.array([location.x, location.y, location.z])
+
+
+def _waypoint_lane(waypoint):
+    # type: (carla.Waypoint) -> tuple[int, int, int]
+    """Returns the (road_id, section_id, lane_id) of a waypoint"""
+    return (waypoint.road_id, waypoint.section_id, waypoint.lane_id)
+
+
+# Planner used by the worker processes of GlobalRoutePlanner.trace_routes
+_WORKER_PLANNER = None  # type: GlobalRoutePlanner | None
+
+
+def _init_trace_routes_worker(state):
+    # type: (dict) -> None
+    """Creates the map-less planner of a trace_routes worker process"""
+    global _WORKER_PLANNER
+    planner = GlobalRoutePlanner.__new__(GlobalRoutePlanner)
+    planner.__dict__.update(state)
+    planner._intersection_end_node = -1
+    planner._previous_decision = RoadOption.VOID
+    _WORKER_PLANNER = planner
+
+
+def _trace_routes_worker(task):
+    # type: (tuple[int, list[tuple]]) -> list[tuple[int, list[tuple[int, RoadOption]]]]
+    """Traces a group of routes on a trace_routes worker process"""
+    return _WORKER_PLANNER._trace_route_group(task)
@@ -6,11 +6,11 @@
 """ This module contains a local planner to perform low-level waypoint following based on PID controllers. """
 
 from enum import IntEnum
-from collections import deque
 import random
 
 import carla
 from agents.navigation.controller import VehiclePIDController
+from agents.navigation.waypoint_horizon import SuccessorCache, WaypointHorizon
 from agents.tools.misc import draw_waypoints, get_speed
 
 
@@ -70,7 +70,8 @@ class LocalPlanner:
         self.target_waypoint = None
         self.target_road_option = None
 
-        self._waypoints_queue = deque(maxlen=10000)
+        self._waypoints_queue = WaypointHorizon(maxlen=10000)
+        self._successors = SuccessorCache.for_map(self._map)
         self._min_waypoint_queue_length = 100
         self._stop_waypoint_creation = False
 
@@ -171,7 +172,7 @@ class LocalPlanner:
 
         for _ in range(k):
             last_waypoint = self._waypoints_queue[-1][0]
-            next_waypoints = list(last_waypoint.next(self._sampling_radius))
+            next_waypoints = self._successors.next(last_waypoint, self._sampling_radius)
 
             if len(next_waypoints) == 0:
                 break
@@ -182,7 +183,7 @@ class LocalPlanner:
             else:
                 # random choice between the possible options
                 road_options_list = _retrieve_options(
-                    next_waypoints, last_waypoint)
+                    next_waypoints, last_waypoint, self._successors)
                 road_option = random.choice(road_options_list)
                 next_waypoint = next_waypoints[road_options_list.index(
                     road_option)]
@@ -206,13 +207,9 @@ class LocalPlanner:
         # Remake the waypoints queue if the new plan has a higher length than the queue
         new_plan_length = len(current_plan) + len(self._waypoints_queue)
         if new_plan_length > self._waypoints_queue.maxlen:
-            new_waypoint_queue = deque(maxlen=new_plan_length)
-            for wp in self._waypoints_queue:
-                new_waypoint_queue.append(wp)
-            self._waypoints_queue = new_waypoint_queue
+            self._waypoints_queue.resize(new_plan_length)
 
-        for elem in current_plan:
-            self._waypoints_queue.append(elem)
+        self._waypoints_queue.extend(current_plan)
 
         self._stop_waypoint_creation = stop_waypoint_creation
 
@@ -240,22 +237,8 @@ class LocalPlanner:
         vehicle_speed = get_speed(self._vehicle) / 3.6
         self._min_distance = self._base_min_distance + self._distance_ratio * vehicle_speed
 
-        num_waypoint_removed = 0
-        for waypoint, _ in self._waypoints_queue:
-
-            if len(self._waypoints_queue) - num_waypoint_removed == 1:
-                min_distance = 1  # Don't remove the last waypoint until very close by
-            else:
-                min_distance = self._min_distance
-
-            if veh_location.distance(waypoint.transform.location) < min_distance:
-                num_waypoint_removed += 1
-            else:
-                break
-
-        if num_waypoint_removed > 0:
-            for _ in range(num_waypoint_removed):
-                self._waypoints_queue.popleft()
+        # Don't remove the last waypoint until very close by
+        self._waypoints_queue.purge(veh_location, self._min_distance, last_min_distance=1)
 
         # Get the target waypoint and move using the PID controllers. Stop if no target waypoint
         if len(self._waypoints_queue) == 0:
@@ -303,13 +286,14 @@ class LocalPlanner:
         return len(self._waypoints_queue) == 0
 
 
-def _retrieve_options(list_waypoints, current_waypoint):
+def _retrieve_options(list_waypoints, current_waypoint, successors=None):
     """
     Compute the type of connection between the current active waypoint and the multiple waypoints present in
     list_waypoints. The result is encoded as a list of RoadOption enums.
 
     :param list_waypoints: list with the possible target waypoints in case of multiple options
     :param current_waypoint: current active waypoint
+    :param successors: SuccessorCache used to look up the waypoints ahead, if any
     :return: list of RoadOption enums representing the type of connection from the active waypoint to each
              candidate in list_waypoints
     """
@@ -318,7 +302,10 @@ def _retrieve_options(list_waypoints, current_waypoint):
         # this is needed because something we are linking to
         # the beginning of an intersection, therefore the
         # variation in angle is small
-        next_next_waypoint = next_waypoint.next(3.0)[0]
+        if successors is None:
+            next_next_waypoint = next_waypoint.next(3.0)[0]
+        else:
+            next_next_waypoint = successors.next(next_waypoint, 3.0)[0]
         link = _compute_connection(current_waypoint, next_next_waypoint)
         options.append(link)
 
@@ -0,0 +1,300 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module provides the shortest path engines used by the GlobalRoutePlanner.
+
+All of them are built from the planner graph, whose nodes have a 'vertex' attribute with
+their (x, y, z) location, and search over the 'length' attribute of its edges:
+
+    - AStarSearch: A* with a straight line heuristic over precomputed node coordinates
+    - BidirectionalDijkstraSearch: plain bidirectional Dijkstra, no preprocessing
+    - ContractionHierarchySearch: contraction hierarchies, slow to build but very fast queries
+    - ALTSearch: A* with landmark based lower bounds (A*, Landmarks, Triangle inequality)
+"""
+
+import heapq
+import itertools
+
+import numpy as np
+import networkx as nx
+
+
+class PathSearch(object):
+    """
+    Base class of the shortest path engines. It keeps a lightweight copy of the graph,
+    with only its topology and edge weights, so engines can be sent to other processes.
+    """
+
+    def __init__(self, graph, weight='length'):
+        """
+        :param graph: networkx.DiGraph of the GlobalRoutePlanner
+        :param weight: name of the edge attribute used as weight
+        """
+        self._graph = nx.DiGraph()
+        self._graph.add_nodes_from(graph.nodes)
+        self._graph.add_weighted_edges_from(graph.edges(data=weight), weight='weight')
+
+        self._nodes = list(self._graph.nodes)
+        self._node_index = {node: i for i, node in enumerate(self._nodes)}
+        self._coordinates = np.array(
+            [graph.nodes[node]['vertex'] for node in self._nodes], dtype=np.float64).reshape(-1, 3)
+
+    def search(self, source, target):
+        """
+        Returns the shortest path between two nodes as a list of node ids,
+        raising networkx.NetworkXNoPath if there is none.
+        """
+        raise NotImplementedError
+
+
+class AStarSearch(PathSearch):
+    """
+    A* search using the straight line distance between nodes as heuristic. The distances
+    to the target are computed at once from the node coordinate array at the start of each
+    search, instead of building new arrays from the node attributes on every expansion.
+    """
+
+    def __init__(self, graph, weight='length', heuristic_scale=1.0):
+        """
+        :param heuristic_scale: factor applied to the distances, in meters, to convert them
+            to weight units. The default value matches the historical planner behavior.
+        """
+        super(AStarSearch, self).__init__(graph, weight)
+        self._heuristic_scale = heuristic_scale
+
+    def search(self, source, target):
+        target_index = self._node_index[target]
+        distances = np.linalg.norm(self._coordinates - self._coordinates[target_index], axis=1)
+        estimates = (self._heuristic_scale * distances).tolist()
+        node_index = self._node_index
+        return nx.astar_path(self._graph, source, target,
+                             heuristic=lambda node, _: estimates[node_index[node]], weight='weight')
+
+
+class BidirectionalDijkstraSearch(PathSearch):
+    """
+    Bidirectional Dijkstra search. It doesn't need any preprocessing nor heuristic.
+    """
+
+    def search(self, source, target):
+        _, path = nx.bidirectional_dijkstra(self._graph, source, target, weight='weight')
+        return path
+
+
+class ALTSearch(PathSearch):
+    """
+    A* search whose heuristic is a lower bound derived from the triangle inequality
+    and the precomputed distances from and to a small set of landmark nodes.
+    Landmarks are chosen with the farthest point heuristic.
+    """
+
+    def __init__(self, graph, weight='length', num_landmarks=8):
+        """
+        :param num_landmarks: amount of landmarks. More landmarks give tighter bounds,
+            at the cost of memory and of a slower heuristic computation.
+        """
+        super(ALTSearch, self).__init__(graph, weight)
+        num_nodes = len(self._nodes)
+        num_landmarks = min(num_landmarks, num_nodes)
+        reverse_graph = self._graph.reverse(copy=False)
+
+        self._from_landmark = np.full((num_landmarks, num_nodes), np.inf)
+        self._to_landmark = np.full((num_landmarks, num_nodes), np.inf)
+        self.landmarks = []
+
+        closest_landmark = np.full(num_nodes, np.inf)
+        landmark = self._nodes[0] if num_nodes else None
+        for i in range(num_landmarks):
+            self.landmarks.append(landmark)
+            for node, distance in nx.single_source_dijkstra_path_length(self._graph, landmark, weight='weight').items():
+                self._from_landmark[i, self._node_index[node]] = distance
+            to_landmark = nx.single_source_dijkstra_path_length(reverse_graph, landmark, weight='weight')
+            for node, distance in to_landmark.items():
+                self._to_landmark[i, self._node_index[node]] = distance
+
+            # Next landmark: the node farthest from all the current ones
+            distances = np.minimum(self._from_landmark[i], self._to_landmark[i])
+            closest_landmark = np.minimum(closest_landmark, np.where(np.isinf(distances), -1, distances))
+            landmark = self._nodes[int(np.argmax(closest_landmark))]
+
+    def search(self, source, target):
+        target_index = self._node_index[target]
+        with np.errstate(invalid='ignore'):
+            # d(u, t) >= d(L, t) - d(L, u) and d(u, t) >= d(u, L) - d(t, L)
+            forward = self._from_landmark[:, target_index:target_index + 1] - self._from_landmark
+            backward = self._to_landmark - self._to_landmark[:, target_index:target_index + 1]
+            bounds = np.fmax(forward, backward)
+        bounds = np.where(np.isnan(bounds), 0.0, bounds)
+        estimates = np.maximum(bounds.max(axis=0), 0.0).tolist() if len(bounds) else [0.0] * len(self._nodes)
+        node_index = self._node_index
+        return nx.astar_path(self._graph, source, target,
+                             heuristic=lambda node, _: estimates[node_index[node]], weight='weight')
+
+
+class ContractionHierarchySearch(PathSearch):
+    """
+    Contraction hierarchies. Nodes are contracted one by one, ordered by their edge difference,
+    adding shortcuts that keep the shortest distances between their neighbors. Queries are then
+    a bidirectional Dijkstra that only moves upwards in the hierarchy, settling very few nodes,
+    and the shortcuts of the resulting path are unpacked back into graph edges.
+    """
+
+    def __init__(self, graph, weight='length', witness_settle_limit=64):
+        """
+        :param witness_settle_limit: maximum amount of nodes settled by each witness search.
+            Lower values build the hierarchy faster, at the cost of some unneeded shortcuts.
+        """
+        super(ContractionHierarchySearch, self).__init__(graph, weight)
+        self._witness_settle_limit = witness_settle_limit
+
+        num_nodes = len(self._nodes)
+        out_edges = [dict() for _ in range(num_nodes)]  # type: list[dict[int, float]]
+        in_edges = [dict() for _ in range(num_nodes)]  # type: list[dict[int, float]]
+        for u, v, w in self._graph.edges(data='weight'):
+            if u == v:
+                continue
+            u, v = self._node_index[u], self._node_index[v]
+            out_edges[u][v] = in_edges[v][u] = w
+        self._shortcut_middle = dict()  # type: dict[tuple[int, int], int]
+
+        rank = [-1] * num_nodes
+        contracted_neighbors = [0] * num_nodes
+        counter = itertools.count()
+        queue = [(self._edge_difference(v, out_edges, in_edges, rank), next(counter), v) for v in range(num_nodes)]
+        heapq.heapify(queue)
+        current_rank = 0
+        while queue:
+            _, _, v = heapq.heappop(queue)
+            if rank[v] >= 0:
+                continue
+            # Lazy update: contract it only if it is still the best candidate
+            priority = self._edge_difference(v, out_edges, in_edges, rank) + contracted_neighbors[v]
+            if queue and priority > queue[0][0]:
+                heapq.heappush(queue, (priority, next(counter), v))
+                continue
+            for u, w in self._shortcuts(v, out_edges, in_edges, rank):
+                weight = in_edges[v][u] + out_edges[v][w]
+                out_edges[u][w] = in_edges[w][u] = weight
+                self._shortcut_middle[(u, w)] = v
+            for neighbor in itertools.chain(out_edges[v], in_edges[v]):
+                contracted_neighbors[neighbor] += 1
+            rank[v] = current_rank
+            current_rank += 1
+
+        # Only the edges going upwards in the hierarchy are needed by the queries
+        self._upward = [[(w, weight) for w, weight in out_edges[u].items() if rank[w] > rank[u]]
+                        for u in range(num_nodes)]
+        self._downward = [[(u, weight) for u, weight in in_edges[w].items() if rank[u] > rank[w]]
+                          for w in range(num_nodes)]
+
+    def _shortcuts(self, v, out_edges, in_edges, rank):
+        """Returns the (u, w) shortcuts needed to contract node v"""
+        shortcuts = []
+        successors = [(w, weight) for w, weight in out_edges[v].items() if rank[w] < 0]
+        if not successors:
+            return shortcuts
+        max_out = max(weight for _, weight in successors)
+        for u, in_weight in in_edges[v].items():
+            if rank[u] >= 0:
+                continue
+            distances = self._witness_search(u, v, in_weight + max_out, out_edges, rank)
+            for w, out_weight in successors:
+                if w != u and distances.get(w, float('inf')) > in_weight + out_weight:
+                    shortcuts.append((u, w))
+        return shortcuts
+
+    def _witness_search(self, source, ignored, max_distance, out_edges, rank):
+        """Limited Dijkstra over the uncontracted nodes, skipping the one being contracted"""
+        distances = {source: 0}
+        queue = [(0, source)]
+        settled = 0
+        while queue and settled < self._witness_settle_limit:
+            distance, u = heapq.heappop(queue)
+            if distance > distances[u]:
+                continue
+            if distance > max_distance:
+                break
+            settled += 1
+            for w, weight in out_edges[u].items():
+                if w == ignored or rank[w] >= 0:
+                    continue
+                new_distance = distance + weight
+                if new_distance < distances.get(w, float('inf')):
+                    distances[w] = new_distance
+                    heapq.heappush(queue, (new_distance, w))
+        return distances
+
+    def _edge_difference(self, v, out_edges, in_edges, rank):
+        """Shortcuts added by contracting the node minus the edges removed"""
+        removed = sum(1 for u in in_edges[v] if rank[u] < 0) + sum(1 for w in out_edges[v] if rank[w] < 0)
+        return len(self._shortcuts(v, out_edges, in_edges, rank)) - removed
+
+    def search(self, source, target):
+        source, target = self._node_index[source], self._node_index[target]
+        distances = ({source: 0}, {target: 0})
+        parents = ({source: None}, {target: None})
+        queues = ([(0, source)], [(0, target)])
+        edges = (self._upward, self._downward)
+        best, meeting = float('inf'), None
+
+        while queues[0] or queues[1]:
+            for direction in (0, 1):
+                queue = queues[direction]
+                if not queue:
+                    continue
+                distance, u = heapq.heappop(queue)
+                if distance > distances[direction][u]:
+                    continue
+                if distance >= best:
+                    del queue[:]
+                    continue
+                other = distances[1 - direction].get(u)
+                if other is not None and distance + other < best:
+                    best, meeting = distance + other, u
+                for w, weight in edges[direction][u]:
+                    new_distance = distance + weight
+                    if new_distance < distances[direction].get(w, float('inf')):
+                        distances[direction][w] = new_distance
+                        parents[direction][w] = u
+                        heapq.heappush(queue, (new_distance, w))
+
+        if meeting is None:
+            raise nx.NetworkXNoPath("Node {} not reachable from {}".format(
+                self._nodes[target], self._nodes[source]))
+
+        upward_path = [meeting]
+        while parents[0][upward_path[-1]] is not None:
+            upward_path.append(parents[0][upward_path[-1]])
+        upward_path.reverse()
+        downward_path = [meeting]
+        while parents[1][downward_path[-1]] is not None:
+            downward_path.append(parents[1][downward_path[-1]])
+
+        path = [upward_path[0]]
+        for u, w in zip(upward_path[:-1] + downward_path[:-1], upward_path[1:] + downward_path[1:]):
+            self._unpack(u, w, path)
+        return [self._nodes[i] for i in path]
+
+    def _unpack(self, u, w, path):
+        """Appends to the path the graph nodes of edge (u, w), after u, expanding shortcuts"""
+        stack = [(u, w)]
+        while stack:
+            u, w = stack.pop()
+            middle = self._shortcut_middle.get((u, w))
+            if middle is None:
+                path.append(w)
+            else:
+                stack.append((middle, w))
+                stack.append((u, middle))
+
+
+# Engines available by name in the GlobalRoutePlanner
+PATH_SEARCH_BACKENDS = {
+    'astar': AStarSearch,
+    'bidirectional_dijkstra': BidirectionalDijkstraSearch,
+    'contraction_hierarchies': ContractionHierarchySearch,
+    'alt': ALTSearch,
+}
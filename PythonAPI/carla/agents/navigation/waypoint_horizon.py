@@ -0,0 +1,234 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+""" This module contains the waypoint buffer and the successor cache used by the local planner. """
+
+import hashlib
+import weakref
+
+import numpy as np
+
+
+class WaypointHorizon(object):
+    """
+    WaypointHorizon is the queue of (carla.Waypoint, RoadOption) pairs followed by the local planner.
+
+    It behaves like a collections.deque with a maxlen, but the elements live in a ring buffer with a
+    moving cursor, along with NumPy arrays of their locations and rotations. These are read from
+    the waypoints only once, when they are added, so that purging the waypoints already reached is a
+    vectorized distance computation instead of a call to the carla API per waypoint and tick.
+
+    Elements also have an absolute index, which starts at 0 and never goes back, not even when the
+    horizon is cleared. It lets other objects cache data of the elements as the horizon advances.
+    """
+
+    _INITIAL_CAPACITY = 128
+
+    def __init__(self, iterable=(), maxlen=10000):
+        """
+        :param iterable: initial (carla.Waypoint, RoadOption) pairs
+        :param maxlen: maximum length. As in a deque, adding elements to a full horizon
+            discards the same amount of elements from the front
+        """
+        self.maxlen = maxlen
+        self._items = [None] * self._INITIAL_CAPACITY
+        self._xyz = np.empty((self._INITIAL_CAPACITY, 3), dtype=np.float64)
+        self._rotation = np.empty((self._INITIAL_CAPACITY, 3), dtype=np.float64)  # pitch, yaw, roll
+        self._head = 0
+        self._size = 0
+        self._first_index = 0
+        self.extend(iterable)
+
+    def __len__(self):
+        return self._size
+
+    def __bool__(self):
+        return self._size > 0
+
+    __nonzero__ = __bool__
+
+    def __iter__(self):
+        capacity = len(self._items)
+        for i in range(self._size):
+            yield self._items[(self._head + i) % capacity]
+
+    @property
+    def first_index(self):
+        """Absolute index of the first element"""
+        return self._first_index
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError('WaypointHorizon index out of range')
+        return self._items[(self._head + index) % len(self._items)]
+
+    def append(self, item):
+        """Adds a (carla.Waypoint, RoadOption) pair at the end"""
+        if self._size == self.maxlen:
+            self.popleft()
+        if self._size == len(self._items):
+            self._grow(2 * self._size)
+        slot = (self._head + self._size) % len(self._items)
+        self._items[slot] = item
+        transform = item[0].transform
+        location, rotation = transform.location, transform.rotation
+        self._xyz[slot] = (location.x, location.y, location.z)
+        self._rotation[slot] = (rotation.pitch, rotation.yaw, rotation.roll)
+        self._size += 1
+
+    def extend(self, iterable):
+        """Adds several (carla.Waypoint, RoadOption) pairs at the end"""
+        for item in iterable:
+            self.append(item)
+
+    def popleft(self):
+        """Removes and returns the first element"""
+        if self._size == 0:
+            raise IndexError('pop from an empty WaypointHorizon')
+        item = self._items[self._head]
+        self.discard(1)
+        return item
+
+    def clear(self):
+        """Removes all the elements"""
+        self.discard(self._size)
+        self._head = 0
+
+    def discard(self, count):
+        """Removes the first count elements"""
+        count = min(count, self._size)
+        capacity = len(self._items)
+        for i in range(count):
+            self._items[(self._head + i) % capacity] = None
+        self._head = (self._head + count) % capacity
+        self._size -= count
+        self._first_index += count
+
+    def resize(self, maxlen):
+        """Changes the maximum length, keeping the last elements if it shrinks"""
+        if self._size > maxlen:
+            self.discard(self._size - maxlen)
+        self.maxlen = maxlen
+
+    def locations(self, start=0, stop=None):
+        """Returns a (N, 3) array with the locations of the elements in the range [start, stop)"""
+        return self._xyz[self._slots(start, stop)]
+
+    def rotations(self, start=0, stop=None):
+        """Returns a (N, 3) array with the (pitch, yaw, roll) of the elements in the range [start, stop)"""
+        return self._rotation[self._slots(start, stop)]
+
+    def count_within(self, location, max_distance, chunk_size=32):
+        """
+        Returns the amount of elements at the front of the horizon whose distance to the
+        location is up to max_distance, stopping at the first one that is farther.
+        """
+        point = np.array([location.x, location.y, location.z])
+        count = 0
+        while count < self._size:
+            distances = np.linalg.norm(self.locations(count, count + chunk_size) - point, axis=1)
+            far = np.flatnonzero(distances > max_distance)
+            if len(far) > 0:
+                return count + int(far[0])
+            count += len(distances)
+        return count
+
+    def purge(self, location, min_distance, last_min_distance=1.0, chunk_size=32):
+        """
+        Removes the elements at the front of the horizon that are closer than min_distance to the
+        given location, stopping at the first one that isn't. The last element of the horizon uses
+        last_min_distance instead, so that it isn't removed until the vehicle is very close by.
+        Returns the amount of elements removed.
+
+            :param location: carla.Location of the vehicle
+            :param min_distance: distance, in meters, below which a waypoint is considered reached
+            :param last_min_distance: same as min_distance, for the last element
+            :param chunk_size: amount of distances computed at once. Only the first waypoints
+                are usually reached, so there is no need to compute all of them
+        """
+        point = np.array([location.x, location.y, location.z])
+        removed = 0
+        while removed < self._size:
+            distances = np.linalg.norm(self.locations(removed, removed + chunk_size) - point, axis=1)
+            thresholds = np.full(len(distances), float(min_distance))
+            if removed + len(distances) == self._size:
+                thresholds[-1] = last_min_distance
+            far = np.flatnonzero(distances >= thresholds)
+            if len(far) > 0:
+                removed += int(far[0])
+                break
+            removed += len(distances)
+        self.discard(removed)
+        return removed
+
+    def _slots(self, start, stop):
+        """Returns the buffer slots of the elements in the range [start, stop)"""
+        stop = self._size if stop is None else min(stop, self._size)
+        return (self._head + np.arange(start, max(start, stop))) % len(self._items)
+
+    def _grow(self, capacity):
+        """Moves the elements to bigger buffers, starting at slot 0"""
+        slots = self._slots(0, None)
+        items = [self._items[slot] for slot in slots.tolist()]
+        xyz = np.empty((capacity, 3), dtype=np.float64)
+        xyz[:self._size] = self._xyz[slots]
+        rotation = np.empty((capacity, 3), dtype=np.float64)
+        rotation[:self._size] = self._rotation[slots]
+        self._items = items + [None] * (capacity - self._size)
+        self._xyz = xyz
+        self._rotation = rotation
+        self._head = 0
+
+
+class SuccessorCache(object):
+    """
+    Memoizes carla.Waypoint.next by waypoint id and distance. As the local planners of all the
+    vehicles following the same roads ask for the same successors, planners of the same map
+    share a single cache, see `SuccessorCache.for_map`.
+    """
+
+    # Caches by map name, along with the hash of the OpenDRIVE they were built for
+    _shared = dict()  # type: dict[str, tuple[str, SuccessorCache]]
+    # Hash of the OpenDRIVE of each carla.Map object, so agents sharing a map only hash it once
+    _digests = weakref.WeakKeyDictionary()  # type: weakref.WeakKeyDictionary[object, str]
+
+    def __init__(self, max_entries=200000):
+        """
+        :param max_entries: maximum number of cached lookups. The cache is emptied when reached
+        """
+        self._max_entries = max_entries
+        self._successors = dict()  # type: dict[tuple[int, float], list]
+
+    @classmethod
+    def for_map(cls, wmap):
+        """
+        Returns the cache shared by all the users of the given carla.Map. Maps are told apart by
+        their OpenDRIVE, so a map that was reloaded with changes, or a different map with the same
+        name, replaces the cache of the previous one. The OpenDRIVE is hashed once per carla.Map
+        object, so pass the same map to all the agents, as with the map_inst of BasicAgent.
+        """
+        digest = cls._digests.get(wmap)
+        if digest is None:
+            digest = cls._digests[wmap] = hashlib.sha1(wmap.to_opendrive().encode("UTF-8")).hexdigest()
+        shared = cls._shared.get(wmap.name)
+        if shared is None or shared[0] != digest:
+            shared = cls._shared[wmap.name] = (digest, cls())
+        return shared[1]
+
+    def next(self, waypoint, distance):
+        """Returns the list of waypoints at the given distance ahead, as carla.Waypoint.next does"""
+        key = (waypoint.id, distance)
+        successors = self._successors.get(key)
+        if successors is None:
+            if len(self._successors) >= self._max_entries:
+                self._successors.clear()
+            successors = self._successors[key] = list(waypoint.next(distance))
+        return successors
+
+    def clear(self):
+        """Removes all the cached lookups"""
+        self._successors.clear()
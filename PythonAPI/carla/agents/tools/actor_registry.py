@@ -0,0 +1,148 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+""" This module contains a cache of the actors of the world, grouped by type id, shared by the agents of a process. """
+
+import numpy as np
+
+
+class ActorRegistry(object):
+    """
+    ActorRegistry keeps the actors of the world, and the lists of the actors of each kind, between ticks.
+
+    Instead of retrieving all the actors of the world and matching the type id of each one of them every time a
+    list of vehicles or traffic lights is needed, the lists are built once and kept until an actor is spawned
+    or destroyed. The ids of the actors of each tick are compared with the previous ones to notice it, which
+    is a single comparison of arrays (see carla.WorldSnapshot.to_numpy), and `invalidate` forces it.
+
+    The lists are carla.ActorList, so their bulk queries (get_transforms, get_velocities...) can be used, and
+    the actors are only created when they are accessed. Agents sharing the same instance (see
+    `ActorRegistry.for_world`) share the lists too.
+
+        registry = ActorRegistry.for_world(world)
+        registry.update()
+        vehicles = registry.filter('*vehicle*')
+        actor = registry.find(actor_id)
+    """
+
+    _shared = dict()  # type: dict[int, ActorRegistry]
+
+    # Lists built as soon as the actors change, as almost every agent asks for them
+    PREBUILT_PATTERNS = ('*vehicle*', '*traffic_light*', '*walker.pedestrian*')
+
+    def __init__(self, world):
+        """
+        :param world: carla.World whose actors are kept
+        """
+        self._world = world
+        self._frame = None  # type: int | None
+        self._episode_id = None  # type: int | None
+        self._ids = np.zeros(0, dtype=np.uint32)
+        self._actors = None  # type: carla.ActorList | None
+        self._index = dict()  # type: dict[int, int]
+        self._lists = dict()  # type: dict[str, carla.ActorList]
+        self._version = 0
+
+    @classmethod
+    def for_world(cls, world):
+        """Returns the instance shared by all the agents of the given world"""
+        registry = cls._shared.get(world.id)
+        if registry is None:
+            registry = cls._shared[world.id] = cls(world)
+        return registry
+
+    @property
+    def frame(self):
+        """Frame of the last update, or None before the first one"""
+        return self._frame
+
+    @property
+    def version(self):
+        """Number of times the actors have changed, to know if something computed from the lists is still valid"""
+        return self._version
+
+    def update(self, snapshot=None):
+        """
+        Checks whether actors were spawned or destroyed since the last update, returning True if the lists
+        were rebuilt. Calling it several times in the same frame does nothing, so every agent can call it at
+        the start of its step.
+
+            :param snapshot: carla.WorldSnapshot of the tick. If None, the last one of the world is used
+        """
+        if snapshot is None:
+            snapshot = self._world.get_snapshot()
+        if self._actors is not None and snapshot.frame == self._frame:
+            return False
+        self._frame = snapshot.frame
+
+        ids = snapshot.to_numpy()['id']
+        if self._actors is not None and snapshot.id == self._episode_id and np.array_equal(ids, self._ids):
+            return False
+        self._episode_id = snapshot.id
+        self._ids = ids
+        self._rebuild()
+        return True
+
+    def invalidate(self):
+        """Rebuilds the lists on the next update, for example after spawning or destroying actors in the same frame"""
+        self._actors = None
+
+    def _rebuild(self):
+        """Retrieves the actors of the snapshot, in the order of their ids, and the prebuilt lists"""
+        self._actors = self._world.get_actors(self._ids.tolist())
+        self._index = dict(zip(self._actors.get_ids().tolist(), range(len(self._actors))))
+        self._lists = dict((pattern, self._actors.filter(pattern)) for pattern in self.PREBUILT_PATTERNS)
+        self._version += 1
+
+    @property
+    def actors(self):
+        """carla.ActorList with all the actors"""
+        self._ensure_updated()
+        return self._actors
+
+    def filter(self, wildcard_pattern):
+        """
+        Returns the carla.ActorList with the actors whose type id matches the pattern, as carla.ActorList.filter
+        does. The list is built the first time a pattern is used, and then kept until the actors change.
+        """
+        self._ensure_updated()
+        actors = self._lists.get(wildcard_pattern)
+        if actors is None:
+            actors = self._lists[wildcard_pattern] = self._actors.filter(wildcard_pattern)
+        return actors
+
+    @property
+    def vehicles(self):
+        """carla.ActorList with the vehicles"""
+        return self.filter('*vehicle*')
+
+    @property
+    def traffic_lights(self):
+        """carla.ActorList with the traffic lights"""
+        return self.filter('*traffic_light*')
+
+    @property
+    def walkers(self):
+        """carla.ActorList with the pedestrians"""
+        return self.filter('*walker.pedestrian*')
+
+    def find(self, actor_id):
+        """Returns the actor with the given id, or None if it is not present"""
+        self._ensure_updated()
+        index = self._index.get(actor_id)
+        return None if index is None else self._actors[index]
+
+    def __contains__(self, actor_id):
+        self._ensure_updated()
+        return actor_id in self._index
+
+    def __len__(self):
+        self._ensure_updated()
+        return len(self._actors)
+
+    def _ensure_updated(self):
+        """Updates the lists if they were never built or they were invalidated"""
+        if self._actors is None:
+            self.update()
@@ -0,0 +1,72 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+""" This module contains the state of the ego vehicle during a step of an agent, shared by its managers. """
+
+from agents.tools.misc import actors_within_distance
+
+
+class EgoContext(object):
+    """
+    EgoContext keeps the state of the ego vehicle during a single step of an agent: its transform, velocity,
+    waypoint, speed limit and the incoming waypoint of its plan. They are retrieved once at the start of the
+    step, so the different parts of the agent don't query the simulator for them again.
+
+    The nearby vehicles and walkers are also kept, computed the first time a radius is asked for, from the
+    SnapshotPerception if there is one, or from the ActorRegistry of the world otherwise.
+
+        ego = EgoContext(vehicle, transform, velocity, waypoint, speed_limit, registry, perception)
+        vehicles = ego.vehicles_within(45)
+    """
+
+    def __init__(self, vehicle, transform, velocity, waypoint, speed_limit, registry, perception=None):
+        """
+        :param vehicle: carla.Vehicle of the agent
+        :param transform: carla.Transform of the vehicle. It must not be modified
+        :param velocity: carla.Vector3D with the velocity of the vehicle, in m/s
+        :param waypoint: carla.Waypoint of the vehicle
+        :param speed_limit: speed limit affecting the vehicle, in Km/h
+        :param registry: ActorRegistry used to find the nearby actors without perception
+        :param perception: SnapshotPerception used to find the nearby actors, or None
+        """
+        self.vehicle = vehicle
+        self.transform = transform
+        self.location = transform.location
+        self.velocity = velocity
+        self.speed = 3.6 * velocity.length()  # Km/h, as misc.get_speed
+        self.waypoint = waypoint
+        self.speed_limit = speed_limit
+        self.direction = None  # type: RoadOption | None
+        self.incoming_waypoint = None  # type: carla.Waypoint | None
+        self.incoming_direction = None  # type: RoadOption | None
+        self._registry = registry
+        self._perception = perception
+        self._nearby = dict()  # type: dict[tuple[str, float], list[carla.Actor]]
+
+    def vehicles_within(self, radius):
+        """Returns the other vehicles at a distance of the waypoint of the ego up to radius, sorted by distance"""
+        return self._actors_within('vehicles', radius)
+
+    def walkers_within(self, radius):
+        """Returns the walkers at a distance of the waypoint of the ego up to radius, sorted by distance"""
+        return self._actors_within('walkers', radius)
+
+    def _actors_within(self, kind, radius):
+        """Returns the nearby actors of a kind, computing them the first time the radius is used"""
+        key = (kind, radius)
+        actors = self._nearby.get(key)
+        if actors is None:
+            location = self.waypoint.transform.location
+            if self._perception:
+                if kind == 'vehicles':
+                    actors = self._perception.vehicles_within(location, radius)
+                else:
+                    actors = self._perception.walkers_within(location, radius)
+                actors = [actor for actor in actors if actor.id != self.vehicle.id]
+            else:
+                candidates = self._registry.vehicles if kind == 'vehicles' else self._registry.walkers
+                actors = [actor for actor, _ in actors_within_distance(candidates, location, radius, self.vehicle.id)]
+            self._nearby[key] = actors
+        return actors
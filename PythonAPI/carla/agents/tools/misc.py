@@ -177,3 +177,27 @@ def positive(num):
         :param num: value to check
     """
     return num if num > 0.0 else 0.0
+
+
+def actors_within_distance(actor_list, location, max_distance, exclude_id=None):
+    """
+    Return the actors of a carla.ActorList closer than max_distance to a location, sorted by distance.
+    The locations of all the actors are read at once with carla.ActorList.get_transforms, and only
+    the actors that are close enough are retrieved from the list.
+
+        :param actor_list: carla.ActorList with the candidates
+        :param location: carla.Location used as reference
+        :param max_distance: maximum distance, in meters
+        :param exclude_id: id of an actor to leave out, like the one of the ego vehicle
+        :return: list of (actor, distance) pairs
+    """
+    if len(actor_list) == 0:
+        return []
+    locations = actor_list.get_transforms()['location']
+    distances = np.linalg.norm(locations - (location.x, location.y, location.z), axis=1)
+    # Destroyed actors have NaN locations, which are never closer than max_distance
+    close = np.flatnonzero(distances < max_distance)
+    if exclude_id is not None:
+        close = close[actor_list.get_ids()[close] != exclude_id]
+    close = close[np.argsort(distances[close], kind='stable')]
+    return [(actor_list[i], float(distances[i])) for i in close.tolist()]
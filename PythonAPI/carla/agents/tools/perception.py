@@ -0,0 +1,157 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+""" This module contains a snapshot based view of the world, shared by the agents of a process. """
+
+import numpy as np
+import carla
+
+from agents.tools.actor_registry import ActorRegistry
+from agents.tools.spatial_index import GridIndex
+
+
+class SnapshotPerception(object):
+    """
+    SnapshotPerception gives the agents the state of the other actors as of the last world tick.
+
+    Actor poses are read from the carla.WorldSnapshot of the tick, and the lists of vehicles and
+    traffic lights come from the ActorRegistry of the world, so they are only updated when actors
+    appear in or disappear from the snapshot, instead of querying the actors of the world at every
+    step. The waypoints of the actors are computed at most once per tick, no matter how many agents
+    ask for them, so agents sharing the same instance (see `SnapshotPerception.for_world`) share a
+    single perception pass.
+
+    Neighbor queries ("vehicles within R meters") are answered with a grid index over the
+    snapshot positions, built on first use and then reused until the next tick.
+    """
+
+    _shared = dict()  # type: dict[int, SnapshotPerception]
+
+    # Side of the cells of the neighbor indices, in meters
+    _INDEX_CELL_SIZE = 20.0
+
+    def __init__(self, world, wmap=None):
+        """
+        :param world: carla.World whose snapshots are used
+        :param wmap: carla.Map used to compute the waypoints. If None, it is retrieved from the world
+        """
+        self._world = world
+        self._map = wmap if wmap is not None else world.get_map()
+        self._snapshot = None  # type: carla.WorldSnapshot | None
+        self._registry = ActorRegistry.for_world(world)
+        self._registry_version = None  # type: int | None
+        self._vehicles = []  # type: list[carla.Actor]
+        self._traffic_lights = []  # type: list[carla.Actor]
+        self._walkers = []  # type: list[carla.Actor]
+        self._waypoints = dict()  # type: dict[tuple[int, carla.LaneType], carla.Waypoint]
+        self._indices = dict()  # type: dict[str, tuple[GridIndex, list[carla.Actor]]]
+
+    @classmethod
+    def for_world(cls, world, wmap=None):
+        """Returns the instance shared by all the agents of the given world"""
+        perception = cls._shared.get(world.id)
+        if perception is None:
+            perception = cls._shared[world.id] = cls(world, wmap)
+        return perception
+
+    @property
+    def frame(self):
+        """Frame of the snapshot currently in use, or None before the first tick"""
+        return None if self._snapshot is None else self._snapshot.frame
+
+    @property
+    def vehicles(self):
+        """List with the vehicles of the snapshot"""
+        return self._vehicles
+
+    @property
+    def traffic_lights(self):
+        """List with the traffic lights of the snapshot"""
+        return self._traffic_lights
+
+    @property
+    def walkers(self):
+        """List with the pedestrians of the snapshot"""
+        return self._walkers
+
+    def tick(self, snapshot=None):
+        """
+        Moves to a new snapshot, dropping the cached waypoints and indices. Calling it several times in the
+        same frame does nothing, so every agent can call it at the start of its step.
+
+            :param snapshot: carla.WorldSnapshot to use. If None, the last one of the world is used
+        """
+        if snapshot is None:
+            snapshot = self._world.get_snapshot()
+        if self._snapshot is not None and snapshot.frame == self._snapshot.frame:
+            return
+        self._snapshot = snapshot
+        self._waypoints.clear()
+        self._indices.clear()
+
+        # The registry may have been updated already by another agent in this frame
+        self._registry.update(snapshot)
+        if self._registry.version == self._registry_version:
+            return
+        self._registry_version = self._registry.version
+        # Sorted by id, as the actors of the registry are
+        self._vehicles = list(self._registry.vehicles)
+        self._traffic_lights = list(self._registry.traffic_lights)
+        self._walkers = list(self._registry.walkers)
+
+    def get_transform(self, actor):
+        """Returns a new carla.Transform with the pose of the actor in the current snapshot"""
+        actor_snapshot = self._snapshot.find(actor.id)
+        if actor_snapshot is None:
+            return actor.get_transform()
+        return actor_snapshot.get_transform()
+
+    def get_velocity(self, actor):
+        """Returns the velocity of the actor in the current snapshot"""
+        actor_snapshot = self._snapshot.find(actor.id)
+        if actor_snapshot is None:
+            return actor.get_velocity()
+        return actor_snapshot.get_velocity()
+
+    def get_waypoint(self, actor, lane_type=carla.LaneType.Driving):
+        """
+        Returns the waypoint of the actor in the current snapshot, as carla.Map.get_waypoint does.
+        It is computed only once per tick and lane type.
+        """
+        key = (actor.id, lane_type)
+        waypoint = self._waypoints.get(key)
+        if waypoint is None:
+            location = self.get_transform(actor).location
+            waypoint = self._waypoints[key] = self._map.get_waypoint(location, lane_type=lane_type)
+        return waypoint
+
+    def vehicles_within(self, location, radius):
+        """Returns the vehicles at a distance of the location up to radius, sorted by distance"""
+        return self._actors_within('vehicles', self._vehicles, location, radius)
+
+    def walkers_within(self, location, radius):
+        """Returns the pedestrians at a distance of the location up to radius, sorted by distance"""
+        return self._actors_within('walkers', self._walkers, location, radius)
+
+    def _actors_within(self, name, actors, location, radius):
+        """Queries the neighbor index of a list of actors, building it if needed"""
+        entry = self._indices.get(name)
+        if entry is None:
+            # Actors missing from the snapshot, like the ones destroyed since the registry was
+            # updated, are left out of the index
+            points = []
+            indexed = []
+            for actor in actors:
+                actor_snapshot = self._snapshot.find(actor.id)
+                if actor_snapshot is None:
+                    continue
+                actor_location = actor_snapshot.get_transform().location
+                points.append((actor_location.x, actor_location.y, actor_location.z))
+                indexed.append(actor)
+            index = GridIndex(np.array(points, dtype=np.float64).reshape(-1, 3), self._INDEX_CELL_SIZE)
+            entry = self._indices[name] = (index, indexed)
+        index, indexed = entry
+        indices, _ = index.query((location.x, location.y, location.z), radius)
+        return [indexed[i] for i in indices.tolist()]
@@ -0,0 +1,171 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module contains the corridor swept by a vehicle along its plan, and the vectorized
+2D geometry used to check if other actors are inside of it.
+"""
+
+import numpy as np
+
+
+class RouteCorridor(object):
+    """
+    RouteCorridor is the area of the XY plane that the vehicle will sweep while following the
+    first meters of its plan. It is made of the cross sections of the plan waypoints (the segment
+    perpendicular to the lane, as wide as the vehicle) joined by pairs of triangles.
+
+    The cross sections are cached by the absolute index of their waypoint in the WaypointHorizon
+    of the local planner, so as the plan advances the corridor is only trimmed at the front and
+    extended at the back. Intersections with oriented bounding boxes are tested for all the
+    triangles and boxes at once with the separating axis theorem.
+    """
+
+    def __init__(self, horizon):
+        """
+        :param horizon: WaypointHorizon with the plan of the vehicle
+        """
+        self._horizon = horizon
+        self._extents = None  # type: tuple[float, float] | None
+        self._first_index = 0
+        self._right_points = np.zeros((0, 2))
+        self._left_points = np.zeros((0, 2))
+        self._triangles = np.zeros((0, 3, 2))
+
+    def update(self, ego_transform, max_distance, half_width, offset=0.0):
+        """
+        Builds the corridor from the ego vehicle to the last consecutive plan waypoint
+        within max_distance of it. Returns False if the corridor is empty, which happens
+        when there are no waypoints close enough.
+
+            :param ego_transform: carla.Transform of the vehicle
+            :param max_distance: distance to the vehicle, in meters, of the plan waypoints used
+            :param half_width: half of the width of the corridor, usually the y extent of the vehicle
+            :param offset: lateral displacement of the corridor, positive to the right
+        """
+        extents = (half_width + offset, -half_width + offset)
+        if extents != self._extents:
+            self._extents = extents
+            self._right_points = np.zeros((0, 2))
+            self._left_points = np.zeros((0, 2))
+
+        ego_location = ego_transform.location
+        count = self._horizon.count_within(ego_location, max_distance)
+        self._sync_sections(count)
+
+        ego_rotation = ego_transform.rotation
+        ego_right = _right_vectors(np.array([[ego_rotation.pitch, ego_rotation.yaw, ego_rotation.roll]]))
+        ego_xy = np.array([[ego_location.x, ego_location.y]])
+        right_points = np.vstack((ego_xy + extents[0] * ego_right, self._right_points[:count]))
+        left_points = np.vstack((ego_xy + extents[1] * ego_right, self._left_points[:count]))
+
+        # Two triangles per pair of consecutive cross sections
+        first = np.stack((right_points[:-1], left_points[:-1], right_points[1:]), axis=1)
+        second = np.stack((left_points[:-1], left_points[1:], right_points[1:]), axis=1)
+        self._triangles = np.concatenate((first, second))
+        return len(self._triangles) > 0
+
+    @property
+    def triangles(self):
+        """(M, 3, 2) array with the triangles of the corridor"""
+        return self._triangles
+
+    def intersects(self, corners):
+        """
+        Returns, for each box, whether or not it overlaps the corridor.
+
+            :param corners: (N, 4, 2) array with the XY corners of the boxes, see `box_corners`
+        """
+        corners = np.asarray(corners, dtype=np.float64).reshape(-1, 4, 2)
+        if len(self._triangles) == 0 or len(corners) == 0:
+            return np.zeros(len(corners), dtype=bool)
+        return convex_polygons_overlap(corners, self._triangles).any(axis=1)
+
+    def _sync_sections(self, count):
+        """Trims the cached cross sections of the removed waypoints and adds the missing ones"""
+        first_index = self._horizon.first_index
+        trim = first_index - self._first_index
+        if not 0 <= trim <= len(self._right_points):
+            trim = len(self._right_points)
+        self._right_points = self._right_points[trim:]
+        self._left_points = self._left_points[trim:]
+        self._first_index = first_index
+
+        cached = len(self._right_points)
+        if cached < count:
+            xy = self._horizon.locations(cached, count)[:, :2]
+            right = _right_vectors(self._horizon.rotations(cached, count))
+            self._right_points = np.vstack((self._right_points, xy + self._extents[0] * right))
+            self._left_points = np.vstack((self._left_points, xy + self._extents[1] * right))
+
+
+def box_corners(centers, yaws, extents):
+    """
+    Returns a (N, 4, 2) array with the XY corners of N oriented boxes, in order around the box.
+
+        :param centers: (N, 2) array with the center of the boxes
+        :param yaws: (N,) array with the orientation of the boxes, in degrees
+        :param extents: (N, 2) array with the half length and half width of the boxes
+    """
+    centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+    yaws = np.radians(np.asarray(yaws, dtype=np.float64).reshape(-1))
+    extents = np.asarray(extents, dtype=np.float64).reshape(-1, 2)
+    forward = np.stack((np.cos(yaws), np.sin(yaws)), axis=1) * extents[:, 0:1]
+    right = np.stack((-np.sin(yaws), np.cos(yaws)), axis=1) * extents[:, 1:2]
+    return np.stack((centers + forward + right, centers + forward - right,
+                     centers - forward - right, centers - forward + right), axis=1)
+
+
+def actor_box_corners(actors, transforms):
+    """
+    Returns the (N, 4, 2) corners of the bounding boxes of the actors, seen from above.
+
+        :param actors: list of carla.Actor
+        :param transforms: list with the carla.Transform of each actor
+    """
+    data = np.zeros((len(actors), 5))
+    for i, (actor, transform) in enumerate(zip(actors, transforms)):
+        bounding_box = actor.bounding_box
+        # The box location is relative to the actor
+        yaw = np.radians(transform.rotation.yaw)
+        box_x, box_y = bounding_box.location.x, bounding_box.location.y
+        data[i] = (transform.location.x + box_x * np.cos(yaw) - box_y * np.sin(yaw),
+                   transform.location.y + box_x * np.sin(yaw) + box_y * np.cos(yaw),
+                   transform.rotation.yaw, bounding_box.extent.x, bounding_box.extent.y)
+    return box_corners(data[:, 0:2], data[:, 2], data[:, 3:5])
+
+
+def convex_polygons_overlap(polygons_a, polygons_b):
+    """
+    Returns a (N, M) boolean array telling which pairs of convex polygons overlap, touching included.
+
+        :param polygons_a: (N, Ka, 2) array with N convex polygons of Ka vertices
+        :param polygons_b: (M, Kb, 2) array with M convex polygons of Kb vertices
+    """
+    # Candidate separating axes: the normals of the edges of both polygons
+    axes_a = _edge_normals(polygons_a)
+    axes_b = _edge_normals(polygons_b)
+    num_a, num_b = len(polygons_a), len(polygons_b)
+    axes = np.concatenate((np.broadcast_to(axes_a[:, None], (num_a, num_b) + axes_a.shape[1:]),
+                           np.broadcast_to(axes_b[None], (num_a, num_b) + axes_b.shape[1:])), axis=2)
+
+    projections_a = np.einsum('nmad,nkd->nmak', axes, polygons_a)
+    projections_b = np.einsum('nmad,mkd->nmak', axes, polygons_b)
+    separated = (projections_a.max(axis=3) < projections_b.min(axis=3)) | \
+                (projections_b.max(axis=3) < projections_a.min(axis=3))
+    return ~separated.any(axis=2)
+
+
+def _edge_normals(polygons):
+    """Returns the (not normalized) normals of the edges of an array of polygons"""
+    edges = np.roll(polygons, -1, axis=1) - polygons
+    return np.stack((-edges[..., 1], edges[..., 0]), axis=-1)
+
+
+def _right_vectors(rotations):
+    """XY components of the right vectors of an array of (pitch, yaw, roll) rotations, in degrees"""
+    pitch, yaw, roll = np.radians(rotations).T
+    return np.stack((np.cos(yaw) * np.sin(pitch) * np.sin(roll) - np.sin(yaw) * np.cos(roll),
+                     np.sin(yaw) * np.sin(pitch) * np.sin(roll) + np.cos(yaw) * np.cos(roll)), axis=1)
@@ -0,0 +1,106 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+""" This module contains a uniform grid index to answer spatial queries over sets of points. """
+
+import numpy as np
+
+# Cell coordinates are packed in a single int64 key, as (x cell) * _KEY_STRIDE + (y cell)
+_KEY_STRIDE = 1 << 31
+
+
+class GridIndex(object):
+    """
+    GridIndex buckets a static set of points into square cells of the XY plane, so
+    that radius and nearest neighbor queries only check the points of nearby cells
+    instead of the whole set. Distances are computed with all the coordinates given
+    (2D or 3D), only the bucketing is done on the XY plane.
+
+    The index is immutable, rebuild it when the points change. Building it is a
+    sort of the cell keys, so it is cheap enough to be done once per tick.
+    """
+
+    def __init__(self, points, cell_size):
+        """
+        :param points: array-like of shape (N, 2) or (N, 3) with the point coordinates
+        :param cell_size: side of the grid cells, in meters. A good value is around
+            the radius of the most common queries
+        """
+        self._points = np.asarray(points, dtype=np.float64)
+        if self._points.size == 0:
+            self._points = self._points.reshape(0, 2)
+        self._cell_size = float(cell_size)
+
+        cells = np.floor(self._points[:, :2] / self._cell_size).astype(np.int64)
+        keys = cells[:, 0] * _KEY_STRIDE + cells[:, 1]
+        self._order = np.argsort(keys, kind='stable')
+        self._keys, self._starts, counts = np.unique(keys[self._order], return_index=True, return_counts=True)
+        self._stops = self._starts + counts
+
+    def __len__(self):
+        return len(self._points)
+
+    @property
+    def points(self):
+        """Array with the indexed points"""
+        return self._points
+
+    def query(self, point, radius):
+        """
+        Returns the indices of the points at a distance smaller than or equal
+        to the radius, along with those distances. Both arrays are sorted by distance.
+
+            :param point: coordinates of the query point, with the same dimension as the indexed ones
+            :param radius: search radius, in meters
+        """
+        point = np.asarray(point, dtype=np.float64)
+        candidates = self._candidates(point, radius)
+        if len(candidates) == 0:
+            return candidates, np.empty(0)
+        distances = np.linalg.norm(self._points[candidates] - point, axis=1)
+        inside = distances <= radius
+        candidates, distances = candidates[inside], distances[inside]
+        order = np.argsort(distances, kind='stable')
+        return candidates[order], distances[order]
+
+    def nearest(self, point, max_distance):
+        """
+        Returns the (index, distance) of the point closest to the query point, or
+        (None, inf) if no point is closer than max_distance. Ties are broken by index.
+
+            :param point: coordinates of the query point, with the same dimension as the indexed ones
+            :param max_distance: maximum distance of the nearest point, in meters
+        """
+        point = np.asarray(point, dtype=np.float64)
+        candidates = self._candidates(point, max_distance)
+        if len(candidates) == 0:
+            return None, float('inf')
+        candidates = np.sort(candidates)
+        distances = np.linalg.norm(self._points[candidates] - point, axis=1)
+        closest = int(np.argmin(distances))
+        if distances[closest] > max_distance:
+            return None, float('inf')
+        return int(candidates[closest]), float(distances[closest])
+
+    def _candidates(self, point, radius):
+        """Returns the indices of all the points in the cells overlapping the query square"""
+        low = np.floor((point[:2] - radius) / self._cell_size).astype(np.int64)
+        high = np.floor((point[:2] + radius) / self._cell_size).astype(np.int64)
+        cells_x, cells_y = np.meshgrid(np.arange(low[0], high[0] + 1), np.arange(low[1], high[1] + 1))
+        keys = (cells_x * _KEY_STRIDE + cells_y).ravel()
+
+        slots = _matching_slots(self._keys, keys)
+        if len(slots) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([self._order[start:stop] for start, stop in
+                               zip(self._starts[slots].tolist(), self._stops[slots].tolist())])
+
+
+def _matching_slots(sorted_keys, keys):
+    """Returns the positions in sorted_keys of the keys present in it"""
+    slots = np.searchsorted(sorted_keys, keys)
+    valid = slots < len(sorted_keys)
+    slots, keys = slots[valid], keys[valid]
+    return slots[sorted_keys[slots] == keys]
@@ -0,0 +1,129 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+""" This module contains an index of the traffic lights of the world by the lanes they control,
+shared by the agents of a process. """
+
+import collections
+
+from agents.tools.actor_registry import ActorRegistry
+from agents.tools.misc import get_trafficlight_trigger_location
+
+
+TrafficLightEntry = collections.namedtuple('TrafficLightEntry', [
+    'traffic_light', 'trigger_waypoint', 'trigger_location', 'trigger_direction', 'stop_waypoints', 'lanes'])
+TrafficLightEntry.__doc__ = """
+Data of a traffic light that doesn't change during the episode. 'trigger_location' and 'trigger_direction' are
+(x, y, z) tuples with the location and forward vector of the trigger waypoint, and 'lanes' the (road_id, lane_id)
+pairs of the trigger waypoint and the stop waypoints, that is, the lanes affected by the traffic light.
+"""
+
+
+class TrafficLightIndex(object):
+    """
+    TrafficLightIndex keeps the trigger and stop waypoints of every traffic light of the world, indexed by the
+    (road_id, lane_id) pairs of the lanes they affect, so an agent only checks the traffic lights of the lanes it
+    is driving through instead of all of them.
+
+    The waypoints are computed once per traffic light, when it is first seen, and all the agents of the world
+    share them (see `TrafficLightIndex.for_world`). The traffic lights come from the ActorRegistry of the world,
+    so the index is only updated when actors are spawned or destroyed.
+
+        index = TrafficLightIndex.for_world(world, wmap)
+        index.update()
+        for entry in index.lookup([ego_waypoint] + next_waypoints):
+            ...
+    """
+
+    _shared = dict()  # type: dict[int, TrafficLightIndex]
+
+    def __init__(self, world, wmap=None):
+        """
+        :param world: carla.World whose traffic lights are indexed
+        :param wmap: carla.Map used to compute the trigger waypoints. If None, it is retrieved from the world
+        """
+        self._world = world
+        self._map = wmap if wmap is not None else world.get_map()
+        self._registry = ActorRegistry.for_world(world)
+        self._registry_version = None  # type: int | None
+        self._entries = dict()  # type: dict[int, TrafficLightEntry]
+        self._lanes = dict()  # type: dict[tuple[int, int], list[TrafficLightEntry]]
+
+    @classmethod
+    def for_world(cls, world, wmap=None):
+        """Returns the index shared by all the agents of the given world"""
+        index = cls._shared.get(world.id)
+        if index is None:
+            index = cls._shared[world.id] = cls(world, wmap)
+        return index
+
+    def __len__(self):
+        return len(self._entries)
+
+    def update(self):
+        """Adds the traffic lights that appeared since the last update and removes the ones that disappeared"""
+        self._registry.update()
+        if self._registry.version == self._registry_version:
+            return
+        self._registry_version = self._registry.version
+
+        traffic_lights = self._registry.traffic_lights
+        ids = traffic_lights.get_ids().tolist()
+        if set(ids) == set(self._entries):
+            return
+        alive = set(ids)
+        for light_id in [light_id for light_id in self._entries if light_id not in alive]:
+            del self._entries[light_id]
+        for position, light_id in enumerate(ids):
+            if light_id not in self._entries:
+                self._entries[light_id] = self._make_entry(traffic_lights[position])
+
+        self._lanes = dict()
+        for light_id in sorted(self._entries):
+            entry = self._entries[light_id]
+            for lane in entry.lanes:
+                self._lanes.setdefault(lane, []).append(entry)
+
+    def entry(self, traffic_light):
+        """Returns the TrafficLightEntry of a traffic light, computing it if the traffic light isn't indexed yet"""
+        entry = self._entries.get(traffic_light.id)
+        if entry is None:
+            entry = self._entries[traffic_light.id] = self._make_entry(traffic_light)
+            for lane in entry.lanes:
+                self._lanes.setdefault(lane, []).append(entry)
+        return entry
+
+    def lights_on_lane(self, road_id, lane_id):
+        """Returns the list of TrafficLightEntry of the traffic lights affecting a lane"""
+        return self._lanes.get((road_id, lane_id), [])
+
+    def lookup(self, waypoints):
+        """
+        Returns the list of TrafficLightEntry of the traffic lights affecting the lanes of any of the waypoints,
+        without repetitions and in the order of the waypoints
+        """
+        entries = []
+        seen = set()
+        for waypoint in waypoints:
+            for entry in self._lanes.get((waypoint.road_id, waypoint.lane_id), ()):
+                if entry.traffic_light.id not in seen:
+                    seen.add(entry.traffic_light.id)
+                    entries.append(entry)
+        return entries
+
+    def _make_entry(self, traffic_light):
+        """Computes the waypoints of a traffic light"""
+        trigger_waypoint = self._map.get_waypoint(get_trafficlight_trigger_location(traffic_light))
+        stop_waypoints = list(traffic_light.get_stop_waypoints())
+        lanes = []
+        for waypoint in [trigger_waypoint] + stop_waypoints:
+            lane = (waypoint.road_id, waypoint.lane_id)
+            if lane not in lanes:
+                lanes.append(lane)
+        transform = trigger_waypoint.transform
+        location, direction = transform.location, transform.get_forward_vector()
+        return TrafficLightEntry(
+            traffic_light, trigger_waypoint, (location.x, location.y, location.z),
+            (direction.x, direction.y, direction.z), stop_waypoints, tuple(lanes))
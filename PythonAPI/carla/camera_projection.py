@@ -0,0 +1,347 @@
+# Copyright (c) 2019 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Projection of 3D points on the image of a camera.
+
+CameraProjection keeps the intrinsic matrix of a camera, built once from its resolution and
+field of view, and projects arrays of points given in world coordinates, or in the coordinates
+of any other actor, with a single matrix product:
+
+    projection = CameraProjection.from_blueprint(camera_bp)
+    # LiDAR points straight to the image, in a single (3, 4) matrix
+    points_2d = projection.project(lidar_data.to_numpy(), camera.get_transform(), lidar.get_transform())
+    projection.splat(image_array, points_2d, colors, size=2)
+
+    # The 3D and 2D bounding boxes of many actors at once
+    boxes = BoundingBoxes(world.get_actors().filter('vehicle.*'))
+    ids, corners = boxes.corners(world.get_snapshot())
+    corners_2d, visible, boxes_2d = projection.project_boxes(corners, camera.get_transform())
+
+The projected points are (u, v, depth) rows: the pixel coordinates and the distance to the
+camera plane, in meters. Points behind the camera have a negative depth.
+"""
+
+import numpy as np
+
+
+# Changes from UE4's coordinate system (x forward, y right, z up) to the one of the image
+# (x right, y down, z forward): (x, y, z) -> (y, -z, x)
+UE4_TO_CAMERA = np.array([
+    [0.0, 1.0, 0.0, 0.0],
+    [0.0, 0.0, -1.0, 0.0],
+    [1.0, 0.0, 0.0, 0.0],
+    [0.0, 0.0, 0.0, 1.0]])
+
+
+def intrinsic_matrix(width, height, fov):
+    """
+    Returns the (3, 3) intrinsic matrix K of a camera:
+
+        K = [[f, 0, width / 2],
+             [0, f, height / 2],
+             [0, 0,          1]]
+
+    where the focal length f is the same for both axes, as pixels are square.
+
+        :param width: width of the image, in pixels
+        :param height: height of the image, in pixels
+        :param fov: horizontal field of view, in degrees
+    """
+    focal = width / (2.0 * np.tan(fov * np.pi / 360.0))
+    matrix = np.identity(3)
+    matrix[0, 0] = matrix[1, 1] = focal
+    matrix[0, 2] = width / 2.0
+    matrix[1, 2] = height / 2.0
+    return matrix
+
+
+def transform_matrices(transforms, inverse=False):
+    """
+    Returns the (4, 4) matrix of a carla.Transform, or a (N, 4, 4) array with the matrices of
+    a list of them.
+
+        :param transforms: carla.Transform or list of carla.Transform
+        :param inverse: whether to return the inverse matrices, which change from world
+            coordinates to the coordinates of the transform
+    """
+    if not isinstance(transforms, (list, tuple)):
+        return np.array(transforms.get_inverse_matrix() if inverse else transforms.get_matrix())
+    if inverse:
+        return np.array([transform.get_inverse_matrix() for transform in transforms]).reshape(-1, 4, 4)
+    return np.array([transform.get_matrix() for transform in transforms]).reshape(-1, 4, 4)
+
+
+# Signs of the extent of the 8 corners of a bounding box: the 4 bottom ones, then the 4 top ones
+BOX_CORNERS = np.array([
+    [1.0, 1.0, -1.0],
+    [-1.0, 1.0, -1.0],
+    [-1.0, -1.0, -1.0],
+    [1.0, -1.0, -1.0],
+    [1.0, 1.0, 1.0],
+    [-1.0, 1.0, 1.0],
+    [-1.0, -1.0, 1.0],
+    [1.0, -1.0, 1.0]])
+
+
+def rotation_matrices(rotations):
+    """
+    Returns the (N, 3, 3) rotation matrices of a (N, 3) array of (pitch, yaw, roll) rotations,
+    in degrees, the same as the ones of carla.Transform.get_matrix
+    """
+    pitch, yaw, roll = np.radians(np.asarray(rotations, dtype=np.float64).reshape(-1, 3)).T
+    c_p, s_p = np.cos(pitch), np.sin(pitch)
+    c_y, s_y = np.cos(yaw), np.sin(yaw)
+    c_r, s_r = np.cos(roll), np.sin(roll)
+    return np.stack((
+        np.stack((c_p * c_y, c_y * s_p * s_r - s_y * c_r, -c_y * s_p * c_r - s_y * s_r), axis=1),
+        np.stack((s_y * c_p, s_y * s_p * s_r + c_y * c_r, -s_y * s_p * c_r + c_y * s_r), axis=1),
+        np.stack((s_p, -c_p * s_r, c_p * c_r), axis=1)), axis=1)
+
+
+def box_corners(locations, rotations, box_locations, box_rotations, extents):
+    """
+    Returns the (N, 8, 3) world coordinates of the corners of N bounding boxes, in the order of
+    BOX_CORNERS.
+
+        :param locations: (N, 3) array with the location of the actors
+        :param rotations: (N, 3) array with the (pitch, yaw, roll) of the actors, in degrees
+        :param box_locations: (N, 3) array with the location of the boxes, relative to the actors
+        :param box_rotations: (N, 3) array with the rotation of the boxes, relative to the actors
+        :param extents: (N, 3) array with the half sizes of the boxes
+    """
+    actor_rotations = rotation_matrices(rotations)
+    # Corners relative to the actor, then to the world
+    corners = np.einsum('nij,knj->nki', rotation_matrices(box_rotations),
+                        BOX_CORNERS[:, None, :] * np.asarray(extents).reshape(-1, 3))
+    corners += np.asarray(box_locations).reshape(-1, 1, 3)
+    corners = np.einsum('nij,nkj->nki', actor_rotations, corners)
+    corners += np.asarray(locations).reshape(-1, 1, 3)
+    return corners
+
+
+class BoundingBoxes(object):
+    """
+    BoundingBoxes keeps the bounding boxes of a list of actors, read once as they don't change,
+    to compute the corners of all of them at once with the transforms of a carla.WorldSnapshot.
+    """
+
+    def __init__(self, actors):
+        """
+        :param actors: list of carla.Actor
+        """
+        self.ids = []
+        box_data = []
+        for actor in actors:
+            bounding_box = actor.bounding_box
+            location, rotation, extent = bounding_box.location, bounding_box.rotation, bounding_box.extent
+            self.ids.append(actor.id)
+            box_data.append((location.x, location.y, location.z,
+                             rotation.pitch, rotation.yaw, rotation.roll,
+                             extent.x, extent.y, extent.z))
+        self._box_data = np.array(box_data, dtype=np.float64).reshape(-1, 9)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def corners(self, snapshot):
+        """
+        Returns the ids of the actors present in the snapshot, and the (N, 8, 3) world
+        coordinates of the corners of their boxes.
+
+            :param snapshot: carla.WorldSnapshot with the transforms of the actors
+        """
+        ids = []
+        rows = []
+        transforms = []
+        for row, actor_id in enumerate(self.ids):
+            actor_snapshot = snapshot.find(actor_id)
+            if actor_snapshot is None:
+                continue
+            transform = actor_snapshot.get_transform()
+            location, rotation = transform.location, transform.rotation
+            ids.append(actor_id)
+            rows.append(row)
+            transforms.append((location.x, location.y, location.z, rotation.pitch, rotation.yaw, rotation.roll))
+        transforms = np.array(transforms, dtype=np.float64).reshape(-1, 6)
+        box_data = self._box_data[rows]
+        return ids, box_corners(transforms[:, 0:3], transforms[:, 3:6],
+                                box_data[:, 0:3], box_data[:, 3:6], box_data[:, 6:9])
+
+
+class CameraProjection(object):
+    """
+    CameraProjection projects 3D points on the image of a camera of the given resolution and
+    field of view.
+
+    Points are projected in float32 and can be written to a preallocated array, so that
+    projecting the millions of points of a few LiDAR frames doesn't allocate a float64 copy
+    of each intermediate step.
+    """
+
+    def __init__(self, width, height, fov):
+        """
+        :param width: width of the image, in pixels
+        :param height: height of the image, in pixels
+        :param fov: horizontal field of view, in degrees
+        """
+        self.width = int(width)
+        self.height = int(height)
+        self.fov = float(fov)
+        self.intrinsic = intrinsic_matrix(self.width, self.height, self.fov)
+        # From camera coordinates to homogeneous pixel coordinates
+        self._camera_to_image = np.dot(self.intrinsic, UE4_TO_CAMERA[:3])
+
+    @classmethod
+    def from_blueprint(cls, blueprint):
+        """Creates the projection of the camera of a carla.ActorBlueprint"""
+        return cls(blueprint.get_attribute('image_size_x').as_int(),
+                   blueprint.get_attribute('image_size_y').as_int(),
+                   blueprint.get_attribute('fov').as_float())
+
+    @classmethod
+    def from_camera(cls, camera):
+        """Creates the projection of a camera sensor, from the attributes of the actor"""
+        attributes = camera.attributes
+        return cls(int(attributes['image_size_x']), int(attributes['image_size_y']), float(attributes['fov']))
+
+    def projection_matrix(self, camera_transform, points_transform=None):
+        """
+        Returns the (3, 4) matrix that projects homogeneous points to homogeneous pixel
+        coordinates, or a (N, 3, 4) array of them if a list of camera transforms is given.
+
+            :param camera_transform: carla.Transform of the camera, or list of them
+            :param points_transform: carla.Transform of the points, if they are relative to an
+                actor, like LiDAR points. None if they are in world coordinates
+        """
+        matrix = np.matmul(self._camera_to_image, transform_matrices(camera_transform, inverse=True))
+        if points_transform is not None:
+            matrix = np.matmul(matrix, transform_matrices(points_transform))
+        return matrix.astype(np.float32)
+
+    def project(self, points, camera_transform, points_transform=None, out=None):
+        """
+        Projects points on the image. Returns a (N, 3) float32 array with the (u, v, depth) of
+        each point, or a (M, N, 3) one if a list of M camera transforms is given.
+
+            :param points: (N, 3) array with the points, or (N, K) with the points in the first
+                three columns, like the (N, 4) arrays of LiDAR measurements
+            :param camera_transform: carla.Transform of the camera, or list of them
+            :param points_transform: carla.Transform of the points if they are relative to an
+                actor, see `projection_matrix`
+            :param out: (N, 3) float32 array where the result is written, to avoid allocating
+                a new one. Only for a single camera transform
+        """
+        matrix = self.projection_matrix(camera_transform, points_transform)
+        return self.project_with_matrix(points, matrix, out)
+
+    @staticmethod
+    def project_with_matrix(points, matrix, out=None):
+        """
+        Same as `project`, with a matrix returned by `projection_matrix`. The matrix can be
+        reused to project several arrays of points with the same camera and point transforms.
+        """
+        points = np.asarray(points)
+        if points.dtype != np.float32:
+            points = points.astype(np.float32)
+        xyz = points[..., :3]
+        rotation = np.swapaxes(matrix[..., :3], -1, -2)
+        if matrix.ndim == 2:
+            out = np.dot(xyz, rotation, out=out)
+            out += matrix[:, 3]
+        else:
+            out = np.matmul(xyz, rotation)
+            out += matrix[:, None, :, 3]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out[..., 0] /= out[..., 2]
+            out[..., 1] /= out[..., 2]
+        return out
+
+    def visible(self, points_2d, min_depth=0.0, max_depth=np.inf):
+        """Returns the mask of the projected points that are inside the image and in front of the camera"""
+        u_coord, v_coord, depth = points_2d[..., 0], points_2d[..., 1], points_2d[..., 2]
+        return (depth > min_depth) & (depth < max_depth) & \
+            (u_coord >= 0.0) & (u_coord < self.width) & \
+            (v_coord >= 0.0) & (v_coord < self.height)
+
+    def project_boxes(self, corners, camera_transform, min_depth=0.0, max_depth=np.inf):
+        """
+        Projects the corners of many bounding boxes at once, and culls the ones that are not in
+        the view of the camera. Returns:
+
+            - (N, 8, 3) float32 array with the (u, v, depth) of the corners of each box
+            - (N,) mask of the boxes that are in the view: all their corners are in front of
+              the camera, within the depth range, and the box overlaps the image
+            - (N, 4) float32 array with the 2D boxes, as (x_min, y_min, x_max, y_max), clipped
+              to the image. Only valid for the boxes in the view
+
+            :param corners: (N, 8, 3) world coordinates of the corners, see `BoundingBoxes.corners`
+            :param camera_transform: carla.Transform of the camera
+            :param min_depth: minimum distance to the camera plane of the corners, in meters
+            :param max_depth: maximum distance to the camera plane of the corners, in meters
+        """
+        corners = np.asarray(corners).reshape(-1, 8, 3)
+        corners_2d = self.project(corners.reshape(-1, 3), camera_transform).reshape(-1, 8, 3)
+        depth = corners_2d[:, :, 2]
+        in_depth = np.all((depth > min_depth) & (depth < max_depth), axis=1)
+
+        boxes_2d = np.concatenate((corners_2d[:, :, :2].min(axis=1), corners_2d[:, :, :2].max(axis=1)), axis=1)
+        visible = in_depth & (boxes_2d[:, 2] >= 0.0) & (boxes_2d[:, 0] < self.width) & \
+            (boxes_2d[:, 3] >= 0.0) & (boxes_2d[:, 1] < self.height)
+        np.clip(boxes_2d[:, 0::2], 0.0, self.width, out=boxes_2d[:, 0::2])
+        np.clip(boxes_2d[:, 1::2], 0.0, self.height, out=boxes_2d[:, 1::2])
+        return corners_2d, visible, boxes_2d
+
+    def splat(self, image, points_2d, colors, size=1, zbuffer=None):
+        """
+        Draws the projected points on an image as squares of size x size pixels. Where several
+        points overlap, the pixel takes the color of the closest one. Returns the number of
+        pixels drawn.
+
+            :param image: (height, width, C) array where the points are drawn
+            :param points_2d: (N, 3) array of projected points, see `project`
+            :param colors: (N, C) array with the color of each point, or a single color
+            :param size: side of the squares, in pixels
+            :param zbuffer: (height, width) float32 array with the depth of the pixels already
+                drawn, initially +inf. Points behind them are not drawn and it is updated with
+                the new ones, so that several splats on the same image keep the closest points
+        """
+        mask = self.visible(points_2d)
+        points_2d = points_2d[mask]
+        colors = np.asarray(colors)
+        if colors.ndim > 1:
+            colors = colors[mask]
+        colors = np.broadcast_to(colors, (len(points_2d), image.shape[2]))
+
+        # Pixels covered by each point, from -size/2 to size/2 around it
+        offsets = np.arange(size) - size // 2
+        u_coord = points_2d[:, 0].astype(np.int64)[:, None] + offsets
+        v_coord = points_2d[:, 1].astype(np.int64)[:, None] + offsets
+        u_coord = np.broadcast_to(u_coord[:, None, :], (len(points_2d), size, size)).reshape(-1)
+        v_coord = np.broadcast_to(v_coord[:, :, None], (len(points_2d), size, size)).reshape(-1)
+        point_index = np.repeat(np.arange(len(points_2d)), size * size)
+        inside = (u_coord >= 0) & (u_coord < self.width) & (v_coord >= 0) & (v_coord < self.height)
+        pixels = (v_coord * self.width + u_coord)[inside]
+        point_index = point_index[inside]
+        depth = points_2d[point_index, 2]
+
+        if zbuffer is not None:
+            in_front = depth < zbuffer[pixels // self.width, pixels % self.width]
+            pixels, point_index, depth = pixels[in_front], point_index[in_front], depth[in_front]
+
+        # The closest point of each pixel is the first one after sorting by pixel and depth
+        order = np.lexsort((depth, pixels))
+        pixels = pixels[order]
+        first = np.ones(len(pixels), dtype=bool)
+        first[1:] = pixels[1:] != pixels[:-1]
+        pixels = pixels[first]
+        closest = order[first]
+
+        v_coord, u_coord = np.divmod(pixels, self.width)
+        image[v_coord, u_coord] = colors[point_index[closest]]
+        if zbuffer is not None:
+            zbuffer[v_coord, u_coord] = depth[closest]
+        return len(pixels)
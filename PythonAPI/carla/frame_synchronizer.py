@@ -0,0 +1,308 @@
+# Copyright (c) 2019 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Frame synchronization of the data streams of the world and its sensors.
+
+The server sends the world snapshot and the data of every sensor in parallel, so the client
+receives them in any order and from different threads. FrameSynchronizer gathers them by frame:
+
+    synchronizer = FrameSynchronizer()
+    synchronizer.add_world(world)
+    synchronizer.add_sensor(camera, 'camera')
+    synchronizer.add_sensor(lidar, 'lidar')
+
+    frame = world.tick()
+    bundle = synchronizer.get(frame, timeout=1.0)
+    if bundle.complete:
+        snapshot, image, point_cloud = bundle['world'], bundle['camera'], bundle['lidar']
+
+Every stream keeps a bounded number of pending frames, and the waiting thread is only woken up
+once the requested frame is complete, not for every piece of data received. CarlaSyncMode is
+the context manager of the examples, built on top of it.
+"""
+
+import collections
+import threading
+import time
+
+import carla
+
+
+# What to do with the new data of a stream that already has the maximum pending frames
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+
+
+class SynchronizationTimeout(RuntimeError):
+    """Raised when a frame is not complete in time and partial bundles are not accepted"""
+
+
+class StreamStats(object):
+    """
+    Counters of a stream of a FrameSynchronizer. The latency is the time between the request
+    of a frame (see `FrameSynchronizer.request`) and the arrival of its data, in seconds, and
+    it is zero for data that arrived before the request.
+    """
+
+    def __init__(self):
+        self.received = 0  # Data received
+        self.delivered = 0  # Data returned in a bundle
+        self.dropped = 0  # Data discarded by the drop policy
+        self.stale = 0  # Data of a frame older than the last one returned
+        self.missing = 0  # Bundles returned without data of this stream
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    @property
+    def latency_mean(self):
+        """Mean latency, in seconds"""
+        return self.latency_sum / self.delivered if self.delivered else 0.0
+
+    def __repr__(self):
+        return ('StreamStats(received={}, delivered={}, dropped={}, stale={}, missing={}, '
+                'latency_mean={:.4f}, latency_max={:.4f})').format(
+                    self.received, self.delivered, self.dropped, self.stale, self.missing,
+                    self.latency_mean, self.latency_max)
+
+
+class FrameBundle(collections.namedtuple('FrameBundle', ['frame', 'data', 'missing'])):
+    """
+    Data of all the streams for a frame. 'data' is an ordered dictionary with the data of each
+    stream, None for the missing ones, whose names are also listed in 'missing'.
+    """
+    __slots__ = ()
+
+    @property
+    def complete(self):
+        """Whether or not all the streams are present"""
+        return not self.missing
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return tuple.__getitem__(self, key)
+        return self.data[key]
+
+    def values(self):
+        """List with the data of each stream, in the order they were added"""
+        return list(self.data.values())
+
+
+class FrameSynchronizer(object):
+    """
+    FrameSynchronizer collects the data of several streams (the world ticks and any amount of
+    sensors) and bundles them by frame.
+
+    Each stream has a slot per pending frame, up to max_pending_frames. When a stream receives a
+    frame and its slots are full, the drop policy decides whether its oldest pending frame
+    (DROP_OLDEST) or the new one (DROP_NEWEST) is discarded. Once a frame is returned, its data
+    and the data of older frames are released, and any data of those frames arriving later is
+    discarded as stale without waking up the waiting thread.
+    """
+
+    def __init__(self, max_pending_frames=4, drop_policy=DROP_OLDEST):
+        """
+        :param max_pending_frames: maximum number of frames kept by each stream
+        :param drop_policy: DROP_OLDEST or DROP_NEWEST
+        """
+        if drop_policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError("Unknown drop policy '{}'".format(drop_policy))
+        self._max_pending_frames = max(1, max_pending_frames)
+        self._drop_policy = drop_policy
+
+        self._condition = threading.Condition()
+        self._slots = collections.OrderedDict()  # type: collections.OrderedDict[str, dict[int, tuple]]
+        self._stats = collections.OrderedDict()  # type: collections.OrderedDict[str, StreamStats]
+        self._ready = dict()  # type: dict[int, int] # Amount of streams with data of each frame
+        self._request_times = dict()  # type: dict[int, float]
+        self._waiting_frame = None
+        self._last_frame = -1  # Last frame returned
+
+        self._world_callbacks = []  # type: list[tuple[carla.World, int]]
+        self._sensors = []  # type: list[carla.Sensor]
+
+    @property
+    def names(self):
+        """Names of the streams, in the order they were added"""
+        return list(self._slots)
+
+    def add_stream(self, name):
+        """
+        Adds a stream and returns the callback that receives its data. Data must have a 'frame'
+        attribute, as carla.SensorData and carla.WorldSnapshot do.
+        """
+        with self._condition:
+            if name in self._slots:
+                raise ValueError("Stream '{}' already exists".format(name))
+            self._slots[name] = dict()
+            self._stats[name] = StreamStats()
+        return lambda data: self._on_data(name, data)
+
+    def add_sensor(self, sensor, name=None):
+        """Adds a stream fed by the given sensor. By default, it is named after the sensor id"""
+        name = str(sensor.id) if name is None else name
+        sensor.listen(self.add_stream(name))
+        self._sensors.append(sensor)
+        return name
+
+    def add_world(self, world, name='world'):
+        """Adds a stream fed by the snapshots of the world ticks"""
+        callback_id = world.on_tick(self.add_stream(name))
+        self._world_callbacks.append((world, callback_id))
+        return name
+
+    def close(self):
+        """Stops the sensors and removes the world callbacks added to the synchronizer"""
+        for sensor in self._sensors:
+            if sensor.is_listening:
+                sensor.stop()
+        for world, callback_id in self._world_callbacks:
+            world.remove_on_tick(callback_id)
+        self._sensors = []
+        self._world_callbacks = []
+
+    def request(self, frame):
+        """
+        Marks the time the frame was requested, used to measure the latency of the streams.
+        `get` calls it if it wasn't called before, but it is more accurate to call it right
+        before (or after) ticking the world.
+        """
+        with self._condition:
+            self._request_times.setdefault(frame, time.time())
+
+    def get(self, frame, timeout=None, partial=True):
+        """
+        Waits until all the streams have data of the frame, or until the timeout expires,
+        and returns the FrameBundle of the frame.
+
+            :param frame: frame to retrieve
+            :param timeout: maximum time to wait, in seconds. None waits forever
+            :param partial: if False, raises SynchronizationTimeout instead of returning an
+                incomplete bundle
+        """
+        self.request(frame)
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            self._waiting_frame = frame
+            try:
+                while self._ready.get(frame, 0) < len(self._slots):
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+            finally:
+                self._waiting_frame = None
+
+            request_time = self._request_times[frame]
+            data = collections.OrderedDict()
+            missing = []
+            for name, slots in self._slots.items():
+                stats = self._stats[name]
+                data[name], arrival = slots.pop(frame, (None, None))
+                if arrival is None:
+                    missing.append(name)
+                    stats.missing += 1
+                else:
+                    latency = max(0.0, arrival - request_time)
+                    stats.delivered += 1
+                    stats.latency_sum += latency
+                    stats.latency_max = max(stats.latency_max, latency)
+            self._release(frame)
+
+        if missing and not partial:
+            raise SynchronizationTimeout("Frame {} timed out waiting for {}".format(frame, ', '.join(missing)))
+        return FrameBundle(frame, data, missing)
+
+    def stats(self):
+        """Returns a dictionary with the StreamStats of each stream"""
+        with self._condition:
+            return collections.OrderedDict(self._stats)
+
+    def _on_data(self, name, data):
+        """Stores the data received by a stream, waking up the waiting thread if it completes its frame"""
+        arrival = time.time()
+        frame = data.frame
+        with self._condition:
+            slots = self._slots[name]
+            stats = self._stats[name]
+            stats.received += 1
+            if frame <= self._last_frame:
+                stats.stale += 1
+                return
+
+            if frame not in slots and len(slots) >= self._max_pending_frames:
+                if self._drop_policy == DROP_NEWEST:
+                    stats.dropped += 1
+                    return
+                oldest = min(slots)
+                del slots[oldest]
+                self._ready[oldest] -= 1
+                stats.dropped += 1
+
+            if frame not in slots:
+                self._ready[frame] = self._ready.get(frame, 0) + 1
+            slots[frame] = (data, arrival)
+
+            if frame == self._waiting_frame and self._ready[frame] == len(self._slots):
+                self._condition.notify_all()
+
+    def _release(self, frame):
+        """Discards the data of the frame and older ones"""
+        self._last_frame = max(self._last_frame, frame)
+        for slots in self._slots.values():
+            for old_frame in [f for f in slots if f <= frame]:
+                del slots[old_frame]
+        for old_frame in [f for f in self._ready if f <= frame]:
+            del self._ready[old_frame]
+        for old_frame in [f for f in self._request_times if f <= frame]:
+            del self._request_times[old_frame]
+
+
+class CarlaSyncMode(object):
+    """
+    Context manager to synchronize output from different sensors. Synchronous
+    mode is enabled as long as we are inside this context
+
+        with CarlaSyncMode(world, sensors) as sync_mode:
+            while True:
+                data = sync_mode.tick(timeout=1.0)
+
+    The first element of the data is the world snapshot, followed by the data of each
+    sensor. Extra keyword arguments are passed to the FrameSynchronizer.
+    """
+
+    def __init__(self, world, *sensors, **kwargs):
+        self.world = world
+        self.sensors = sensors
+        self.frame = None
+        self.delta_seconds = 1.0 / kwargs.pop('fps', 20)
+        self.synchronizer = FrameSynchronizer(**kwargs)
+        self._settings = None
+
+    def __enter__(self):
+        self._settings = self.world.get_settings()
+        self.frame = self.world.apply_settings(carla.WorldSettings(
+            no_rendering_mode=False,
+            synchronous_mode=True,
+            fixed_delta_seconds=self.delta_seconds))
+
+        self.synchronizer.add_world(self.world)
+        for index, sensor in enumerate(self.sensors):
+            self.synchronizer.add_sensor(sensor, 'sensor{}'.format(index))
+        return self
+
+    def tick(self, timeout, partial=False):
+        """
+        Ticks the world and returns the list with the data of the new frame.
+        If partial is True, missing data is returned as None instead of raising SynchronizationTimeout.
+        """
+        self.frame = self.world.tick()
+        self.synchronizer.request(self.frame)
+        return self.synchronizer.get(self.frame, timeout, partial=partial).values()
+
+    def __exit__(self, *args, **kwargs):
+        self.synchronizer.close()
+        self.world.apply_settings(self._settings)
@@ -0,0 +1,376 @@
+# Copyright (c) 2021 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Tiled, multi-resolution rendering of the top view of a town.
+
+The road network is first recorded as a list of drawing primitives in world coordinates, a
+MapGeometry, which is much faster than drawing it and small enough to be cached and shared with
+other processes. The primitives are then drawn on demand into the square tiles of a pyramid of
+resolutions, where level 0 has the full resolution and each level halves the resolution of the
+previous one. Tiles are rendered in a pool of processes and saved as PNG files, so only the tiles
+that are needed get rendered, and only once:
+
+    geometry = MapGeometry(offset=(min_x, min_y), width=width, pixels_per_meter=12)
+    geometry.polygon((46, 52, 54), road_points)
+    geometry.save(os.path.join(directory, GEOMETRY_FILENAME))
+
+    with TileCache(directory, geometry) as tiles:
+        tiles.request(tiles.tiles_in_rect(0, pygame.Rect(0, 0, 1280, 720)))
+        surface = tiles.get(0, 0, 0)  # None until the tile has been rendered
+
+Each cache directory holds the geometry and the tiles of a single map, so the renders of several
+towns, or of several versions of the same town, can live side by side.
+"""
+
+import collections
+import math
+import multiprocessing
+import os
+import pickle
+import re
+import signal
+import time
+
+import numpy as np
+import pygame
+
+
+GEOMETRY_FILENAME = 'geometry.pickle'
+GEOMETRY_VERSION = 1
+
+POLYGON, LINES, TEXT = range(3)
+
+_TILE_FILENAME = re.compile(r'^(\d+)_(\d+)\.png$')
+_TEMPORARY_FILENAME = re.compile(r'^\d+_\d+\.\d+\.tmp\.png$')
+
+# Temporary files older than this, in seconds, were left by a rendering process that was
+# terminated, while the newer ones may still belong to another process using the same cache
+_STALE_TEMPORARY_AGE = 60.0
+
+Primitive = collections.namedtuple('Primitive', ['kind', 'color', 'width', 'points', 'extra'])
+
+
+def split_dashes(points, length, period):
+    """
+    Splits a polyline into dashes of the given length, one at the start of each period, all of
+    them in world units. Returns the list of the points of each dash.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(points) < 2:
+        return []
+    distances = np.concatenate([[0.0], np.cumsum(np.linalg.norm(np.diff(points, axis=0), axis=1))])
+    dashes = []
+    for start in np.arange(0.0, distances[-1], period):
+        end = min(start + length, distances[-1])
+        inner = points[(distances > start) & (distances < end)]
+        first = [np.interp(start, distances, points[:, axis]) for axis in range(2)]
+        last = [np.interp(end, distances, points[:, axis]) for axis in range(2)]
+        dashes.append(np.vstack([first, inner, last]))
+    return dashes
+
+
+class MapGeometry(object):
+    """
+    MapGeometry records the primitives drawn by the renderer of a map, with the same arguments
+    as pygame.draw but with points in world coordinates, to draw them later at any resolution.
+    Widths are given in pixels at the full resolution.
+    """
+
+    def __init__(self, offset, width, pixels_per_meter, background=(85, 87, 83)):
+        """
+        :param offset: world coordinates (x, y) of the top left corner of the map
+        :param width: width and height of the map, in meters
+        :param pixels_per_meter: resolution of the level 0 of the tiles
+        :param background: color of the parts of the map without anything drawn
+        """
+        self.offset = (float(offset[0]), float(offset[1]))
+        self.width = float(width)
+        self.pixels_per_meter = pixels_per_meter
+        self.background = tuple(background)
+        self.primitives = []  # type: list[Primitive]
+        self._bounds = []  # type: list[tuple[float, float, float, float]]
+        self._bounds_array = None
+
+    @property
+    def width_in_pixels(self):
+        """Width and height of the map at the full resolution"""
+        return int(math.ceil(self.width * self.pixels_per_meter))
+
+    def polygon(self, color, points, width=0):
+        """Records a polygon, filled if the width is 0"""
+        self._add(POLYGON, color, width, points, None, width / float(self.pixels_per_meter))
+
+    def lines(self, color, closed, points, width=1):
+        """Records a sequence of connected lines"""
+        self._add(LINES, color, width, points, closed, width / float(self.pixels_per_meter))
+
+    def line(self, color, start, end, width=1):
+        """Records a single line"""
+        self.lines(color, False, [start, end], width)
+
+    def text(self, color, text, center, size, angle=0.0, bold=False, stretch=1.0):
+        """
+        Records a text
+
+            :param center: world coordinates (x, y) of the center of the text
+            :param size: height of the font, in meters
+            :param angle: counterclockwise rotation of the text, in degrees
+            :param stretch: factor applied to the height of the rendered text
+        """
+        extent = size * max(len(text), stretch)
+        self._add(TEXT, color, 0, [center], (text, size, angle, bold, stretch), extent)
+
+    def query(self, min_x, min_y, max_x, max_y):
+        """Returns the sorted indices of the primitives that may be drawn inside a rectangle"""
+        if self._bounds_array is None or len(self._bounds_array) != len(self._bounds):
+            self._bounds_array = np.array(self._bounds, dtype=np.float32).reshape(-1, 4)
+        bounds = self._bounds_array
+        inside = (bounds[:, 0] <= max_x) & (bounds[:, 2] >= min_x) & \
+            (bounds[:, 1] <= max_y) & (bounds[:, 3] >= min_y)
+        return np.nonzero(inside)[0]
+
+    def save(self, path):
+        """Saves the geometry into a file, atomically so readers never see a partial file"""
+        state = (GEOMETRY_VERSION, self.offset, self.width, self.pixels_per_meter, self.background,
+                 [tuple(primitive) for primitive in self.primitives], self._bounds)
+        temporary_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(temporary_path, 'wb') as geometry_file:
+            pickle.dump(state, geometry_file, protocol=2)
+        _replace(temporary_path, path)
+
+    @staticmethod
+    def load(path):
+        """Loads a geometry saved by save, returning None if it has an older format"""
+        with open(path, 'rb') as geometry_file:
+            state = pickle.load(geometry_file)
+        if state[0] != GEOMETRY_VERSION:
+            return None
+        geometry = MapGeometry(state[1], state[2], state[3], state[4])
+        geometry.primitives = [Primitive(*primitive) for primitive in state[5]]
+        geometry._bounds = state[6]  # pylint: disable=protected-access
+        return geometry
+
+    def _add(self, kind, color, width, points, extra, margin):
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+        if len(points) == 0:
+            return
+        self.primitives.append(Primitive(kind, tuple(color), width, points, extra))
+        (min_x, min_y), (max_x, max_y) = points.min(axis=0).tolist(), points.max(axis=0).tolist()
+        self._bounds.append((min_x - margin, min_y - margin, max_x + margin, max_y + margin))
+
+
+def render_tile(geometry, level, tile_x, tile_y, tile_size):
+    """Draws the tile of a level of the pyramid into a new surface"""
+    scale = 0.5 ** level
+    pixels_per_meter = geometry.pixels_per_meter * scale
+    origin = np.array([tile_x * tile_size, tile_y * tile_size])
+    min_x = geometry.offset[0] + origin[0] / pixels_per_meter
+    min_y = geometry.offset[1] + origin[1] / pixels_per_meter
+    extent = tile_size / pixels_per_meter
+
+    surface = pygame.Surface((tile_size, tile_size))
+    surface.fill(geometry.background)
+    offset = np.array(geometry.offset)
+    for index in geometry.query(min_x, min_y, min_x + extent, min_y + extent):
+        primitive = geometry.primitives[index]
+        # Pixels are floored in the coordinates of the whole level, so neighbour tiles agree
+        pixels = (np.floor((primitive.points - offset) * pixels_per_meter) - origin).astype(int).tolist()
+        width = max(1, int(round(primitive.width * scale))) if primitive.width > 0 else 0
+        if primitive.kind == POLYGON:
+            if len(pixels) > 2:
+                pygame.draw.polygon(surface, primitive.color, pixels, width)
+        elif primitive.kind == LINES:
+            if len(pixels) > 1:
+                pygame.draw.lines(surface, primitive.color, primitive.extra, pixels, width)
+        elif primitive.kind == TEXT:
+            _draw_text(surface, primitive, pixels[0], pixels_per_meter)
+    return surface
+
+
+class TileCache(object):
+    """
+    TileCache keeps the tiles of a map: the ones used recently in memory, all the rendered ones
+    in its directory, and the missing ones are rendered in a pool of processes when requested.
+    """
+
+    def __init__(self, directory, geometry, tile_size=512, processes=None, max_tiles=128):
+        """
+        :param directory: directory of the cache of this map, created if it does not exist
+        :param geometry: MapGeometry of the map, saved in the directory if it is not there yet
+        :param tile_size: width and height of the tiles, in pixels
+        :param processes: number of rendering processes, by default one per CPU. With 0, the
+            tiles are rendered in the calling process when requested
+        :param max_tiles: number of tiles kept in memory
+        """
+        self.directory = directory
+        self.geometry = geometry
+        self.tile_size = tile_size
+        self.max_tiles = max_tiles
+        tiles = geometry.width_in_pixels / float(tile_size)
+        self.levels = 1 + max(0, int(math.ceil(math.log(tiles, 2)))) if tiles > 0 else 1
+
+        self._tiles = collections.OrderedDict()  # type: collections.OrderedDict[tuple, pygame.Surface]
+        self._pending = dict()  # type: dict[tuple, multiprocessing.pool.AsyncResult]
+        self._rendered = set()  # type: set[tuple[int, int, int]]
+        for level in range(self.levels):
+            level_directory = os.path.join(directory, str(level))
+            if not os.path.isdir(level_directory):
+                os.makedirs(level_directory)
+            for filename in os.listdir(level_directory):
+                match = _TILE_FILENAME.match(filename)
+                if match:
+                    self._rendered.add((level, int(match.group(1)), int(match.group(2))))
+                elif _TEMPORARY_FILENAME.match(filename):
+                    _remove_stale(os.path.join(level_directory, filename))
+
+        geometry_path = os.path.join(directory, GEOMETRY_FILENAME)
+        if not os.path.isfile(geometry_path):
+            geometry.save(geometry_path)
+        self._pool = None
+        if processes != 0:
+            self._pool = multiprocessing.Pool(processes, _init_worker, (geometry_path,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+    def tile_count(self, level):
+        """Number of tiles of each row and column of a level"""
+        return int(math.ceil(self.geometry.width_in_pixels * 0.5 ** level / self.tile_size))
+
+    def tiles_in_rect(self, level, rect):
+        """
+        Returns the (level, x, y) keys of the tiles of a level that overlap a rectangle, given in
+        pixels of that level, from the closest to the center of the rectangle to the farthest
+        """
+        count = self.tile_count(level)
+        first_x, first_y = max(0, rect[0] // self.tile_size), max(0, rect[1] // self.tile_size)
+        last_x = min(count - 1, (rect[0] + rect[2] - 1) // self.tile_size)
+        last_y = min(count - 1, (rect[1] + rect[3] - 1) // self.tile_size)
+        center_x = (rect[0] + rect[2] / 2.0) / self.tile_size - 0.5
+        center_y = (rect[1] + rect[3] / 2.0) / self.tile_size - 0.5
+        tiles = [(level, int(x), int(y)) for x in range(int(first_x), int(last_x) + 1)
+                 for y in range(int(first_y), int(last_y) + 1)]
+        return sorted(tiles, key=lambda tile: (tile[1] - center_x) ** 2 + (tile[2] - center_y) ** 2)
+
+    def path(self, tile):
+        """Path of the file of a tile"""
+        level, tile_x, tile_y = tile
+        return os.path.join(self.directory, str(level), '%d_%d.png' % (tile_x, tile_y))
+
+    def get(self, level, tile_x, tile_y):
+        """Returns the surface of a tile, or None if it has not been rendered yet"""
+        tile = (level, tile_x, tile_y)
+        surface = self._tiles.get(tile)
+        if surface is not None:
+            # Most recently used
+            del self._tiles[tile]
+            self._tiles[tile] = surface
+            return surface
+        if tile not in self._rendered:
+            return None
+        surface = pygame.image.load(self.path(tile))
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert()
+        self._tiles[tile] = surface
+        while len(self._tiles) > self.max_tiles:
+            self._tiles.popitem(last=False)
+        return surface
+
+    def request(self, tiles):
+        """Starts rendering the tiles that have not been rendered yet, in the given order"""
+        for tile in tiles:
+            if tile in self._rendered or tile in self._pending:
+                continue
+            arguments = (tile, self.tile_size, self.path(tile))
+            if self._pool is None:
+                _render_tile_file(arguments, self.geometry)
+                self._rendered.add(tile)
+            else:
+                self._pending[tile] = self._pool.apply_async(_render_tile_file, (arguments,))
+
+    def poll(self):
+        """Registers the tiles whose rendering has finished, returning how many tiles are still pending"""
+        for tile, result in list(self._pending.items()):
+            if result.ready():
+                del self._pending[tile]
+                # Raises the errors of the rendering process, if any
+                result.get()
+                self._rendered.add(tile)
+        return len(self._pending)
+
+    def close(self):
+        """Stops the rendering processes, dropping the pending tiles"""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        self._pending.clear()
+
+
+_worker_geometry = None
+
+
+def _init_worker(geometry_path):
+    global _worker_geometry  # pylint: disable=global-statement
+    # The main process handles Ctrl+C and terminates the pool. Pygame may have replaced the handler of
+    # SIGTERM in the main process, which would prevent terminating the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    _worker_geometry = MapGeometry.load(geometry_path)
+
+
+def _remove_stale(path):
+    try:
+        if time.time() - os.path.getmtime(path) > _STALE_TEMPORARY_AGE:
+            os.remove(path)
+    except OSError:
+        # Already renamed or removed by another process
+        pass
+
+
+def _render_tile_file(arguments, geometry=None):
+    (level, tile_x, tile_y), tile_size, path = arguments
+    surface = render_tile(geometry or _worker_geometry, level, tile_x, tile_y, tile_size)
+    temporary_path = '%s.%d.tmp.png' % (path[:-len('.png')], os.getpid())
+    pygame.image.save(surface, temporary_path)
+    _replace(temporary_path, path)
+    return path
+
+
+_fonts = dict()
+
+
+def _draw_text(surface, primitive, center, pixels_per_meter):
+    text, size, angle, bold, stretch = primitive.extra
+    font_size = int(size * pixels_per_meter)
+    if font_size < 2:
+        # Too small to be read
+        return
+    if not pygame.font.get_init():
+        pygame.font.init()
+    font = _fonts.get((font_size, bold))
+    if font is None:
+        font = _fonts[(font_size, bold)] = pygame.font.SysFont('Arial', font_size, bold)
+    font_surface = font.render(text, False, primitive.color)
+    if stretch != 1.0:
+        font_surface = pygame.transform.scale(
+            font_surface, (font_surface.get_width(), int(font_surface.get_height() * stretch)))
+    font_surface = pygame.transform.rotate(font_surface, angle)
+    surface.blit(font_surface, font_surface.get_rect(center=center))
+
+
+def _replace(source, destination):
+    try:
+        os.replace(source, destination)
+    except AttributeError:
+        # Python 2, where rename fails on Windows if the destination exists
+        if os.path.exists(destination):
+            os.remove(destination)
+        os.rename(source, destination)
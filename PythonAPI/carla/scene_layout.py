@@ -6,6 +6,7 @@
 # Provides map data for users.
 
 import glob
+import math
 import os
 import sys
 
@@ -120,18 +121,27 @@ def get_scene_layout(carla_map):
 
 def get_dynamic_objects(carla_world, carla_map):
     # Private helper functions
-    def _get_bounding_box(actor):
-        bb = actor.bounding_box.extent
+    def _get_bounding_box(t, bb):
         corners = [
-            carla.Location(x=-bb.x, y=-bb.y),
-            carla.Location(x=bb.x, y=-bb.y),
-            carla.Location(x=bb.x, y=bb.y),
-            carla.Location(x=-bb.x, y=bb.y)]
-        t = actor.get_transform()
+            carla.Location(x=-bb[0], y=-bb[1]),
+            carla.Location(x=bb[0], y=-bb[1]),
+            carla.Location(x=bb[0], y=bb[1]),
+            carla.Location(x=-bb[0], y=bb[1])]
         t.transform(corners)
         corners = [carla_map.transform_to_geolocation(p) for p in corners]
         return corners
 
+    def _get_states(actor_list):
+        # Ids, transforms and bounding box extents of all the actors of the list, read at once
+        transforms = actor_list.get_transforms()
+        rows = zip(actor_list.get_ids().tolist(),
+                   transforms['location'].tolist(),
+                   transforms['rotation'].tolist(),
+                   actor_list.get_bounding_boxes()['extent'].tolist())
+        # Destroyed actors have NaN locations and are left out
+        return [(actor_id, carla.Transform(carla.Location(*location), carla.Rotation(*rotation)), extent)
+                for actor_id, location, rotation, extent in rows if not math.isnan(location[0])]
+
     def _get_trigger_volume(actor):
         bb = actor.trigger_volume.extent
         corners = [carla.Location(x=-bb.x, y=-bb.y),
@@ -146,26 +156,13 @@ def get_dynamic_objects(carla_world, carla_map):
         return corners
 
     def _split_actors(actors):
-        vehicles = []
-        traffic_lights = []
-        speed_limits = []
-        walkers = []
-        stops = []
-        static_obstacles = []
-        for actor in actors:
-            if 'vehicle' in actor.type_id:
-                vehicles.append(actor)
-            elif 'traffic_light' in actor.type_id:
-                traffic_lights.append(actor)
-            elif 'speed_limit' in actor.type_id:
-                speed_limits.append(actor)
-            elif 'walker' in actor.type_id:
-                walkers.append(actor)
-            elif 'stop' in actor.type_id:
-                stops.append(actor)
-            elif 'static.prop' in actor.type_id:
-                static_obstacles.append(actor)
-
+        # Filtering does not retrieve the actors, only the ones that are iterated are
+        vehicles = actors.filter('*vehicle*')
+        traffic_lights = actors.filter('*traffic_light*')
+        speed_limits = actors.filter('*speed_limit*')
+        walkers = actors.filter('*walker*')
+        stops = actors.filter('*stop*')
+        static_obstacles = actors.filter('*static.prop*')
 
         return (vehicles, traffic_lights, speed_limits, walkers, stops, static_obstacles)
 
@@ -199,16 +196,15 @@ def get_dynamic_objects(carla_world, carla_map):
 
     def get_vehicles(vehicles):
         vehicles_dict = dict()
-        for vehicle in vehicles:
-            v_transform = vehicle.get_transform()
+        for vehicle_id, v_transform, v_extent in _get_states(vehicles):
             location_gnss = carla_map.transform_to_geolocation(v_transform.location)
             v_dict = {
-                "id": vehicle.id,
+                "id": vehicle_id,
                 "position": [location_gnss.latitude, location_gnss.longitude, location_gnss.altitude],
                 "orientation": [v_transform.rotation.roll, v_transform.rotation.pitch, v_transform.rotation.yaw],
-                "bounding_box": [[v.longitude, v.latitude, v.altitude] for v in _get_bounding_box(vehicle)]
+                "bounding_box": [[v.longitude, v.latitude, v.altitude] for v in _get_bounding_box(v_transform, v_extent)]
             }
-            vehicles_dict[vehicle.id] = v_dict
+            vehicles_dict[vehicle_id] = v_dict
         return vehicles_dict
 
     def get_hero_vehicle(hero_vehicle):
@@ -229,16 +225,15 @@ def get_dynamic_objects(carla_world, carla_map):
 
     def get_walkers(walkers):
         walkers_dict = dict()
-        for walker in walkers:
-            w_transform = walker.get_transform()
+        for walker_id, w_transform, w_extent in _get_states(walkers):
             location_gnss = carla_map.transform_to_geolocation(w_transform.location)
             w_dict = {
-                "id": walker.id,
+                "id": walker_id,
                 "position": [location_gnss.latitude, location_gnss.longitude, location_gnss.altitude],
                 "orientation": [w_transform.rotation.roll, w_transform.rotation.pitch, w_transform.rotation.yaw],
-                "bounding_box": [[v.longitude, v.latitude, v.altitude] for v in _get_bounding_box(walker)]
+                "bounding_box": [[v.longitude, v.latitude, v.altitude] for v in _get_bounding_box(w_transform, w_extent)]
             }
-            walkers_dict[walker.id] = w_dict
+            walkers_dict[walker_id] = w_dict
         return walkers_dict
 
     def get_speed_limits(speed_limits):
@@ -256,21 +251,19 @@ def get_dynamic_objects(carla_world, carla_map):
 
     def get_static_obstacles(static_obstacles):
         static_obstacles_dict = dict()
-        for static_prop in static_obstacles:
-            sl_transform = static_prop.get_transform()
+        for static_prop_id, sl_transform, _ in _get_states(static_obstacles):
             location_gnss = carla_map.transform_to_geolocation(sl_transform.location)
             sl_dict = {
-                "id": static_prop.id,
+                "id": static_prop_id,
                 "position": [location_gnss.latitude, location_gnss.longitude, location_gnss.altitude]
             }
-            static_obstacles_dict[static_prop.id] = sl_dict
+            static_obstacles_dict[static_prop_id] = sl_dict
         return static_obstacles_dict
 
     actors = carla_world.get_actors()
     vehicles, traffic_lights, speed_limits, walkers, stops, static_obstacles = _split_actors(actors)
 
-    hero_vehicles = [vehicle for vehicle in vehicles if
-                     'vehicle' in vehicle.type_id and vehicle.attributes['role_name'] == 'hero']
+    hero_vehicles = [vehicle for vehicle in vehicles if vehicle.attributes['role_name'] == 'hero']
     hero = None if len(hero_vehicles) == 0 else random.choice(hero_vehicles)
 
     return {
@@ -0,0 +1,375 @@
+# Copyright (c) 2019 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Asynchronous writing of sensor data to disk.
+
+Calling save_to_disk inside a sensor callback blocks the thread that delivers the data of the
+sensor until the file is encoded and written. SensorWriter moves that work to a pool of workers,
+so callbacks only enqueue the data:
+
+    writer = SensorWriter(num_workers=4, max_pending=64)
+    camera.listen(lambda image: writer.write(image, '_out/%06d.png' % image.frame))
+    lidar.listen(lambda data: writer.write(data, '_out/%06d.ply' % data.frame))
+    ...
+    writer.close()
+    print(writer.stats())
+
+The format is chosen from the extension of the path:
+    .png, .jpg, .jpeg, .tiff, .bmp  images (carla.Image and the images of get_color_coded_flow)
+    .ply                            point clouds (carla.LidarMeasurement, carla.SemanticLidarMeasurement,
+                                    carla.RadarMeasurement)
+    .npz                            compressed NumPy archive of to_numpy(), any measurement that has it
+    anything else                   raw bytes of raw_data
+
+With threads (the default), images and point clouds are written by the save_to_disk of the
+measurement, which releases the GIL while encoding, so the workers run in parallel. With
+processes, the data is copied to a NumPy array in the callback and sent to the pool, where it is
+encoded by the functions of this module.
+"""
+
+import multiprocessing
+import os
+import struct
+import sys
+import threading
+import zlib
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import numpy as np
+
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tiff', '.bmp')
+
+# Names of the columns of the (N, 4) arrays of carla.LidarMeasurement and carla.RadarMeasurement
+LIDAR_FIELDS = ('x', 'y', 'z', 'I')
+RADAR_FIELDS = ('velocity', 'azimuth', 'altitude', 'depth')
+
+
+class WriterStats(object):
+    """Counters of a SensorWriter"""
+
+    def __init__(self, submitted=0, written=0, dropped=0, failed=0, pending=0):
+        self.submitted = submitted  # Data accepted by `write`
+        self.written = written  # Files written
+        self.dropped = dropped  # Data rejected because too many writes were pending
+        self.failed = failed  # Writes that raised an error
+        self.pending = pending  # Writes accepted and not finished yet
+
+    def __repr__(self):
+        return 'WriterStats(submitted={}, written={}, dropped={}, failed={}, pending={})'.format(
+            self.submitted, self.written, self.dropped, self.failed, self.pending)
+
+
+class SensorWriter(object):
+    """
+    SensorWriter writes sensor data to disk in a bounded pool of worker threads or processes.
+
+    At most max_pending writes can be queued or in progress at once. When that many are pending,
+    `write` either drops the new data, counting it in the stats, or blocks the caller until a
+    worker is done (back-pressure), which in synchronous mode slows down the simulation to the
+    speed of the disk instead of losing frames.
+    """
+
+    def __init__(self, num_workers=4, max_pending=64, block=False, use_processes=False, batch_size=1):
+        """
+        :param num_workers: number of worker threads or processes
+        :param max_pending: maximum number of writes queued or in progress
+        :param block: whether `write` blocks when max_pending writes are pending, instead of
+            dropping the data
+        :param use_processes: whether to use a pool of processes instead of threads
+        :param batch_size: number of writes sent at once to a process, to reduce the overhead
+            of the communication between processes. Ignored by threads. It can't be greater
+            than max_pending, as the writes of a batch are pending until it is sent
+        """
+        self._block = block
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._stats = WriterStats()
+        self._last_error = None
+        self._closed = False
+
+        self._batch = []
+        self._batch_size = max(1, min(batch_size, max_pending))
+        self._batch_lock = threading.Lock()
+        if use_processes:
+            self._pool = multiprocessing.Pool(num_workers)
+            self._queue = None
+            self._threads = []
+        else:
+            self._pool = None
+            self._queue = queue.Queue()
+            self._threads = [threading.Thread(target=self._work) for _ in range(num_workers)]
+            for thread in self._threads:
+                thread.daemon = True
+                thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+    @property
+    def last_error(self):
+        """Last exception raised by a write, if any"""
+        return self._last_error
+
+    def stats(self):
+        """Returns a copy of the WriterStats of the writer"""
+        with self._lock:
+            stats = self._stats
+            return WriterStats(stats.submitted, stats.written, stats.dropped, stats.failed, stats.pending)
+
+    def write(self, data, path, color_converter=None, timeout=None):
+        """
+        Queues the data to be written to the given path. Returns whether or not it was accepted.
+
+            :param data: carla.SensorData to write
+            :param path: path of the file, its extension decides the format
+            :param color_converter: carla.ColorConverter applied to images before writing them
+            :param timeout: maximum time to wait, in seconds, when the writer blocks. None waits forever
+        """
+        if self._closed:
+            raise RuntimeError('SensorWriter is closed')
+        if not self._slots.acquire(False):
+            if self._pool is not None:
+                # The writes waiting in the batch hold slots too, and they would never finish
+                self._send_batch()
+            if not (self._block and self._wait_slot(timeout)):
+                with self._lock:
+                    self._stats.dropped += 1
+                return False
+
+        with self._lock:
+            self._stats.submitted += 1
+            self._stats.pending += 1
+
+        if self._pool is None:
+            self._queue.put((data, path, color_converter))
+            return True
+
+        try:
+            job = _to_job(data, path, color_converter)
+        except Exception as error:  # pylint: disable=broad-except
+            self._finish_jobs(1, error)
+            return True
+        with self._batch_lock:
+            self._batch.append(job)
+            full = len(self._batch) >= self._batch_size
+        if full:
+            self._send_batch()
+        return True
+
+    def flush(self):
+        """Blocks until all the pending writes are finished"""
+        if self._pool is not None:
+            self._send_batch()
+        with self._idle:
+            while self._stats.pending > 0:
+                self._idle.wait()
+
+    def close(self):
+        """Finishes the pending writes and stops the workers"""
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+        else:
+            for _ in self._threads:
+                self._queue.put(None)
+            for thread in self._threads:
+                thread.join()
+
+    def _wait_slot(self, timeout):
+        if timeout is None:
+            return self._slots.acquire()
+        # Python 2 semaphores do not accept a timeout
+        try:
+            return self._slots.acquire(True, timeout)
+        except TypeError:
+            return self._slots.acquire()
+
+    def _send_batch(self):
+        """Sends the batch of jobs to the process pool"""
+        with self._batch_lock:
+            batch, self._batch = self._batch, []
+        if not batch:
+            return
+        callbacks = {'callback': lambda errors: self._on_batch_done(len(batch), errors)}
+        if sys.version_info >= (3, 2):
+            # Errors outside _run_jobs, like pickling the batch, would leave its writes pending forever
+            callbacks['error_callback'] = lambda error: self._finish_jobs(len(batch), error)
+        self._pool.apply_async(_run_jobs, (batch,), **callbacks)
+
+    def _on_batch_done(self, count, errors):
+        for error in errors:
+            self._finish_jobs(1, error)
+        self._finish_jobs(count - len(errors), None)
+
+    def _work(self):
+        """Loop of the worker threads"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            data, path, color_converter = item
+            error = None
+            try:
+                _write_data(data, path, color_converter)
+            except Exception as exception:  # pylint: disable=broad-except
+                error = exception
+            # Do not keep the data alive while waiting for the next item
+            data = item = None
+            self._finish_jobs(1, error)
+
+    def _finish_jobs(self, count, error):
+        if count <= 0:
+            return
+        with self._lock:
+            if error is None:
+                self._stats.written += count
+            else:
+                self._stats.failed += count
+                self._last_error = error
+            self._stats.pending -= count
+            if self._stats.pending == 0:
+                self._idle.notify_all()
+        for _ in range(count):
+            self._slots.release()
+
+
+def _write_data(data, path, color_converter=None):
+    """Writes a carla.SensorData to disk, in the format given by the extension of the path"""
+    _make_directory(path)
+    extension = os.path.splitext(path)[1].lower()
+    if extension in IMAGE_EXTENSIONS and hasattr(data, 'save_to_disk'):
+        if color_converter is None:
+            data.save_to_disk(path)
+        else:
+            data.save_to_disk(path, color_converter)
+    elif extension == '.ply' and hasattr(data, 'save_to_disk'):
+        data.save_to_disk(path)
+    else:
+        _write_job(_to_job(data, path, color_converter, copy=False))
+
+
+def _to_job(data, path, color_converter=None, copy=True):
+    """
+    Returns the (format, path, payload) tuple to write the data. If copy is True, the payload is
+    a copy of the data that can be pickled, otherwise it is a view of the data.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if color_converter is not None:
+        data.convert(color_converter)
+    if extension in IMAGE_EXTENSIONS:
+        if extension != '.png':
+            raise ValueError("Only '.png' images can be written from NumPy arrays")
+        fmt = 'png'
+    elif extension in ('.ply', '.npz'):
+        fmt = extension[1:]
+    else:
+        return ('raw', path, bytes(data.raw_data) if copy else data.raw_data)
+    payload = np.array(data.to_numpy()) if copy else data.to_numpy()
+    if fmt == 'ply' and hasattr(data, 'get_detection_count'):
+        # Radar detections are (N, 4) arrays too, but their columns aren't those of a lidar
+        payload = _named_columns(payload, RADAR_FIELDS)
+    return (fmt, path, payload)
+
+
+def _run_jobs(jobs):
+    """Writes a batch of jobs in a worker process, returning the errors"""
+    errors = []
+    for job in jobs:
+        try:
+            _make_directory(job[1])
+            _write_job(job)
+        except Exception as error:  # pylint: disable=broad-except
+            errors.append(error)
+    return errors
+
+
+def _write_job(job):
+    fmt, path, payload = job
+    if fmt == 'png':
+        write_png(path, payload)
+    elif fmt == 'ply':
+        write_ply(path, payload)
+    elif fmt == 'npz':
+        np.savez_compressed(path, data=payload)
+    else:
+        with open(path, 'wb') as raw_file:
+            raw_file.write(payload)
+
+
+def _make_directory(path):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Created by another worker in the meantime
+            if not os.path.isdir(directory):
+                raise
+
+
+def write_png(path, bgra, compression=6):
+    """
+    Writes a (height, width, 4) uint8 array of BGRA pixels, as returned by carla.Image.to_numpy,
+    to a RGBA PNG file.
+    """
+    height, width = bgra.shape[:2]
+    rgba = np.ascontiguousarray(bgra[:, :, [2, 1, 0, 3]])
+    # Each scanline starts with its filter type, 0 (none)
+    scanlines = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    scanlines[:, 1:] = rgba.reshape(height, width * 4)
+
+    def chunk(tag, content):
+        return (struct.pack('>I', len(content)) + tag + content +
+                struct.pack('>I', zlib.crc32(tag + content) & 0xffffffff))
+
+    with open(path, 'wb') as png_file:
+        png_file.write(b'\x89PNG\r\n\x1a\n')
+        png_file.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)))
+        png_file.write(chunk(b'IDAT', zlib.compress(scanlines.tobytes(), compression)))
+        png_file.write(chunk(b'IEND', b''))
+
+
+def write_ply(path, points, names=LIDAR_FIELDS):
+    """
+    Writes a point cloud to a binary PLY file. Points are either a (N, len(names)) float32 array,
+    by default of x, y, z and intensity as returned by carla.LidarMeasurement.to_numpy, or a
+    structured array, as returned by carla.SemanticLidarMeasurement.to_numpy.
+
+        :param names: names of the columns of a plain array, like RADAR_FIELDS for the detections
+            of carla.RadarMeasurement.to_numpy
+    """
+    if points.dtype.names is None:
+        points = _named_columns(points, names)
+    ply_types = {'f': 'float32', 'u': 'uint32', 'i': 'int32'}
+    header = ['ply', 'format binary_little_endian 1.0', 'element vertex %d' % len(points)]
+    for name in points.dtype.names:
+        header.append('property %s %s' % (ply_types[points.dtype[name].kind], name))
+    header.append('end_header')
+    with open(path, 'wb') as ply_file:
+        ply_file.write(('\n'.join(header) + '\n').encode('ascii'))
+        ply_file.write(np.ascontiguousarray(points).tobytes())
+
+
+def _named_columns(array, names):
+    """Returns a (N, len(names)) float32 array as a (N,) structured array with a field per column"""
+    array = np.ascontiguousarray(array, dtype='<f4')
+    if array.size % len(names) != 0:
+        raise ValueError('Expected %d values per point, got an array of shape %s' % (len(names), array.shape))
+    return array.reshape(-1, len(names)).view(np.dtype([(name, '<f4') for name in names])).reshape(-1)
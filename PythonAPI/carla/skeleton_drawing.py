@@ -0,0 +1,293 @@
+# Copyright (c) 2021 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Rasterization of points, lines and walker skeletons on NumPy images.
+
+All the points and lines of a frame are drawn at once, so drawing the skeletons of many walkers
+costs a few array operations instead of a Python call per pixel:
+
+    skeletons = WalkerSkeletons()
+    keypoints = skeletons.project(walkers, projection, camera.get_transform())
+    draw_lines(buffer, skeletons.segments(keypoints), (0, 255, 0), size=2)
+    draw_points(buffer, np.concatenate([points for _, points in keypoints]), (255, 0, 0), size=4)
+
+The keypoints can also be saved as annotations with a KeypointWriter, one JSON line per frame.
+"""
+
+import json
+
+import numpy as np
+
+
+# Pairs of bones joined by a line in the skeleton of the walkers. The line from crl_root to
+# crl_hips__C is left out on purpose, as in the draw_skeleton example: the root bone lies on the
+# ground between the feet, so it would draw a line that is not part of the body
+WALKER_BONES = (
+    ("crl_hips__C", "crl_spine__C"),
+    ("crl_hips__C", "crl_thigh__R"),
+    ("crl_hips__C", "crl_thigh__L"),
+    ("crl_spine__C", "crl_spine01__C"),
+    ("crl_spine01__C", "crl_shoulder__L"),
+    ("crl_spine01__C", "crl_neck__C"),
+    ("crl_spine01__C", "crl_shoulder__R"),
+    ("crl_shoulder__L", "crl_arm__L"),
+    ("crl_arm__L", "crl_foreArm__L"),
+    ("crl_foreArm__L", "crl_hand__L"),
+    ("crl_hand__L", "crl_handThumb__L"),
+    ("crl_hand__L", "crl_handIndex__L"),
+    ("crl_hand__L", "crl_handMiddle__L"),
+    ("crl_hand__L", "crl_handRing__L"),
+    ("crl_hand__L", "crl_handPinky__L"),
+    ("crl_handThumb__L", "crl_handThumb01__L"),
+    ("crl_handThumb01__L", "crl_handThumb02__L"),
+    ("crl_handThumb02__L", "crl_handThumbEnd__L"),
+    ("crl_handIndex__L", "crl_handIndex01__L"),
+    ("crl_handIndex01__L", "crl_handIndex02__L"),
+    ("crl_handIndex02__L", "crl_handIndexEnd__L"),
+    ("crl_handMiddle__L", "crl_handMiddle01__L"),
+    ("crl_handMiddle01__L", "crl_handMiddle02__L"),
+    ("crl_handMiddle02__L", "crl_handMiddleEnd__L"),
+    ("crl_handRing__L", "crl_handRing01__L"),
+    ("crl_handRing01__L", "crl_handRing02__L"),
+    ("crl_handRing02__L", "crl_handRingEnd__L"),
+    ("crl_handPinky__L", "crl_handPinky01__L"),
+    ("crl_handPinky01__L", "crl_handPinky02__L"),
+    ("crl_handPinky02__L", "crl_handPinkyEnd__L"),
+    ("crl_neck__C", "crl_Head__C"),
+    ("crl_Head__C", "crl_eye__L"),
+    ("crl_Head__C", "crl_eye__R"),
+    ("crl_shoulder__R", "crl_arm__R"),
+    ("crl_arm__R", "crl_foreArm__R"),
+    ("crl_foreArm__R", "crl_hand__R"),
+    ("crl_hand__R", "crl_handThumb__R"),
+    ("crl_hand__R", "crl_handIndex__R"),
+    ("crl_hand__R", "crl_handMiddle__R"),
+    ("crl_hand__R", "crl_handRing__R"),
+    ("crl_hand__R", "crl_handPinky__R"),
+    ("crl_handThumb__R", "crl_handThumb01__R"),
+    ("crl_handThumb01__R", "crl_handThumb02__R"),
+    ("crl_handThumb02__R", "crl_handThumbEnd__R"),
+    ("crl_handIndex__R", "crl_handIndex01__R"),
+    ("crl_handIndex01__R", "crl_handIndex02__R"),
+    ("crl_handIndex02__R", "crl_handIndexEnd__R"),
+    ("crl_handMiddle__R", "crl_handMiddle01__R"),
+    ("crl_handMiddle01__R", "crl_handMiddle02__R"),
+    ("crl_handMiddle02__R", "crl_handMiddleEnd__R"),
+    ("crl_handRing__R", "crl_handRing01__R"),
+    ("crl_handRing01__R", "crl_handRing02__R"),
+    ("crl_handRing02__R", "crl_handRingEnd__R"),
+    ("crl_handPinky__R", "crl_handPinky01__R"),
+    ("crl_handPinky01__R", "crl_handPinky02__R"),
+    ("crl_handPinky02__R", "crl_handPinkyEnd__R"),
+    ("crl_thigh__R", "crl_leg__R"),
+    ("crl_leg__R", "crl_foot__R"),
+    ("crl_foot__R", "crl_toe__R"),
+    ("crl_toe__R", "crl_toeEnd__R"),
+    ("crl_thigh__L", "crl_leg__L"),
+    ("crl_leg__L", "crl_foot__L"),
+    ("crl_foot__L", "crl_toe__L"),
+    ("crl_toe__L", "crl_toeEnd__L"))
+
+
+def draw_points(buffer, points, color, size=4):
+    """
+    Draws points on an image as squares of size x size pixels.
+
+        :param buffer: (height, width, C) array where the points are drawn
+        :param points: (N, 2) array with the pixel coordinates of the points, or (N, K) with
+            them in the first two columns
+        :param color: color of the points, or (N, C) array with the color of each one
+        :param size: side of the squares, in pixels
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if points.size == 0:
+        return
+    points = points.reshape(len(points), -1)
+    height, width = buffer.shape[:2]
+    offsets = np.arange(size) - size // 2
+    u_coord = np.floor(points[:, 0]).astype(np.int64)[:, None, None] + offsets[None, None, :]
+    v_coord = np.floor(points[:, 1]).astype(np.int64)[:, None, None] + offsets[None, :, None]
+    u_coord, v_coord = np.broadcast_arrays(u_coord, v_coord)
+    inside = (u_coord >= 0) & (u_coord < width) & (v_coord >= 0) & (v_coord < height)
+    color = np.asarray(color)
+    if color.ndim > 1:
+        color = np.broadcast_to(color[:, None, None], u_coord.shape + color.shape[1:])[inside]
+    buffer[v_coord[inside], u_coord[inside]] = color
+
+
+def clip_segments(segments, width, height, margin=0.0):
+    """
+    Clips line segments to the rectangle of an image with the Liang-Barsky algorithm. Returns
+    the clipped (M, 2, 2) segments and the mask of the segments that intersect the rectangle.
+
+        :param segments: (M, 2, 2) array with the pixel coordinates of the ends of the segments
+        :param width: width of the image
+        :param height: height of the image
+        :param margin: pixels added to each side of the rectangle
+    """
+    segments = np.asarray(segments, dtype=np.float64).reshape(-1, 2, 2)
+    start = segments[:, 0]
+    delta = segments[:, 1] - start
+    t_enter = np.zeros(len(segments))
+    t_exit = np.ones(len(segments))
+    keep = np.all(np.isfinite(segments), axis=(1, 2))
+    lower = (-margin, -margin)
+    upper = (width - 1 + margin, height - 1 + margin)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for axis in (0, 1):
+            for direction, distance in ((-delta[:, axis], start[:, axis] - lower[axis]),
+                                        (delta[:, axis], upper[axis] - start[:, axis])):
+                # Parallel to this edge and outside of it
+                keep &= ~((direction == 0) & (distance < 0))
+                ratio = distance / direction
+                t_enter = np.where(direction < 0, np.maximum(t_enter, ratio), t_enter)
+                t_exit = np.where(direction > 0, np.minimum(t_exit, ratio), t_exit)
+    keep &= t_enter <= t_exit
+    clipped = np.stack((start + t_enter[:, None] * delta, start + t_exit[:, None] * delta), axis=1)
+    return clipped, keep
+
+
+def draw_lines(buffer, segments, color, size=4):
+    """
+    Draws line segments on an image, with a width of size pixels.
+
+        :param buffer: (height, width, C) array where the lines are drawn
+        :param segments: (M, 2, 2) array with the pixel coordinates of the ends of the
+            segments, or (M, 2, K) with them in the first two columns
+        :param color: color of the lines
+        :param size: width of the lines, in pixels
+    """
+    segments = np.asarray(segments, dtype=np.float64)
+    if segments.size == 0:
+        return
+    height, width = buffer.shape[:2]
+    segments, keep = clip_segments(segments[..., :2], width, height, margin=size)
+    segments = segments[keep]
+
+    # One pixel per step along the longest axis of each segment, as Bresenham's algorithm
+    segments = np.floor(segments)
+    start = segments[:, 0]
+    delta = segments[:, 1] - start
+    steps = np.abs(delta).max(axis=1).astype(np.int64) + 1
+    segment = np.repeat(np.arange(len(segments)), steps)
+    first = np.cumsum(steps) - steps
+    ratio = (np.arange(steps.sum()) - first[segment]) / np.maximum(steps - 1, 1)[segment].astype(np.float64)
+    draw_points(buffer, np.floor(start[segment] + ratio[:, None] * delta[segment] + 0.5), color, size)
+
+
+class WalkerSkeletons(object):
+    """
+    WalkerSkeletons projects the bones of many walkers on the image of a camera at once, and
+    gives the lines of their skeletons. The bone names of each walker are read once, and the
+    bones joined by each line are cached by walker id.
+    """
+
+    def __init__(self, bones=WALKER_BONES):
+        """
+        :param bones: pairs of bone names joined by a line
+        """
+        self._bones = bones
+        self._layouts = dict()  # type: dict[int, tuple[list[str], np.ndarray]]
+
+    def bone_names(self, walker_id):
+        """Names of the bones of a walker already projected, in the order of its keypoints"""
+        return self._layouts[walker_id][0]
+
+    def project(self, walkers, projection, camera_transform):
+        """
+        Returns a list with the (walker id, keypoints) of each walker, where the keypoints
+        are a (B, 3) array with the (u, v, depth) of each of its B bones.
+
+            :param walkers: list of carla.Walker
+            :param projection: CameraProjection of the camera
+            :param camera_transform: carla.Transform of the camera
+        """
+        ids = []
+        counts = []
+        locations = []
+        for walker in walkers:
+            bone_transforms = walker.get_bones().bone_transforms
+            if walker.id not in self._layouts:
+                self._add_layout(walker.id, [bone.name for bone in bone_transforms])
+            ids.append(walker.id)
+            counts.append(len(bone_transforms))
+            for bone in bone_transforms:
+                location = bone.world.location
+                locations.append((location.x, location.y, location.z))
+
+        # All the bones of all the walkers in a single projection
+        points = projection.project(np.array(locations, dtype=np.float32).reshape(-1, 3), camera_transform)
+        return list(zip(ids, np.split(points, np.cumsum(counts)[:-1])))
+
+    def segments(self, keypoints):
+        """
+        Returns a (M, 2, 3) array with the ends of the lines of the skeletons of the walkers,
+        skipping the ones with an end behind the camera.
+
+            :param keypoints: list of (walker id, keypoints) returned by `project`
+        """
+        segments = [points[self._layouts[walker_id][1]] for walker_id, points in keypoints]
+        if not segments:
+            return np.zeros((0, 2, 3), dtype=np.float32)
+        segments = np.concatenate(segments)
+        return segments[np.all(segments[:, :, 2] > 0.0, axis=1)]
+
+    def _add_layout(self, walker_id, names):
+        index = {name: i for i, name in enumerate(names)}
+        pairs = [(index[first], index[second]) for first, second in self._bones
+                 if first in index and second in index]
+        self._layouts[walker_id] = (names, np.array(pairs, dtype=np.int64).reshape(-1, 2))
+
+
+class KeypointWriter(object):
+    """
+    KeypointWriter saves the keypoints of the walkers to a JSON Lines file, one line per frame:
+
+        {"frame": 1234, "walkers": [{"id": 42, "keypoints": [[u, v, depth], ...]}, ...]}
+
+    The first line of each walker also has the names of its bones, in the order of its
+    keypoints, in a "bones" field. The file is written as the simulation runs, so it is a
+    lighter alternative to saving the images with the skeletons drawn on them.
+    """
+
+    def __init__(self, path, skeletons, decimals=2):
+        """
+        :param path: path of the file
+        :param skeletons: WalkerSkeletons that projects the keypoints
+        :param decimals: number of decimals of the coordinates
+        """
+        self._file = open(path, 'w')
+        self._skeletons = skeletons
+        self._decimals = decimals
+        self._written = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+    def write(self, frame, keypoints):
+        """
+        Writes the keypoints of a frame.
+
+            :param frame: frame number
+            :param keypoints: list of (walker id, keypoints) returned by `WalkerSkeletons.project`
+        """
+        walkers = []
+        for walker_id, points in keypoints:
+            walker = {'id': walker_id, 'keypoints': np.round(points.astype(np.float64), self._decimals).tolist()}
+            if walker_id not in self._written:
+                walker['bones'] = self._skeletons.bone_names(walker_id)
+                self._written.add(walker_id)
+            walkers.append(walker)
+        self._file.write(json.dumps({'frame': frame, 'walkers': walkers}) + '\n')
+
+    def close(self):
+        """Closes the file"""
+        if not self._file.closed:
+            self._file.close()
@@ -26,6 +26,7 @@
 
 #include <carla/sensor/data/RadarData.h>
 
+#include <boost/python/object/life_support.hpp>
 #include <boost/python/suite/indexing/vector_indexing_suite.hpp>
 
 #include <ostream>
@@ -33,7 +34,11 @@
 #include <cmath>
 #include <vector>
 #include <algorithm>
+#include <initializer_list>
+#include <limits>
+#include <stdexcept>
 #include <thread>
+#include <utility>
 
 namespace carla {
 namespace sensor {
@@ -263,6 +268,210 @@ static auto GetRawDataAsBuffer(T &self) {
     return boost::python::object(boost::python::handle<>(ptr));  
 }  
   
+// Read-only NumPy array of the given dtype and shape viewing the data of a
+// measurement, without copying it. Unlike raw_data, the array keeps the
+// measurement alive for as long as it (or any view of it) exists.
+template <typename T>
+static boost::python::object GetRawDataAsNumPy(
+    boost::python::object self,
+    boost::python::object dtype,
+    boost::python::tuple shape) {
+  namespace bp = boost::python;
+  bp::object numpy = bp::import("numpy");
+  T &measurement = bp::extract<T &>(self);
+  bp::object array = numpy.attr("frombuffer")(GetRawDataAsBuffer(measurement), numpy.attr("dtype")(dtype));
+  // NumPy views use this array as their base, so it is the one holding the
+  // measurement, with the same life support used by with_custodian_and_ward.
+  if (bp::objects::make_nurse_and_patient(array.ptr(), self.ptr()) == nullptr) {
+    bp::throw_error_already_set();
+  }
+  return array.attr("reshape")(shape);
+}
+
+// (height, width, 4) uint8 array with the BGRA pixels of the image.
+static boost::python::object ImageToNumPy(boost::python::object self) {
+  const carla::sensor::data::Image &image = boost::python::extract<carla::sensor::data::Image &>(self);
+  return GetRawDataAsNumPy<carla::sensor::data::Image>(
+      self,
+      boost::python::str("uint8"),
+      boost::python::make_tuple(image.GetHeight(), image.GetWidth(), 4));
+}
+
+// (height, width, 2) float32 array with the (x, y) flow of each pixel.
+static boost::python::object OpticalFlowImageToNumPy(boost::python::object self) {
+  const carla::sensor::data::OpticalFlowImage &image = boost::python::extract<carla::sensor::data::OpticalFlowImage &>(self);
+  return GetRawDataAsNumPy<carla::sensor::data::OpticalFlowImage>(
+      self,
+      boost::python::str("float32"),
+      boost::python::make_tuple(image.GetHeight(), image.GetWidth(), 2));
+}
+
+// (N, 4) float32 array with the x, y, z and intensity of each point.
+static boost::python::object LidarMeasurementToNumPy(boost::python::object self) {
+  const carla::sensor::data::LidarMeasurement &meas = boost::python::extract<carla::sensor::data::LidarMeasurement &>(self);
+  return GetRawDataAsNumPy<carla::sensor::data::LidarMeasurement>(
+      self,
+      boost::python::str("float32"),
+      boost::python::make_tuple(meas.size(), 4));
+}
+
+// (N,) structured array with the fields of carla.SemanticLidarDetection.
+static boost::python::object SemanticLidarMeasurementToNumPy(boost::python::object self) {
+  const carla::sensor::data::SemanticLidarMeasurement &meas = boost::python::extract<carla::sensor::data::SemanticLidarMeasurement &>(self);
+  static_assert(sizeof(carla::sensor::data::SemanticLidarDetection) == 24u, "Invalid SemanticLidarDetection size");
+  return GetRawDataAsNumPy<carla::sensor::data::SemanticLidarMeasurement>(
+      self,
+      MakeStructuredDType({
+          {"x", "<f4"}, {"y", "<f4"}, {"z", "<f4"},
+          {"cos_inc_angle", "<f4"}, {"object_idx", "<u4"}, {"object_tag", "<u4"}}),
+      boost::python::make_tuple(meas.size()));
+}
+
+// (N, 4) float32 array with the velocity, azimuth, altitude and depth of each detection.
+static boost::python::object RadarMeasurementToNumPy(boost::python::object self) {
+  const carla::sensor::data::RadarMeasurement &meas = boost::python::extract<carla::sensor::data::RadarMeasurement &>(self);
+  return GetRawDataAsNumPy<carla::sensor::data::RadarMeasurement>(
+      self,
+      boost::python::str("float32"),
+      boost::python::make_tuple(meas.size(), 4));
+}
+
+// (N,) structured array with the fields of carla.DVSEvent.
+static boost::python::object DVSEventArrayToNumPy(boost::python::object self) {
+  const carla::sensor::data::DVSEventArray &events = boost::python::extract<carla::sensor::data::DVSEventArray &>(self);
+  static_assert(sizeof(carla::sensor::data::DVSEvent) == 13u, "Invalid DVSEvent size");
+  return GetRawDataAsNumPy<carla::sensor::data::DVSEventArray>(
+      self,
+      MakeStructuredDType({{"x", "<u2"}, {"y", "<u2"}, {"t", "<i8"}, {"pol", "?"}}),
+      boost::python::make_tuple(events.size()));
+}
+
+// Array of N rows with the given columns, filled event by event with the GIL
+// released. Single column arrays are one-dimensional.
+template <typename T, typename Function>
+static boost::python::object DVSEventsToColumns(
+    const carla::sensor::data::DVSEventArray &events,
+    const char *dtype,
+    size_t columns,
+    Function &&fill) {
+  const size_t size = events.size();
+  NumPyOutput output(
+      columns == 1u ? boost::python::make_tuple(size) : boost::python::make_tuple(size, columns),
+      dtype);
+  T *out = output.data<T>();
+  {
+    carla::PythonUtil::ReleaseGIL unlock;
+    for (size_t i = 0u; i < size; ++i) {
+      fill(events[i], out + i * columns);
+    }
+  }
+  return output.array();
+}
+
+static boost::python::object DVSEventArrayToArray(const carla::sensor::data::DVSEventArray &self) {
+  return DVSEventsToColumns<int64_t>(self, "int64", 4u, [](const carla::sensor::data::DVSEvent &event, int64_t *out) {
+    out[0] = event.x;
+    out[1] = event.y;
+    out[2] = event.t;
+    out[3] = event.pol ? 1 : -1;
+  });
+}
+
+static boost::python::object DVSEventArrayToArrayX(const carla::sensor::data::DVSEventArray &self) {
+  return DVSEventsToColumns<uint16_t>(self, "uint16", 1u, [](const carla::sensor::data::DVSEvent &event, uint16_t *out) {
+    *out = event.x;
+  });
+}
+
+static boost::python::object DVSEventArrayToArrayY(const carla::sensor::data::DVSEventArray &self) {
+  return DVSEventsToColumns<uint16_t>(self, "uint16", 1u, [](const carla::sensor::data::DVSEvent &event, uint16_t *out) {
+    *out = event.y;
+  });
+}
+
+static boost::python::object DVSEventArrayToArrayT(const carla::sensor::data::DVSEventArray &self) {
+  return DVSEventsToColumns<int64_t>(self, "int64", 1u, [](const carla::sensor::data::DVSEvent &event, int64_t *out) {
+    *out = event.t;
+  });
+}
+
+static boost::python::object DVSEventArrayToArrayPol(const carla::sensor::data::DVSEventArray &self) {
+  return DVSEventsToColumns<int16_t>(self, "int16", 1u, [](const carla::sensor::data::DVSEvent &event, int16_t *out) {
+    *out = event.pol ? 1 : -1;
+  });
+}
+
+// Calls function with the events inside the image, of the given polarity (1
+// positive, -1 negative, 0 both) and within the last time_window seconds
+// before the most recent event (all of them if time_window is not positive).
+template <typename Function>
+static void ForEachDVSEventInWindow(
+    const carla::sensor::data::DVSEventArray &events,
+    double time_window,
+    int polarity,
+    Function &&function) {
+  if (polarity < -1 || polarity > 1) {
+    throw std::invalid_argument("polarity must be 1 (positive), -1 (negative) or 0 (both)");
+  }
+  int64_t min_t = std::numeric_limits<int64_t>::lowest();
+  if (time_window > 0.0 && events.size() > 0u) {
+    int64_t max_t = min_t;
+    for (const auto &event : events) {
+      // Packed fields cannot be bound to references, as std::max would do.
+      const int64_t t = event.t;
+      max_t = t > max_t ? t : max_t;
+    }
+    // Event timestamps are in nanoseconds.
+    min_t = max_t - static_cast<int64_t>(time_window * 1e9);
+  }
+  const auto width = events.GetWidth();
+  const auto height = events.GetHeight();
+  for (const auto &event : events) {
+    if (event.t < min_t || event.x >= width || event.y >= height) {
+      continue;
+    }
+    if ((polarity > 0 && !event.pol) || (polarity < 0 && event.pol)) {
+      continue;
+    }
+    function(event, static_cast<size_t>(width) * event.y + event.x);
+  }
+}
+
+// (height, width, 4) uint8 BGRA image, blue where there are positive events
+// and red where there are negative ones.
+static boost::python::object DVSEventArrayToImage(
+    const carla::sensor::data::DVSEventArray &self,
+    double time_window,
+    int polarity) {
+  NumPyOutput output(boost::python::make_tuple(self.GetHeight(), self.GetWidth(), 4), "uint8");
+  uint8_t *out = output.data<uint8_t>();
+  {
+    carla::PythonUtil::ReleaseGIL unlock;
+    ForEachDVSEventInWindow(self, time_window, polarity, [out](const carla::sensor::data::DVSEvent &event, size_t index) {
+      // Channels are in BGRA order.
+      out[4u * index + (event.pol ? 0u : 2u)] = 255u;
+    });
+  }
+  return output.array();
+}
+
+// (height, width) int32 array with the number of events per pixel. Negative
+// events count as -1 when both polarities are accumulated.
+static boost::python::object DVSEventArrayAccumulate(
+    const carla::sensor::data::DVSEventArray &self,
+    double time_window,
+    int polarity) {
+  NumPyOutput output(boost::python::make_tuple(self.GetHeight(), self.GetWidth()), "int32");
+  int32_t *out = output.data<int32_t>();
+  {
+    carla::PythonUtil::ReleaseGIL unlock;
+    ForEachDVSEventInWindow(self, time_window, polarity, [out, polarity](const carla::sensor::data::DVSEvent &event, size_t index) {
+      out[index] += (polarity == 0 && !event.pol) ? -1 : 1;
+    });
+  }
+  return output.array();
+}
+
 // 模板函数ConvertImage，用于根据指定的颜色转换器类型转换图像数据  
 template <typename T>  
 static void ConvertImage(T &self, EColorConverter cc) {  
@@ -298,6 +507,15 @@ class FakeImage : public std::vector<uint8_t> {
     float FOV = 0; // 视野角度  
 };  
   
+// (height, width, 4) uint8 array with the BGRA pixels of the color coded flow.
+static boost::python::object FakeImageToNumPy(boost::python::object self) {
+  const FakeImage &image = boost::python::extract<FakeImage &>(self);
+  return GetRawDataAsNumPy<FakeImage>(
+      self,
+      boost::python::str("uint8"),
+      boost::python::make_tuple(image.Height, image.Width, 4));
+}
+
 // ColorCodedFlow函数，用于将光学流图像转换为RGB图像  
 static FakeImage ColorCodedFlow(  
     carla::sensor::data::OpticalFlowImage& image) {  
@@ -507,7 +725,8 @@ void export_sensor_data() {
       .add_property("width", &FakeImage::Width)
       .add_property("height", &FakeImage::Height)
       .add_property("fov", &FakeImage::FOV)
-      .add_property("raw_data", &GetRawDataAsBuffer<FakeImage>);
+      .add_property("raw_data", &GetRawDataAsBuffer<FakeImage>)
+      .def("to_numpy", &FakeImageToNumPy);
 
   class_<cs::SensorData, boost::noncopyable, boost::shared_ptr<cs::SensorData>>("SensorData", no_init)
     .add_property("frame", &cs::SensorData::GetFrame)
@@ -546,6 +765,7 @@ void export_sensor_data() {
     .add_property("height", &csd::Image::GetHeight)
     .add_property("fov", &csd::Image::GetFOVAngle)
     .add_property("raw_data", &GetRawDataAsBuffer<csd::Image>)
+    .def("to_numpy", &ImageToNumPy)
     .def("convert", &ConvertImage<csd::Image>, (arg("color_converter")))
     .def("save_to_disk", &SaveImageToDisk<csd::Image>, (arg("path"), arg("color_converter")=EColorConverter::Raw))
     .def("__len__", &csd::Image::size)
@@ -564,6 +784,7 @@ void export_sensor_data() {
     .add_property("height", &csd::OpticalFlowImage::GetHeight)
     .add_property("fov", &csd::OpticalFlowImage::GetFOVAngle)
     .add_property("raw_data", &GetRawDataAsBuffer<csd::OpticalFlowImage>)
+    .def("to_numpy", &OpticalFlowImageToNumPy)
     .def("get_color_coded_flow", &ColorCodedFlow)
     .def("__len__", &csd::OpticalFlowImage::size)
     .def("__iter__", iterator<csd::OpticalFlowImage>())
@@ -580,6 +801,7 @@ void export_sensor_data() {
     .add_property("horizontal_angle", &csd::LidarMeasurement::GetHorizontalAngle)
     .add_property("channels", &csd::LidarMeasurement::GetChannelCount)
     .add_property("raw_data", &GetRawDataAsBuffer<csd::LidarMeasurement>)
+    .def("to_numpy", &LidarMeasurementToNumPy)
     .def("get_point_count", &csd::LidarMeasurement::GetPointCount, (arg("channel")))
     .def("save_to_disk", &SavePointCloudToDisk<csd::LidarMeasurement>, (arg("path")))
     .def("__len__", &csd::LidarMeasurement::size)
@@ -597,6 +819,7 @@ void export_sensor_data() {
     .add_property("horizontal_angle", &csd::SemanticLidarMeasurement::GetHorizontalAngle)
     .add_property("channels", &csd::SemanticLidarMeasurement::GetChannelCount)
     .add_property("raw_data", &GetRawDataAsBuffer<csd::SemanticLidarMeasurement>)
+    .def("to_numpy", &SemanticLidarMeasurementToNumPy)
     .def("get_point_count", &csd::SemanticLidarMeasurement::GetPointCount, (arg("channel")))
     .def("save_to_disk", &SavePointCloudToDisk<csd::SemanticLidarMeasurement>, (arg("path")))
     .def("__len__", &csd::SemanticLidarMeasurement::size)
@@ -646,6 +869,7 @@ void export_sensor_data() {
 
   class_<csd::RadarMeasurement, bases<cs::SensorData>, boost::noncopyable, boost::shared_ptr<csd::RadarMeasurement>>("RadarMeasurement", no_init)
     .add_property("raw_data", &GetRawDataAsBuffer<csd::RadarMeasurement>)
+    .def("to_numpy", &RadarMeasurementToNumPy)
     .def("get_detection_count", &csd::RadarMeasurement::GetDetectionAmount)
     .def("__len__", &csd::RadarMeasurement::size)
     .def("__iter__", iterator<csd::RadarMeasurement>())
@@ -693,6 +917,7 @@ void export_sensor_data() {
     .add_property("height", &csd::DVSEventArray::GetHeight)
     .add_property("fov", &csd::DVSEventArray::GetFOVAngle)
     .add_property("raw_data", &GetRawDataAsBuffer<csd::DVSEventArray>)
+    .def("to_numpy", &DVSEventArrayToNumPy)
     .def("__len__", &csd::DVSEventArray::size)
     .def("__iter__", iterator<csd::DVSEventArray>())
     .def("__getitem__", +[](const csd::DVSEventArray &self, size_t pos) -> csd::DVSEvent {
@@ -701,12 +926,13 @@ void export_sensor_data() {
     .def("__setitem__", +[](csd::DVSEventArray &self, size_t pos, csd::DVSEvent event) {
       self.at(pos) = event;
     })
-    .def("to_image", CALL_RETURNING_LIST(csd::DVSEventArray, ToImage))
-    .def("to_array", CALL_RETURNING_LIST(csd::DVSEventArray, ToArray))
-    .def("to_array_x", CALL_RETURNING_LIST(csd::DVSEventArray, ToArrayX))
-    .def("to_array_y", CALL_RETURNING_LIST(csd::DVSEventArray, ToArrayY))
-    .def("to_array_t", CALL_RETURNING_LIST(csd::DVSEventArray, ToArrayT))
-    .def("to_array_pol", CALL_RETURNING_LIST(csd::DVSEventArray, ToArrayPol))
+    .def("to_image", &DVSEventArrayToImage, (arg("time_window")=0.0, arg("polarity")=0))
+    .def("accumulate", &DVSEventArrayAccumulate, (arg("time_window")=0.0, arg("polarity")=0))
+    .def("to_array", &DVSEventArrayToArray)
+    .def("to_array_x", &DVSEventArrayToArrayX)
+    .def("to_array_y", &DVSEventArrayToArrayY)
+    .def("to_array_t", &DVSEventArrayToArrayT)
+    .def("to_array_pol", &DVSEventArrayToArrayPol)
     .def(self_ns::str(self_ns::self))
   ;
 
@@ -10,6 +10,9 @@
 #include <carla/client/World.h>
 
 #include <boost/python/suite/indexing/vector_indexing_suite.hpp>
+
+#include <algorithm>
+#include <cstdint>
 // 命名空间 carla 和 carla::client
 namespace carla {
 namespace client {
@@ -27,6 +30,59 @@ namespace client {
 } // namespace client
 } // namespace carla
 
+// Row of the structured array returned by WorldSnapshot.to_numpy().
+struct ActorSnapshotRow {
+  uint32_t id;
+  float location[3u];
+  float rotation[3u];
+  float velocity[3u];
+  float angular_velocity[3u];
+  float acceleration[3u];
+};
+
+static_assert(sizeof(ActorSnapshotRow) == 64u, "Invalid ActorSnapshotRow size");
+
+// NumPy dtype of ActorSnapshotRow. Parsing a dtype costs more than filling the
+// array, so it is built once, and never destroyed since the interpreter may be
+// finalized before the static objects are.
+static const boost::python::object &ActorSnapshotDType() {
+  static const auto *dtype = new boost::python::object(
+      boost::python::import("numpy").attr("dtype")(MakeStructuredDType({
+          {"id", "<u4"},
+          {"location", "(3,)<f4"},
+          {"rotation", "(3,)<f4"},
+          {"velocity", "(3,)<f4"},
+          {"angular_velocity", "(3,)<f4"},
+          {"acceleration", "(3,)<f4"}})));
+  return *dtype;
+}
+
+// (N,) structured array with the state of every actor of the snapshot, sorted
+// by actor id. Filled with the GIL released, in a single pass.
+static boost::python::object WorldSnapshotToNumPy(const carla::client::WorldSnapshot &self) {
+  const size_t size = self.size();
+  NumPyOutput output(boost::python::make_tuple(size), ActorSnapshotDType());
+  ActorSnapshotRow *rows = output.data<ActorSnapshotRow>();
+  {
+    carla::PythonUtil::ReleaseGIL unlock;
+    ActorSnapshotRow *row = rows;
+    for (const auto &actor : self) {
+      row->id = actor.id;
+      CopyVector(actor.transform.location, row->location);
+      CopyRotation(actor.transform.rotation, row->rotation);
+      CopyVector(actor.velocity, row->velocity);
+      CopyVector(actor.angular_velocity, row->angular_velocity);
+      CopyVector(actor.acceleration, row->acceleration);
+      ++row;
+    }
+    // The actors are stored in a hash map, sorting them makes the order stable.
+    std::sort(rows, rows + size, [](const ActorSnapshotRow &lhs, const ActorSnapshotRow &rhs) {
+      return lhs.id < rhs.id;
+    });
+  }
+  return output.array();
+}
+
 void export_snapshot() {
   using namespace boost::python;
   namespace cc = carla::client;
@@ -52,6 +108,7 @@ void export_snapshot() {
     /// @}
     .def("has_actor", &cc::WorldSnapshot::Contains, (arg("actor_id")))
     .def("find", CALL_RETURNING_OPTIONAL_1(cc::WorldSnapshot, Find, carla::ActorId), (arg("actor_id")))
+    .def("to_numpy", &WorldSnapshotToNumPy)
     .def("__len__", &cc::WorldSnapshot::size)// 定义方法 __len__，返回 WorldSnapshot 中的元素数量
     .def("__iter__", range(&cc::WorldSnapshot::begin, &cc::WorldSnapshot::end)) // 定义方法 __iter__，用于迭代 WorldSnapshot 的元素
     .def("__eq__", &cc::WorldSnapshot::operator==)// 定义方法 __eq__，用于比较两个 WorldSnapshot 对象是否相等
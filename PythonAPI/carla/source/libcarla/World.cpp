@@ -13,6 +13,9 @@
 
 // 引入标准库中的字符串处理功能
 #include <string>
+#include <algorithm>
+#include <cstdint>
+#include <limits>
 
 // 引入Boost Python库中的vector容器相关的功能
 #include <boost/python/suite/indexing/vector_indexing_suite.hpp>
@@ -100,6 +103,124 @@ static auto GetActorsById(carla::client::World &self, const boost::python::list
   return self.GetActors(ids);
 }
 
+// Rows of the structured arrays returned by the bulk queries of ActorList.
+struct TransformRow {
+  float location[3u];
+  float rotation[3u];
+};
+
+static_assert(sizeof(TransformRow) == 24u, "Invalid TransformRow size");
+
+struct BoundingBoxRow {
+  float location[3u];
+  float extent[3u];
+  float rotation[3u];
+};
+
+static_assert(sizeof(BoundingBoxRow) == 36u, "Invalid BoundingBoxRow size");
+
+// The dtypes are built once, see ActorSnapshotDType.
+static const boost::python::object &TransformDType() {
+  static const auto *dtype = new boost::python::object(
+      boost::python::import("numpy").attr("dtype")(MakeStructuredDType({
+          {"location", "(3,)<f4"},
+          {"rotation", "(3,)<f4"}})));
+  return *dtype;
+}
+
+static const boost::python::object &BoundingBoxDType() {
+  static const auto *dtype = new boost::python::object(
+      boost::python::import("numpy").attr("dtype")(MakeStructuredDType({
+          {"location", "(3,)<f4"},
+          {"extent", "(3,)<f4"},
+          {"rotation", "(3,)<f4"}})));
+  return *dtype;
+}
+
+static std::vector<boost::optional<carla::client::ActorSnapshot>> GetActorListSnapshots(
+    const carla::client::ActorList &self) {
+  carla::PythonUtil::ReleaseGIL unlock;
+  return self.GetSnapshots();
+}
+
+// Actors that are no longer in the episode state, like the destroyed ones, get
+// NaN values, so they are never within any distance of a location, instead of
+// appearing at the origin.
+static void FillNaN(float *out, size_t count) {
+  std::fill(out, out + count, std::numeric_limits<float>::quiet_NaN());
+}
+
+// (N,) array with the ids of the actors of the list.
+static boost::python::object GetActorListIds(const carla::client::ActorList &self) {
+  NumPyOutput output(boost::python::make_tuple(self.size()), "<u4");
+  uint32_t *ids = output.data<uint32_t>();
+  {
+    carla::PythonUtil::ReleaseGIL unlock;
+    for (auto id : self.GetIds()) {
+      *ids++ = id;
+    }
+  }
+  return output.array();
+}
+
+// (N,) structured array with the location and rotation of the actors of the
+// list, read from a single lookup of the episode state.
+static boost::python::object GetActorListTransforms(const carla::client::ActorList &self) {
+  const auto snapshots = GetActorListSnapshots(self);
+  NumPyOutput output(boost::python::make_tuple(snapshots.size()), TransformDType());
+  TransformRow *row = output.data<TransformRow>();
+  {
+    carla::PythonUtil::ReleaseGIL unlock;
+    for (const auto &snapshot : snapshots) {
+      if (snapshot) {
+        CopyVector(snapshot->transform.location, row->location);
+        CopyRotation(snapshot->transform.rotation, row->rotation);
+      } else {
+        FillNaN(row->location, 3u);
+        FillNaN(row->rotation, 3u);
+      }
+      ++row;
+    }
+  }
+  return output.array();
+}
+
+// (N,3) array with the velocity of the actors of the list.
+static boost::python::object GetActorListVelocities(const carla::client::ActorList &self) {
+  const auto snapshots = GetActorListSnapshots(self);
+  NumPyOutput output(boost::python::make_tuple(snapshots.size(), 3u), "<f4");
+  float *row = output.data<float>();
+  {
+    carla::PythonUtil::ReleaseGIL unlock;
+    for (const auto &snapshot : snapshots) {
+      if (snapshot) {
+        CopyVector(snapshot->velocity, row);
+      } else {
+        FillNaN(row, 3u);
+      }
+      row += 3u;
+    }
+  }
+  return output.array();
+}
+
+// (N,) structured array with the bounding boxes of the actors of the list, in
+// the coordinates of each actor.
+static boost::python::object GetActorListBoundingBoxes(const carla::client::ActorList &self) {
+  NumPyOutput output(boost::python::make_tuple(self.size()), BoundingBoxDType());
+  BoundingBoxRow *row = output.data<BoundingBoxRow>();
+  {
+    carla::PythonUtil::ReleaseGIL unlock;
+    for (const auto &bounding_box : self.GetBoundingBoxes()) {
+      CopyVector(bounding_box.location, row->location);
+      CopyVector(bounding_box.extent, row->extent);
+      CopyRotation(bounding_box.rotation, row->rotation);
+      ++row;
+    }
+  }
+  return output.array();
+}
+
 static auto GetVehiclesLightStates(carla::client::World &self) {
   boost::python::dict dict;
   auto list = self.GetVehiclesLightStates();
@@ -165,6 +286,10 @@ void export_world() {
     .def("find", &cc::ActorList::Find, (arg("id")))
     .def("filter", &cc::ActorList::Filter, (arg("wildcard_pattern")))
     .def("__getitem__", &cc::ActorList::at)
+    .def("get_ids", &GetActorListIds)
+    .def("get_transforms", &GetActorListTransforms)
+    .def("get_velocities", &GetActorListVelocities)
+    .def("get_bounding_boxes", &GetActorListBoundingBoxes)
     .def("__len__", &cc::ActorList::size)
     .def("__iter__", range(&cc::ActorList::begin, &cc::ActorList::end))
     .def(self_ns::str(self_ns::self))
@@ -5,11 +5,16 @@
 // For a copy, see <https://opensource.org/licenses/MIT>.
 
 #include <carla/Memory.h>
+#include <carla/NonCopyable.h>
 #include <carla/PythonUtil.h>
 #include <carla/Time.h>
+#include <carla/geom/Rotation.h>
+#include <carla/geom/Vector3D.h>
 
+#include <initializer_list>
 #include <ostream>
 #include <type_traits>
+#include <utility>
 #include <vector>
 
 // 对于Python中的变量类型，Boost.Python都有相应的类对应，他们都是boost::python::object的子类。
@@ -191,6 +196,64 @@ namespace std {
 
 } // namespace std
 
+// NumPy structured dtype made of the given (name, format) pairs, packed.
+static boost::python::list MakeStructuredDType(
+    std::initializer_list<std::pair<const char *, const char *>> fields) {
+  boost::python::list dtype;
+  for (const auto &field : fields) {
+    dtype.append(boost::python::make_tuple(field.first, field.second));
+  }
+  return dtype;
+}
+
+// C contiguous NumPy array, initialized to zero, whose data is written from C++.
+class NumPyOutput : private carla::NonCopyable {
+public:
+
+  NumPyOutput(boost::python::tuple shape, boost::python::object dtype)
+    : _array(boost::python::import("numpy").attr("zeros")(shape, dtype)) {
+    if (PyObject_GetBuffer(_array.ptr(), &_view, PyBUF_WRITABLE | PyBUF_C_CONTIGUOUS) != 0) {
+      boost::python::throw_error_already_set();
+    }
+  }
+
+  NumPyOutput(boost::python::tuple shape, const char *dtype)
+    : NumPyOutput(std::move(shape), boost::python::str(dtype)) {}
+
+  ~NumPyOutput() {
+    PyBuffer_Release(&_view);
+  }
+
+  template <typename T>
+  T *data() {
+    return reinterpret_cast<T *>(_view.buf);
+  }
+
+  const boost::python::object &array() const {
+    return _array;
+  }
+
+private:
+
+  boost::python::object _array;
+
+  Py_buffer _view;
+};
+
+// Writes the three components of a vector to a row of a NumPy array.
+static void CopyVector(const carla::geom::Vector3D &vector, float *out) {
+  out[0u] = vector.x;
+  out[1u] = vector.y;
+  out[2u] = vector.z;
+}
+
+// Writes a rotation to a row of a NumPy array as (pitch, yaw, roll).
+static void CopyRotation(const carla::geom::Rotation &rotation, float *out) {
+  out[0u] = rotation.pitch;
+  out[1u] = rotation.yaw;
+  out[2u] = rotation.roll;
+}
+
 static carla::time_duration TimeDurationFromSeconds(double seconds) {
   size_t ms = static_cast<size_t>(1e3 * seconds);
   return carla::time_duration::milliseconds(ms);
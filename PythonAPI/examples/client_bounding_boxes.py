@@ -35,6 +35,11 @@ try:
 except IndexError:
     pass
 
+try:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + '/carla')
+except IndexError:
+    pass
+
 
 # ==============================================================================
 # -- imports -------------------------------------------------------------------
@@ -61,6 +66,8 @@ try:
 except ImportError:
     raise RuntimeError('cannot import numpy, make sure numpy package is installed')
 
+from camera_projection import BoundingBoxes, CameraProjection
+
 VIEW_WIDTH = 1920//2
 VIEW_HEIGHT = 1080//2
 VIEW_FOV = 90
@@ -79,15 +86,18 @@ class ClientSideBoundingBoxes(object):
     """
 
     @staticmethod
-    def get_bounding_boxes(vehicles, camera):
+    def get_bounding_boxes(boxes, snapshot, camera):
         """
-        Creates 3D bounding boxes based on carla vehicle list and camera.
+        Creates 3D bounding boxes of all the actors of a BoundingBoxes at once, based on the
+        transforms of a world snapshot and the camera.
         """
 
-        bounding_boxes = [ClientSideBoundingBoxes.get_bounding_box(vehicle, camera) for vehicle in vehicles]
-        # filter objects behind camera
-        bounding_boxes = [bb for bb in bounding_boxes if all(bb[:, 2] > 0)]
-        return bounding_boxes
+        _, corners = boxes.corners(snapshot)
+        camera_snapshot = snapshot.find(camera.id)
+        camera_transform = camera.get_transform() if camera_snapshot is None else camera_snapshot.get_transform()
+        corners_2d, visible, _ = camera.projection.project_boxes(corners, camera_transform)
+        # filter objects behind camera or out of the view
+        return list(corners_2d[visible])
 
     @staticmethod
     def draw_bounding_boxes(display, bounding_boxes):
@@ -118,100 +128,6 @@ class ClientSideBoundingBoxes(object):
             pygame.draw.line(bb_surface, BB_COLOR, points[3], points[7])
         display.blit(bb_surface, (0, 0))
 
-    @staticmethod
-    def get_bounding_box(vehicle, camera):
-        """
-        Returns 3D bounding box for a vehicle based on camera view.
-        """
-
-        bb_cords = ClientSideBoundingBoxes._create_bb_points(vehicle)
-        cords_x_y_z = ClientSideBoundingBoxes._vehicle_to_sensor(bb_cords, vehicle, camera)[:3, :]
-        cords_y_minus_z_x = np.concatenate([cords_x_y_z[1, :], -cords_x_y_z[2, :], cords_x_y_z[0, :]])
-        bbox = np.transpose(np.dot(camera.calibration, cords_y_minus_z_x))
-        camera_bbox = np.concatenate([bbox[:, 0] / bbox[:, 2], bbox[:, 1] / bbox[:, 2], bbox[:, 2]], axis=1)
-        return camera_bbox
-
-    @staticmethod
-    def _create_bb_points(vehicle):
-        """
-        Returns 3D bounding box for a vehicle.
-        """
-
-        cords = np.zeros((8, 4))
-        extent = vehicle.bounding_box.extent
-        cords[0, :] = np.array([extent.x, extent.y, -extent.z, 1])
-        cords[1, :] = np.array([-extent.x, extent.y, -extent.z, 1])
-        cords[2, :] = np.array([-extent.x, -extent.y, -extent.z, 1])
-        cords[3, :] = np.array([extent.x, -extent.y, -extent.z, 1])
-        cords[4, :] = np.array([extent.x, extent.y, extent.z, 1])
-        cords[5, :] = np.array([-extent.x, extent.y, extent.z, 1])
-        cords[6, :] = np.array([-extent.x, -extent.y, extent.z, 1])
-        cords[7, :] = np.array([extent.x, -extent.y, extent.z, 1])
-        return cords
-
-    @staticmethod
-    def _vehicle_to_sensor(cords, vehicle, sensor):
-        """
-        Transforms coordinates of a vehicle bounding box to sensor.
-        """
-
-        world_cord = ClientSideBoundingBoxes._vehicle_to_world(cords, vehicle)
-        sensor_cord = ClientSideBoundingBoxes._world_to_sensor(world_cord, sensor)
-        return sensor_cord
-
-    @staticmethod
-    def _vehicle_to_world(cords, vehicle):
-        """
-        Transforms coordinates of a vehicle bounding box to world.
-        """
-
-        bb_transform = carla.Transform(vehicle.bounding_box.location)
-        bb_vehicle_matrix = ClientSideBoundingBoxes.get_matrix(bb_transform)
-        vehicle_world_matrix = ClientSideBoundingBoxes.get_matrix(vehicle.get_transform())
-        bb_world_matrix = np.dot(vehicle_world_matrix, bb_vehicle_matrix)
-        world_cords = np.dot(bb_world_matrix, np.transpose(cords))
-        return world_cords
-
-    @staticmethod
-    def _world_to_sensor(cords, sensor):
-        """
-        Transforms world coordinates to sensor.
-        """
-
-        sensor_world_matrix = ClientSideBoundingBoxes.get_matrix(sensor.get_transform())
-        world_sensor_matrix = np.linalg.inv(sensor_world_matrix)
-        sensor_cords = np.dot(world_sensor_matrix, cords)
-        return sensor_cords
-
-    @staticmethod
-    def get_matrix(transform):
-        """
-        Creates matrix from carla transform.
-        """
-
-        rotation = transform.rotation
-        location = transform.location
-        c_y = np.cos(np.radians(rotation.yaw))
-        s_y = np.sin(np.radians(rotation.yaw))
-        c_r = np.cos(np.radians(rotation.roll))
-        s_r = np.sin(np.radians(rotation.roll))
-        c_p = np.cos(np.radians(rotation.pitch))
-        s_p = np.sin(np.radians(rotation.pitch))
-        matrix = np.matrix(np.identity(4))
-        matrix[0, 3] = location.x
-        matrix[1, 3] = location.y
-        matrix[2, 3] = location.z
-        matrix[0, 0] = c_p * c_y
-        matrix[0, 1] = c_y * s_p * s_r - s_y * c_r
-        matrix[0, 2] = -c_y * s_p * c_r - s_y * s_r
-        matrix[1, 0] = s_y * c_p
-        matrix[1, 1] = s_y * s_p * s_r + c_y * c_r
-        matrix[1, 2] = -s_y * s_p * c_r + c_y * s_r
-        matrix[2, 0] = s_p
-        matrix[2, 1] = -c_p * s_r
-        matrix[2, 2] = c_p * c_r
-        return matrix
-
 
 # ==============================================================================
 # -- BasicSynchronousClient ----------------------------------------------------
@@ -265,7 +181,7 @@ class BasicSynchronousClient(object):
     def setup_camera(self):
         """
         Spawns actor-camera to be used to render view.
-        Sets calibration for client-side boxes rendering.
+        Sets projection for client-side boxes rendering.
         """
 
         camera_transform = carla.Transform(carla.Location(x=-5.5, z=2.8), carla.Rotation(pitch=-15))
@@ -273,11 +189,7 @@ class BasicSynchronousClient(object):
         weak_self = weakref.ref(self)
         self.camera.listen(lambda image: weak_self().set_image(weak_self, image))
 
-        calibration = np.identity(3)
-        calibration[0, 2] = VIEW_WIDTH / 2.0
-        calibration[1, 2] = VIEW_HEIGHT / 2.0
-        calibration[0, 0] = calibration[1, 1] = VIEW_WIDTH / (2.0 * np.tan(VIEW_FOV * np.pi / 360.0))
-        self.camera.calibration = calibration
+        self.camera.projection = CameraProjection(VIEW_WIDTH, VIEW_HEIGHT, VIEW_FOV)
 
     def control(self, car):
         """
@@ -354,15 +266,17 @@ class BasicSynchronousClient(object):
 
             self.set_synchronous_mode(True)
             vehicles = self.world.get_actors().filter('vehicle.*')
+            boxes = BoundingBoxes(vehicles)
 
             while True:
                 self.world.tick()
+                snapshot = self.world.get_snapshot()
 
                 self.capture = True
                 pygame_clock.tick_busy_loop(20)
 
                 self.render(self.display)
-                bounding_boxes = ClientSideBoundingBoxes.get_bounding_boxes(vehicles, self.camera)
+                bounding_boxes = ClientSideBoundingBoxes.get_bounding_boxes(boxes, snapshot, self.camera)
                 ClientSideBoundingBoxes.draw_bounding_boxes(self.display, bounding_boxes)
 
                 pygame.display.flip()
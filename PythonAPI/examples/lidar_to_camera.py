@@ -22,6 +22,11 @@ try:
 except IndexError:
     pass
 
+try:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + '/carla')
+except IndexError:
+    pass
+
 import carla
 
 import argparse
@@ -39,6 +44,8 @@ try:
 except ImportError:
     raise RuntimeError('cannot import PIL, make sure "Pillow" package is installed')
 
+from camera_projection import CameraProjection
+
 VIRIDIS = np.array(cm.get_cmap('viridis').colors)
 VID_RANGE = np.linspace(0.0, 1.0, VIRIDIS.shape[0])
 
@@ -110,21 +117,14 @@ def tutorial(args):
             transform=carla.Transform(carla.Location(x=1.0, z=1.8)),
             attach_to=vehicle)
 
-        # Build the K projection matrix:
+        # The projection of the camera keeps its K matrix, built from the
+        # resolution and the field of view of the blueprint:
         # K = [[Fx,  0, image_w/2],
         #      [ 0, Fy, image_h/2],
         #      [ 0,  0,         1]]
-        image_w = camera_bp.get_attribute("image_size_x").as_int()
-        image_h = camera_bp.get_attribute("image_size_y").as_int()
-        fov = camera_bp.get_attribute("fov").as_float()
-        focal = image_w / (2.0 * np.tan(fov * np.pi / 360.0))
-
         # In this case Fx and Fy are the same since the pixel aspect
         # ratio is 1
-        K = np.identity(3)
-        K[0, 0] = K[1, 1] = focal
-        K[0, 2] = image_w / 2.0
-        K[1, 2] = image_h / 2.0
+        projection = CameraProjection.from_blueprint(camera_bp)
 
         # The sensor data will be saved in thread-safe Queues
         image_queue = Queue()
@@ -151,88 +151,44 @@ def tutorial(args):
                 (frame, args.frames, world_frame, image_data.frame, lidar_data.frame) + ' ')
             sys.stdout.flush()
 
-            # Get the raw BGRA buffer and convert it to an array of RGB of
-            # shape (image_data.height, image_data.width, 3).
-            im_array = np.copy(np.frombuffer(image_data.raw_data, dtype=np.dtype("uint8")))
-            im_array = np.reshape(im_array, (image_data.height, image_data.width, 4))
-            im_array = im_array[:, :, :3][:, :, ::-1]
-
-            # Get the lidar data and convert it to a numpy array.
-            p_cloud_size = len(lidar_data)
-            p_cloud = np.copy(np.frombuffer(lidar_data.raw_data, dtype=np.dtype('f4')))
-            p_cloud = np.reshape(p_cloud, (p_cloud_size, 4))
-
-            # Lidar intensity array of shape (p_cloud_size,) but, for now, let's
-            # focus on the 3D points.
-            intensity = np.array(p_cloud[:, 3])
-
-            # Point cloud in lidar sensor space array of shape (3, p_cloud_size).
-            local_lidar_points = np.array(p_cloud[:, :3]).T
-
-            # Add an extra 1.0 at the end of each 3d point so it becomes of
-            # shape (4, p_cloud_size) and it can be multiplied by a (4, 4) matrix.
-            local_lidar_points = np.r_[
-                local_lidar_points, [np.ones(local_lidar_points.shape[1])]]
-
-            # This (4, 4) matrix transforms the points from lidar space to world space.
-            lidar_2_world = lidar.get_transform().get_matrix()
-
-            # Transform the points from lidar space to world space.
-            world_points = np.dot(lidar_2_world, local_lidar_points)
-
-            # This (4, 4) matrix transforms the points from world to sensor coordinates.
-            world_2_camera = np.array(camera.get_transform().get_inverse_matrix())
-
-            # Transform the points from world space to camera space.
-            sensor_points = np.dot(world_2_camera, world_points)
-
-            # New we must change from UE4's coordinate system to an "standard"
-            # camera coordinate system (the same used by OpenCV):
-
-            # ^ z                       . z
-            # |                        /
-            # |              to:      +-------> x
-            # | . x                   |
-            # |/                      |
-            # +-------> y             v y
-
-            # This can be achieved by multiplying by the following matrix:
-            # [[ 0,  1,  0 ],
-            #  [ 0,  0, -1 ],
-            #  [ 1,  0,  0 ]]
-
-            # Or, in this case, is the same as swapping:
-            # (x, y ,z) -> (y, -z, x)
-            point_in_camera_coords = np.array([
-                sensor_points[1],
-                sensor_points[2] * -1,
-                sensor_points[0]])
-
-            # Finally we can use our K matrix to do the actual 3D -> 2D.
-            points_2d = np.dot(K, point_in_camera_coords)
-
-            # Remember to normalize the x, y values by the 3rd value.
-            points_2d = np.array([
-                points_2d[0, :] / points_2d[2, :],
-                points_2d[1, :] / points_2d[2, :],
-                points_2d[2, :]])
-
-            # At this point, points_2d[0, :] contains all the x and points_2d[1, :]
-            # contains all the y values of our points. In order to properly
-            # visualize everything on a screen, the points that are out of the screen
-            # must be discarted, the same with points behind the camera projection plane.
-            points_2d = points_2d.T
-            intensity = intensity.T
-            points_in_canvas_mask = \
-                (points_2d[:, 0] > 0.0) & (points_2d[:, 0] < image_w) & \
-                (points_2d[:, 1] > 0.0) & (points_2d[:, 1] < image_h) & \
-                (points_2d[:, 2] > 0.0)
+            # Get the BGRA pixels and convert them to an array of RGB of
+            # shape (image_data.height, image_data.width, 3). The points are
+            # drawn on it, so it is copied from the read-only view.
+            im_array = np.copy(image_data.to_numpy()[:, :, :3][:, :, ::-1])
+
+            # Get the lidar data as a numpy array of shape (p_cloud_size, 4),
+            # with the x, y, z and intensity of each point.
+            p_cloud = lidar_data.to_numpy()
+
+            # The points are projected with a single (3, 4) matrix, the product of:
+            # - The (4, 4) matrix that transforms the points from lidar space to
+            #   world space, lidar.get_transform().get_matrix().
+            # - The (4, 4) matrix that transforms the points from world space to
+            #   camera space, camera.get_transform().get_inverse_matrix().
+            # - The change from UE4's coordinate system to an "standard" camera
+            #   coordinate system (the same used by OpenCV):
+            #
+            #   ^ z                       . z
+            #   |                        /
+            #   |              to:      +-------> x
+            #   | . x                   |
+            #   |/                      |
+            #   +-------> y             v y
+            #
+            #   (x, y ,z) -> (y, -z, x)
+            # - The K matrix, that does the actual 3D -> 2D.
+            #
+            # The result has shape (p_cloud_size, 3): the screen coords (u, v),
+            # already normalized by the 3rd value, and the depth of each point.
+            points_2d = projection.project(
+                p_cloud, camera.get_transform(), lidar.get_transform())
+
+            # In order to properly visualize everything on a screen, the points
+            # that are out of the screen must be discarted, the same with points
+            # behind the camera projection plane.
+            points_in_canvas_mask = projection.visible(points_2d)
             points_2d = points_2d[points_in_canvas_mask]
-            intensity = intensity[points_in_canvas_mask]
-
-            # Extract the screen coords (uv) as integers.
-            u_coord = points_2d[:, 0].astype(np.int)
-            v_coord = points_2d[:, 1].astype(np.int)
+            intensity = p_cloud[points_in_canvas_mask, 3]
 
             # Since at the time of the creation of this script, the intensity function
             # is returning high values, these are adjusted to be nicely visualized.
@@ -240,20 +196,11 @@ def tutorial(args):
             color_map = np.array([
                 np.interp(intensity, VID_RANGE, VIRIDIS[:, 0]) * 255.0,
                 np.interp(intensity, VID_RANGE, VIRIDIS[:, 1]) * 255.0,
-                np.interp(intensity, VID_RANGE, VIRIDIS[:, 2]) * 255.0]).astype(np.int).T
-
-            if args.dot_extent <= 0:
-                # Draw the 2d points on the image as a single pixel using numpy.
-                im_array[v_coord, u_coord] = color_map
-            else:
-                # Draw the 2d points on the image as squares of extent args.dot_extent.
-                for i in range(len(points_2d)):
-                    # I'm not a NumPy expert and I don't know how to set bigger dots
-                    # without using this loop, so if anyone has a better solution,
-                    # make sure to update this script. Meanwhile, it's fast enough :)
-                    im_array[
-                        v_coord[i]-args.dot_extent : v_coord[i]+args.dot_extent,
-                        u_coord[i]-args.dot_extent : u_coord[i]+args.dot_extent] = color_map[i]
+                np.interp(intensity, VID_RANGE, VIRIDIS[:, 2]) * 255.0]).astype(np.uint8).T
+
+            # Draw the 2d points on the image as squares of extent args.dot_extent.
+            # Where squares overlap, the pixels take the color of the closest point.
+            projection.splat(im_array, points_2d, color_map, size=args.dot_extent)
 
             # Save the image using Pillow module.
             image = Image.fromarray(im_array)
@@ -340,7 +287,7 @@ def main():
         help='lidar points per second (default: 100000)')
     args = argparser.parse_args()
     args.width, args.height = [int(x) for x in args.res.split('x')]
-    args.dot_extent -= 1
+    args.dot_extent = max(1, args.dot_extent)
 
     try:
         tutorial(args)
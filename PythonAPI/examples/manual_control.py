@@ -74,6 +74,14 @@ try:
 except IndexError:
     pass
 
+# ==============================================================================
+# -- Add PythonAPI for release mode --------------------------------------------
+# ==============================================================================
+try:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + '/carla')
+except IndexError:
+    pass
+
 
 # ==============================================================================
 # -- imports -------------------------------------------------------------------
@@ -84,6 +92,8 @@ import carla
 
 from carla import ColorConverter as cc
 
+from sensor_writer import SensorWriter
+
 import argparse
 import collections
 import datetime
@@ -353,8 +363,8 @@ class World(object):
     def destroy(self):
         if self.radar_sensor is not None:
             self.toggle_radar()
+        self.camera_manager.destroy()
         sensors = [
-            self.camera_manager.sensor,
             self.collision_sensor.sensor,
             self.lane_invasion_sensor.sensor,
             self.gnss_sensor.sensor,
@@ -751,13 +761,15 @@ class HUD(object):
             'Number of vehicles: % 8d' % len(vehicles)]
         if len(vehicles) > 1:
             self._info_text += ['Nearby vehicles:']
-            distance = lambda l: math.sqrt((l.x - t.location.x)**2 + (l.y - t.location.y)**2 + (l.z - t.location.z)**2)
-            vehicles = [(distance(x.get_location()), x) for x in vehicles if x.id != world.player.id]
-            for d, vehicle in sorted(vehicles, key=lambda vehicles: vehicles[0]):
-                if d > 200.0:
-                    break
-                vehicle_type = get_actor_display_name(vehicle, truncate=22)
-                self._info_text.append('% 4dm %s' % (d, vehicle_type))
+            # The locations of all the vehicles are read at once, and only the
+            # nearby ones are retrieved to get their names. Destroyed vehicles
+            # have NaN locations, so they are never nearby
+            locations = vehicles.get_transforms()['location']
+            distances = np.linalg.norm(locations - (t.location.x, t.location.y, t.location.z), axis=1)
+            nearby = np.flatnonzero((distances <= 200.0) & (vehicles.get_ids() != world.player.id))
+            for i in nearby[np.argsort(distances[nearby], kind='stable')].tolist():
+                vehicle_type = get_actor_display_name(vehicles[i], truncate=22)
+                self._info_text.append('% 4dm %s' % (distances[i], vehicle_type))
 
     def show_ackermann_info(self, enabled):
         self._show_ackermann_info = enabled
@@ -1044,9 +1056,8 @@ class RadarSensor(object):
         self = weak_self()
         if not self:
             return
-        # To get a numpy [[vel, altitude, azimuth, depth],...[,,,]]:
-        # points = np.frombuffer(radar_data.raw_data, dtype=np.dtype('f4'))
-        # points = np.reshape(points, (len(radar_data), 4))
+        # To get a numpy [[vel, azimuth, altitude, depth],...[,,,]]:
+        # points = radar_data.to_numpy()
 
         current_rot = radar_data.transform.rotation
         for detect in radar_data:
@@ -1088,6 +1099,7 @@ class CameraManager(object):
         self._parent = parent_actor
         self.hud = hud
         self.recording = False
+        self.writer = None
         bound_x = 0.5 + self._parent.bounding_box.extent.x
         bound_y = 0.5 + self._parent.bounding_box.extent.y
         bound_z = 0.5 + self._parent.bounding_box.extent.z
@@ -1180,7 +1192,25 @@ class CameraManager(object):
 
     def toggle_recording(self):
         self.recording = not self.recording
-        self.hud.notification('Recording %s' % ('On' if self.recording else 'Off'))
+        if self.recording and self.writer is None:
+            # Images are written by a pool of workers, so that encoding them
+            # doesn't slow down the sensor. Frames are dropped if it falls behind.
+            self.writer = SensorWriter(num_workers=2, max_pending=32)
+        if self.recording:
+            self.hud.notification('Recording On')
+        else:
+            stats = self.writer.stats()
+            self.hud.notification('Recording Off (%d frames written, %d pending, %d dropped)' % (
+                stats.written, stats.pending, stats.dropped))
+
+    def destroy(self):
+        if self.sensor is not None:
+            self.sensor.stop()
+            self.sensor.destroy()
+            self.sensor = None
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
 
     def render(self, display):
         if self.surface is not None:
@@ -1192,8 +1222,7 @@ class CameraManager(object):
         if not self:
             return
         if self.sensors[self.index][0].startswith('sensor.lidar'):
-            points = np.frombuffer(image.raw_data, dtype=np.dtype('f4'))
-            points = np.reshape(points, (int(points.shape[0] / 4), 4))
+            points = image.to_numpy()
             lidar_data = np.array(points[:, :2])
             lidar_data *= min(self.hud.dim) / (2.0 * self.lidar_range)
             lidar_data += (0.5 * self.hud.dim[0], 0.5 * self.hud.dim[1])
@@ -1205,30 +1234,31 @@ class CameraManager(object):
             lidar_img[tuple(lidar_data.T)] = (255, 255, 255)
             self.surface = pygame.surfarray.make_surface(lidar_img)
         elif self.sensors[self.index][0].startswith('sensor.camera.dvs'):
-            # Example of converting the raw_data from a carla.DVSEventArray
-            # sensor into a NumPy array and using it as an image
-            dvs_events = np.frombuffer(image.raw_data, dtype=np.dtype([
-                ('x', np.uint16), ('y', np.uint16), ('t', np.int64), ('pol', np.bool)]))
-            dvs_img = np.zeros((image.height, image.width, 3), dtype=np.uint8)
-            # Blue is positive, red is negative
-            dvs_img[dvs_events[:]['y'], dvs_events[:]['x'], dvs_events[:]['pol'] * 2] = 255
+            # Example of converting a carla.DVSEventArray sensor into an
+            # image, blue is positive and red is negative. Use to_numpy() to
+            # get the events themselves as a NumPy array
+            dvs_img = image.to_image()[:, :, 2::-1]
             self.surface = pygame.surfarray.make_surface(dvs_img.swapaxes(0, 1))
         elif self.sensors[self.index][0].startswith('sensor.camera.optical_flow'):
             image = image.get_color_coded_flow()
-            array = np.frombuffer(image.raw_data, dtype=np.dtype("uint8"))
-            array = np.reshape(array, (image.height, image.width, 4))
+            array = image.to_numpy()
             array = array[:, :, :3]
             array = array[:, :, ::-1]
             self.surface = pygame.surfarray.make_surface(array.swapaxes(0, 1))
         else:
             image.convert(self.sensors[self.index][1])
-            array = np.frombuffer(image.raw_data, dtype=np.dtype("uint8"))
-            array = np.reshape(array, (image.height, image.width, 4))
+            array = image.to_numpy()
             array = array[:, :, :3]
             array = array[:, :, ::-1]
             self.surface = pygame.surfarray.make_surface(array.swapaxes(0, 1))
         if self.recording:
-            image.save_to_disk('_out/%08d' % image.frame)
+            if self.sensors[self.index][0].startswith('sensor.lidar'):
+                extension = 'ply'
+            elif self.sensors[self.index][0].startswith('sensor.camera.dvs'):
+                extension = 'npz'
+            else:
+                extension = 'png'
+            self.writer.write(image, '_out/%08d.%s' % (image.frame, extension))
 
 
 # ==============================================================================
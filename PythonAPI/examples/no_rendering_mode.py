@@ -46,6 +46,11 @@ try:
 except IndexError:
     pass
 
+try:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + '/carla')
+except IndexError:
+    pass
+
 # ==============================================================================
 # -- imports -------------------------------------------------------------------
 # ==============================================================================
@@ -54,8 +59,10 @@ import carla
 from carla import TrafficLightState as tls
 
 import argparse
+import collections
 import logging
 import datetime
+import functools
 import weakref
 import math
 import random
@@ -88,6 +95,14 @@ try:
 except ImportError:
     raise RuntimeError('cannot import pygame, make sure pygame package is installed')
 
+try:
+    import numpy as np
+except ImportError:
+    raise RuntimeError('cannot import numpy, make sure numpy package is installed')
+
+from camera_projection import rotation_matrices
+from map_tiles import GEOMETRY_FILENAME, GEOMETRY_VERSION, MapGeometry, TileCache, split_dashes
+
 # ==============================================================================
 # -- Constants -----------------------------------------------------------------
 # ==============================================================================
@@ -172,6 +187,13 @@ class Util(object):
         """Returns the length of a vector"""
         return math.sqrt(v.x**2 + v.y**2 + v.z**2)
 
+    @staticmethod
+    def transform_points(transforms, points):
+        """Transforms the (N, K, 3) array with K points in the local coordinates of each one of N actors to world coordinates,
+        given the (N,) array with the transforms of the actors returned by carla.ActorList.get_transforms"""
+        rotations = rotation_matrices(transforms['rotation'])
+        return np.einsum('nij,nkj->nki', rotations, points) + transforms['location'][:, np.newaxis, :]
+
     @staticmethod
     def get_bounding_box(actor):
         """Gets the bounding box corners of an actor in world space"""
@@ -302,27 +324,26 @@ class HUD (object):
         """Adds a block of information in the left HUD panel of the visualizer"""
         self._info_text[title] = info
 
-    def render_vehicles_ids(self, vehicle_id_surface, list_actors, world_to_pixel, hero_actor, hero_transform):
+    def render_vehicles_ids(self, vehicle_id_surface, vehicles, world_to_pixels, hero_actor, hero_transform):
         """When flag enabled, it shows the IDs of the vehicles that are spawned in the world. Depending on the vehicle type,
         it will render it in different colors"""
 
         vehicle_id_surface.fill(COLOR_BLACK)
         if self.show_actor_ids:
             vehicle_id_surface.set_alpha(150)
-            for actor in list_actors:
-                x, y = world_to_pixel(actor[1].location)
-
+            positions = world_to_pixels(vehicles.transforms['location']).tolist()
+            for actor, (x, y) in zip(vehicles.actors, positions):
                 angle = 0
                 if hero_actor is not None:
                     angle = -hero_transform.rotation.yaw - 90
 
                 color = COLOR_SKY_BLUE_0
-                if int(actor[0].attributes['number_of_wheels']) == 2:
+                if int(actor.attributes['number_of_wheels']) == 2:
                     color = COLOR_CHOCOLATE_0
-                if actor[0].attributes['role_name'] == 'hero':
+                if actor.attributes['role_name'] == 'hero':
                     color = COLOR_CHAMELEON_0
 
-                font_surface = self._header_font.render(str(actor[0].id), True, color)
+                font_surface = self._header_font.render(str(actor.id), True, color)
                 rotated_font_surface = pygame.transform.rotate(font_surface, angle)
                 rect = rotated_font_surface.get_rect(center=(x, y))
                 vehicle_id_surface.blit(rotated_font_surface, rect)
@@ -427,83 +448,72 @@ class TrafficLightSurfaces(object):
 
 
 class MapImage(object):
-    """Class encharged of rendering a 2D image from top view of a carla world. Please note that a cache system is used, so if the OpenDrive content
-    of a Carla town has not changed, it will read and use the stored image if it was rendered in a previous execution"""
+    """Class encharged of rendering a 2D image from top view of a carla world. Please note that a cache system is used: the map is drawn
+    in tiles of several resolutions, only around the visible area and in parallel processes, and the tiles are stored per town and
+    OpenDrive content, so if the OpenDrive content of a Carla town has not changed, the tiles rendered in previous executions are reused"""
 
-    def __init__(self, carla_world, carla_map, pixels_per_meter, show_triggers, show_connections, show_spawn_points):
-        """ Renders the map image generated based on the world, its map and additional flags that provide extra information about the road network"""
+    def __init__(self, carla_world, carla_map, pixels_per_meter, show_triggers, show_connections, show_spawn_points, processes=None):
+        """ Prepares the tiles of the map image based on the world, its map and additional flags that provide extra information about the road network"""
         self._pixels_per_meter = pixels_per_meter
         self.scale = 1.0
+        self.level = 0
         self.show_triggers = show_triggers
         self.show_connections = show_connections
         self.show_spawn_points = show_spawn_points
 
-        waypoints = carla_map.generate_waypoints(2)
-        margin = 50
-        max_x = max(waypoints, key=lambda x: x.transform.location.x).transform.location.x + margin
-        max_y = max(waypoints, key=lambda x: x.transform.location.y).transform.location.y + margin
-        min_x = min(waypoints, key=lambda x: x.transform.location.x).transform.location.x - margin
-        min_y = min(waypoints, key=lambda x: x.transform.location.y).transform.location.y - margin
-
-        self.width = max(max_x - min_x, max_y - min_y)
-        self._world_offset = (min_x, min_y)
-
-        # Maximum size of a Pygame surface
-        width_in_pixels = (1 << 14) - 1
-
-        # Adapt Pixels per meter to make world fit in surface
-        surface_pixel_per_meter = int(width_in_pixels / self.width)
-        if surface_pixel_per_meter > PIXELS_PER_METER:
-            surface_pixel_per_meter = PIXELS_PER_METER
-
-        self._pixels_per_meter = surface_pixel_per_meter
-        width_in_pixels = int(self._pixels_per_meter * self.width)
-
-        self.big_map_surface = pygame.Surface((width_in_pixels, width_in_pixels)).convert()
-
         # Load OpenDrive content
         opendrive_content = carla_map.to_opendrive()
 
-        # Get hash based on content
+        # Get hash based on content and on everything else that changes the rendered map
         hash_func = hashlib.sha1()
         hash_func.update(opendrive_content.encode("UTF-8"))
+        hash_func.update(str((GEOMETRY_VERSION, pixels_per_meter,
+                              show_triggers, show_connections, show_spawn_points)).encode("UTF-8"))
         opendrive_hash = str(hash_func.hexdigest())
 
-        # Build path for saving or loading the cached rendered map
-        filename = carla_map.name.split('/')[-1] + "_" + opendrive_hash + ".tga"
-        dirname = os.path.join("cache", "no_rendering_mode")
-        full_path = str(os.path.join(dirname, filename))
+        # Build path of the cache of the rendered map. Each town and version has its own directory, so they can coexist
+        dirname = os.path.join("cache", "no_rendering_mode", carla_map.name.split('/')[-1] + "_" + opendrive_hash)
+        geometry_path = os.path.join(dirname, GEOMETRY_FILENAME)
 
-        if os.path.isfile(full_path):
-            # Load Image
-            self.big_map_surface = pygame.image.load(full_path)
-        else:
-            # Render map
-            self.draw_road_map(
-                self.big_map_surface,
-                carla_world,
-                carla_map,
-                self.world_to_pixel,
-                self.world_to_pixel_width)
-
-            # If folders path does not exist, create it
+        geometry = MapGeometry.load(geometry_path) if os.path.isfile(geometry_path) else None
+        if geometry is None:
+            # Record the map, which is drawn later tile by tile
+            geometry = self.record_road_map(carla_world, carla_map)
             if not os.path.exists(dirname):
                 os.makedirs(dirname)
+            geometry.save(geometry_path)
 
-            # Remove files if selected town had a previous version saved
-            list_filenames = glob.glob(os.path.join(dirname, carla_map.name) + "*")
-            for town_filename in list_filenames:
-                os.remove(town_filename)
+        self.width = geometry.width
+        self.width_in_pixels = geometry.width_in_pixels
+        self._world_offset = geometry.offset
 
-            # Save rendered map for next executions of same map
-            pygame.image.save(self.big_map_surface, full_path)
+        self.tiles = TileCache(dirname, geometry, processes=processes)
+        self._scaled_tiles = {}
 
-        self.surface = self.big_map_surface
+        # The coarsest level is a fallback for the tiles that are not rendered yet, so it is rendered first
+        coarsest_level = self.tiles.levels - 1
+        self.tiles.request(self.tiles.tiles_in_rect(coarsest_level, (0, 0, self.width_in_pixels, self.width_in_pixels)))
 
-    def draw_road_map(self, map_surface, carla_world, carla_map, world_to_pixel, world_to_pixel_width):
-        """Draws all the roads, including lane markings, arrows and traffic signs"""
-        map_surface.fill(COLOR_ALUMINIUM_4)
-        precision = 0.05
+    def record_road_map(self, carla_world, carla_map):
+        """Records the roads of the map and its bounds in a MapGeometry"""
+        waypoints = carla_map.generate_waypoints(2)
+        margin = 50
+        max_x = max(waypoints, key=lambda x: x.transform.location.x).transform.location.x + margin
+        max_y = max(waypoints, key=lambda x: x.transform.location.y).transform.location.y + margin
+        min_x = min(waypoints, key=lambda x: x.transform.location.x).transform.location.x - margin
+        min_y = min(waypoints, key=lambda x: x.transform.location.y).transform.location.y - margin
+
+        width = max(max_x - min_x, max_y - min_y)
+        geometry = MapGeometry((min_x, min_y), width, self._pixels_per_meter, background=COLOR_ALUMINIUM_4)
+
+        # The geometry is recorded in world coordinates
+        self.draw_road_map(geometry, carla_world, carla_map, lambda location: (location.x, location.y))
+        return geometry
+
+    def draw_road_map(self, map_surface, carla_world, carla_map, world_to_pixel):
+        """Draws all the roads, including lane markings, arrows and traffic signs. The map surface is a MapGeometry, with the
+        same drawing functions as pygame.draw, so the map can be drawn later at any resolution"""
+        precision = 0.5
 
         def lane_marking_color_to_tango(lane_marking_color):
             """Maps the lane marking color enum specified in PythonAPI to a Tango Color"""
@@ -529,16 +539,16 @@ class MapImage(object):
         def draw_solid_line(surface, color, closed, points, width):
             """Draws solid lines in a surface given a set of points, width and color"""
             if len(points) >= 2:
-                pygame.draw.lines(surface, color, closed, points, width)
+                surface.lines(color, closed, points, width)
 
         def draw_broken_line(surface, color, closed, points, width):
             """Draws broken lines in a surface given a set of points, width and color"""
-            # Select which lines are going to be rendered from the set of lines
-            broken_lines = [x for n, x in enumerate(zip(*(iter(points),) * 20)) if n % 3 == 0]
+            # Select which lines are going to be rendered from the set of lines, one meter long every three meters
+            broken_lines = split_dashes(points, 1.0, 3.0)
 
             # Draw selected lines
             for line in broken_lines:
-                pygame.draw.lines(surface, color, closed, line, width)
+                surface.lines(color, closed, line, width)
 
         def get_lane_markings(lane_marking_type, lane_marking_color, waypoints, sign):
             """For multiple lane marking types (SolidSolid, BrokenSolid, SolidBroken and BrokenBroken), it converts them
@@ -575,8 +585,8 @@ class MapImage(object):
                 polygon = [world_to_pixel(x) for x in polygon]
 
                 if len(polygon) > 2:
-                    pygame.draw.polygon(surface, color, polygon, 5)
-                    pygame.draw.polygon(surface, color, polygon)
+                    surface.polygon(color, polygon, 5)
+                    surface.polygon(color, polygon)
 
         def draw_lane_marking(surface, waypoints):
             """Draws the left and right side of lane markings"""
@@ -657,19 +667,18 @@ class MapImage(object):
             left = start + 0.8 * forward - 0.4 * right_dir
 
             # Draw lines
-            pygame.draw.lines(surface, color, False, [world_to_pixel(x) for x in [start, end]], 4)
-            pygame.draw.lines(surface, color, False, [world_to_pixel(x) for x in [left, start, right]], 4)
+            surface.lines(color, False, [world_to_pixel(x) for x in [start, end]], 4)
+            surface.lines(color, False, [world_to_pixel(x) for x in [left, start, right]], 4)
 
-        def draw_traffic_signs(surface, font_surface, actor, color=COLOR_ALUMINIUM_2, trigger_color=COLOR_PLUM_0):
+        def draw_traffic_signs(surface, text, actor, color=COLOR_ALUMINIUM_2, trigger_color=COLOR_PLUM_0):
             """Draw stop traffic signs and its bounding box if enabled"""
             transform = actor.get_transform()
             waypoint = carla_map.get_waypoint(transform.location)
 
+            # One meter high font, stretched to double height
             angle = -waypoint.transform.rotation.yaw - 90.0
-            font_surface = pygame.transform.rotate(font_surface, angle)
             pixel_pos = world_to_pixel(waypoint.transform.location)
-            offset = font_surface.get_rect(center=(pixel_pos[0], pixel_pos[1]))
-            surface.blit(font_surface, offset)
+            surface.text(color, text, pixel_pos, 1.0, angle, bold=True, stretch=2.0)
 
             # Draw line in front of stop
             forward_vector = carla.Location(waypoint.transform.get_forward_vector())
@@ -680,13 +689,13 @@ class MapImage(object):
                     (waypoint.transform.location + (forward_vector * 1.5) - (left_vector))]
 
             line_pixel = [world_to_pixel(p) for p in line]
-            pygame.draw.lines(surface, color, True, line_pixel, 2)
+            surface.lines(color, True, line_pixel, 2)
 
             # Draw bounding box of the stop trigger
             if self.show_triggers:
                 corners = Util.get_bounding_box(actor)
                 corners = [world_to_pixel(p) for p in corners]
-                pygame.draw.lines(surface, trigger_color, True, corners, 2)
+                surface.lines(trigger_color, True, corners, 2)
 
         # def draw_crosswalk(surface, transform=None, color=COLOR_ALUMINIUM_2):
         #     """Given two points A and B, draw white parallel lines from A to B"""
@@ -800,16 +809,17 @@ class MapImage(object):
                 polygon = [world_to_pixel(x) for x in polygon]
 
                 if len(polygon) > 2:
-                    pygame.draw.polygon(map_surface, COLOR_ALUMINIUM_5, polygon, 5)
-                    pygame.draw.polygon(map_surface, COLOR_ALUMINIUM_5, polygon)
+                    map_surface.polygon(COLOR_ALUMINIUM_5, polygon, 5)
+                    map_surface.polygon(COLOR_ALUMINIUM_5, polygon)
 
-                # Draw Lane Markings and Arrows
+                # Draw Lane Markings and Arrows, one every 20 meters
                 if not waypoint.is_junction:
                     draw_lane_marking(map_surface, [waypoints, waypoints])
                     for n, wp in enumerate(waypoints):
-                        if ((n + 1) % 400) == 0:
+                        if ((n + 1) % arrow_step) == 0:
                             draw_arrow(map_surface, wp.transform)
 
+        arrow_step = int(round(20.0 / precision))
         topology = carla_map.get_topology()
         draw_topology(topology, 0)
 
@@ -824,38 +834,27 @@ class MapImage(object):
             for wp in carla_map.generate_waypoints(dist):
                 col = (0, 255, 255) if wp.is_junction else (0, 255, 0)
                 for nxt in wp.next(dist):
-                    pygame.draw.line(map_surface, col, to_pixel(wp), to_pixel(nxt), 2)
+                    map_surface.line(col, to_pixel(wp), to_pixel(nxt), 2)
                 if wp.lane_change & carla.LaneChange.Right:
                     r = wp.get_right_lane()
                     if r and r.lane_type == carla.LaneType.Driving:
-                        pygame.draw.line(map_surface, col, to_pixel(wp), to_pixel(r), 2)
+                        map_surface.line(col, to_pixel(wp), to_pixel(r), 2)
                 if wp.lane_change & carla.LaneChange.Left:
                     l = wp.get_left_lane()
                     if l and l.lane_type == carla.LaneType.Driving:
-                        pygame.draw.line(map_surface, col, to_pixel(wp), to_pixel(l), 2)
+                        map_surface.line(col, to_pixel(wp), to_pixel(l), 2)
 
         actors = carla_world.get_actors()
 
         # Find and Draw Traffic Signs: Stops and Yields
-        font_size = world_to_pixel_width(1)
-        font = pygame.font.SysFont('Arial', font_size, True)
-
         stops = [actor for actor in actors if 'stop' in actor.type_id]
         yields = [actor for actor in actors if 'yield' in actor.type_id]
 
-        stop_font_surface = font.render("STOP", False, COLOR_ALUMINIUM_2)
-        stop_font_surface = pygame.transform.scale(
-            stop_font_surface, (stop_font_surface.get_width(), stop_font_surface.get_height() * 2))
-
-        yield_font_surface = font.render("YIELD", False, COLOR_ALUMINIUM_2)
-        yield_font_surface = pygame.transform.scale(
-            yield_font_surface, (yield_font_surface.get_width(), yield_font_surface.get_height() * 2))
-
         for ts_stop in stops:
-            draw_traffic_signs(map_surface, stop_font_surface, ts_stop, trigger_color=COLOR_SCARLET_RED_1)
+            draw_traffic_signs(map_surface, "STOP", ts_stop, trigger_color=COLOR_SCARLET_RED_1)
 
         for ts_yield in yields:
-            draw_traffic_signs(map_surface, yield_font_surface, ts_yield, trigger_color=COLOR_ORANGE_1)
+            draw_traffic_signs(map_surface, "YIELD", ts_yield, trigger_color=COLOR_ORANGE_1)
 
     def world_to_pixel(self, location, offset=(0, 0)):
         """Converts the world coordinates to pixel coordinates"""
@@ -863,16 +862,82 @@ class MapImage(object):
         y = self.scale * self._pixels_per_meter * (location.y - self._world_offset[1])
         return [int(x - offset[0]), int(y - offset[1])]
 
+    def world_to_pixel_array(self, points, offset=(0, 0)):
+        """Converts an array of world coordinates, whose last axis is (x, y, z), to an integer array of pixel coordinates"""
+        points = np.asarray(points)
+        x = self.scale * self._pixels_per_meter * (points[..., 0] - self._world_offset[0]) - offset[0]
+        y = self.scale * self._pixels_per_meter * (points[..., 1] - self._world_offset[1]) - offset[1]
+        return np.stack((x, y), axis=-1).astype(np.int64)
+
     def world_to_pixel_width(self, width):
         """Converts the world units to pixel units"""
         return int(self.scale * self._pixels_per_meter * width)
 
     def scale_map(self, scale):
-        """Scales the map surface"""
+        """Scales the map, which is drawn from the level of tiles with the closest resolution above the scaled one"""
         if scale != self.scale:
             self.scale = scale
-            width = int(self.big_map_surface.get_width() * self.scale)
-            self.surface = pygame.transform.smoothscale(self.big_map_surface, (width, width))
+            level = int(math.floor(math.log(1.0 / scale, 2) + 1e-6))
+            self.level = min(self.tiles.levels - 1, max(0, level))
+            self._scaled_tiles = {}
+
+    def render(self, surface, origin):
+        """Draws the part of the scaled map that is seen by a surface whose top left corner is at the given pixel. Missing tiles are
+        requested, together with the ones around them, and they are replaced by the tiles of coarser levels until they are rendered"""
+        self.tiles.poll()
+        tile_size = self.tiles.tile_size
+
+        # Size of a pixel of the level in the scaled map
+        factor = self.scale * (2 ** self.level)
+        rect = pygame.Rect(int(math.floor(origin[0] / factor)), int(math.floor(origin[1] / factor)),
+                           int(math.ceil(surface.get_width() / factor)) + 1, int(math.ceil(surface.get_height() / factor)) + 1)
+
+        visible_tiles = self.tiles.tiles_in_rect(self.level, rect)
+        self.tiles.request(visible_tiles)
+        self.tiles.request(self.tiles.tiles_in_rect(self.level, rect.inflate(2 * tile_size, 2 * tile_size)))
+
+        for tile in visible_tiles:
+            _, tile_x, tile_y = tile
+            # Rounding both corners of the tiles leaves no gaps between them
+            x, y = int(round(tile_x * tile_size * factor)), int(round(tile_y * tile_size * factor))
+            size = (int(round((tile_x + 1) * tile_size * factor)) - x, int(round((tile_y + 1) * tile_size * factor)) - y)
+            tile_surface = self._scaled_tile(tile, size)
+            if tile_surface is not None:
+                surface.blit(tile_surface, (x - origin[0], y - origin[1]))
+
+    def _scaled_tile(self, tile, size):
+        """Returns the surface of a tile at the current scale, or None if neither it nor a coarser tile has been rendered"""
+        scaled_surface = self._scaled_tiles.get(tile)
+        if scaled_surface is not None and scaled_surface.get_size() == size:
+            return scaled_surface
+
+        level, tile_x, tile_y = tile
+        tile_surface = self.tiles.get(level, tile_x, tile_y)
+        if tile_surface is None:
+            # Crop the part of a coarser tile covering this tile. It is not kept as the tile may be rendered soon
+            for coarser_level in range(level + 1, self.tiles.levels):
+                shift = coarser_level - level
+                coarser_surface = self.tiles.get(coarser_level, tile_x >> shift, tile_y >> shift)
+                if coarser_surface is not None:
+                    part = max(1, self.tiles.tile_size >> shift)
+                    area = pygame.Rect((tile_x % (1 << shift)) * part, (tile_y % (1 << shift)) * part, part, part)
+                    return pygame.transform.scale(coarser_surface.subsurface(area), size)
+            return None
+
+        if tile_surface.get_size() != size:
+            tile_surface = pygame.transform.smoothscale(tile_surface, size)
+        if len(self._scaled_tiles) >= self.tiles.max_tiles:
+            self._scaled_tiles = {}
+        self._scaled_tiles[tile] = tile_surface
+        return tile_surface
+
+    def close(self):
+        """Stops rendering tiles"""
+        self.tiles.close()
+
+
+# Actors of one kind, with the arrays of their transforms and bounding boxes returned by carla.ActorList
+ActorGroup = collections.namedtuple('ActorGroup', ['actors', 'transforms', 'bounding_boxes'])
 
 
 class World(object):
@@ -890,7 +955,7 @@ class World(object):
         # World data
         self.world = None
         self.town_map = None
-        self.actors_with_transforms = []
+        self.actors_with_transforms = None
 
         self._hud = None
         self._input = None
@@ -952,24 +1017,18 @@ class World(object):
             pixels_per_meter=PIXELS_PER_METER,
             show_triggers=self.args.show_triggers,
             show_connections=self.args.show_connections,
-            show_spawn_points=self.args.show_spawn_points)
+            show_spawn_points=self.args.show_spawn_points,
+            processes=self.args.map_processes)
 
         self._hud = hud
         self._input = input_control
 
         self.original_surface_size = min(self._hud.dim[0], self._hud.dim[1])
-        self.surface_size = self.map_image.big_map_surface.get_width()
+        self.surface_size = self.map_image.width_in_pixels
 
         self.scaled_size = int(self.surface_size)
         self.prev_scaled_size = int(self.surface_size)
 
-        # Render Actors
-        self.actors_surface = pygame.Surface((self.map_image.surface.get_width(), self.map_image.surface.get_height()))
-        self.actors_surface.set_colorkey(COLOR_BLACK)
-
-        self.vehicle_id_surface = pygame.Surface((self.surface_size, self.surface_size)).convert()
-        self.vehicle_id_surface.set_colorkey(COLOR_BLACK)
-
         self.border_round_surface = pygame.Surface(self._hud.dim, pygame.SRCALPHA).convert()
         self.border_round_surface.set_colorkey(COLOR_WHITE)
         self.border_round_surface.fill(COLOR_BLACK)
@@ -982,8 +1041,8 @@ class World(object):
         scaled_original_size = self.original_surface_size * (1.0 / 0.9)
         self.hero_surface = pygame.Surface((scaled_original_size, scaled_original_size)).convert()
 
-        self.result_surface = pygame.Surface((self.surface_size, self.surface_size)).convert()
-        self.result_surface.set_colorkey(COLOR_BLACK)
+        # Used for Map Mode, it covers the whole window
+        self.result_surface = pygame.Surface(self._hud.dim).convert()
 
         # Start hero mode by default
         self.select_hero_actor()
@@ -1029,7 +1088,7 @@ class World(object):
 
         # We store the transforms also so that we avoid having transforms of
         # previous tick and current tick when rendering them.
-        self.actors_with_transforms = [(actor, actor.get_transform()) for actor in actors]
+        self.actors_with_transforms = self._split_actors(actors)
         if self.hero_actor is not None:
             self.hero_transform = self.hero_actor.get_transform()
 
@@ -1094,45 +1153,36 @@ class World(object):
     def _show_nearby_vehicles(self, vehicles):
         """Shows nearby vehicles of the hero actor"""
         info_text = []
-        if self.hero_actor is not None and len(vehicles) > 1:
+        if self.hero_actor is not None and len(vehicles.actors) > 1:
             location = self.hero_transform.location
-            vehicle_list = [x[0] for x in vehicles if x[0].id != self.hero_actor.id]
-
-            def distance(v): return location.distance(v.get_location())
-            for n, vehicle in enumerate(sorted(vehicle_list, key=distance)):
-                if n > 15:
-                    break
+            distances = np.linalg.norm(vehicles.transforms['location'] - (location.x, location.y, location.z), axis=1)
+            others = [i for i, vehicle in enumerate(vehicles.actors) if vehicle.id != self.hero_actor.id]
+            for i in sorted(others, key=lambda i: distances[i])[:16]:
+                vehicle = vehicles.actors[i]
                 vehicle_type = get_actor_display_name(vehicle, truncate=22)
                 info_text.append('% 5d %s' % (vehicle.id, vehicle_type))
         self._hud.add_info('NEARBY VEHICLES', info_text)
 
-    def _split_actors(self):
-        """Splits the retrieved actors by type id"""
-        vehicles = []
-        traffic_lights = []
-        speed_limits = []
-        walkers = []
-
-        for actor_with_transform in self.actors_with_transforms:
-            actor = actor_with_transform[0]
-            if 'vehicle' in actor.type_id:
-                vehicles.append(actor_with_transform)
-            elif 'traffic_light' in actor.type_id:
-                traffic_lights.append(actor_with_transform)
-            elif 'speed_limit' in actor.type_id:
-                speed_limits.append(actor_with_transform)
-            elif 'walker.pedestrian' in actor.type_id:
-                walkers.append(actor_with_transform)
-
-        return (vehicles, traffic_lights, speed_limits, walkers)
-
-    def _render_traffic_lights(self, surface, list_tl, world_to_pixel):
+    @staticmethod
+    def _split_actors(actors):
+        """Splits the retrieved actors by type id. The transforms and bounding boxes of each kind of actor are read
+        at once for all of them, and only the actors that are rendered are retrieved from the list"""
+        groups = []
+        for pattern in ('*vehicle*', '*traffic_light*', '*speed_limit*', '*walker.pedestrian*'):
+            actor_list = actors.filter(pattern)
+            transforms = actor_list.get_transforms()
+            # Actors destroyed since the list was retrieved have NaN transforms and can't be drawn
+            alive = np.isfinite(transforms['location']).all(axis=1)
+            actors_alive = [actor for actor, is_alive in zip(actor_list, alive.tolist()) if is_alive]
+            groups.append(ActorGroup(actors_alive, transforms[alive], actor_list.get_bounding_boxes()[alive]))
+        return tuple(groups)
+
+    def _render_traffic_lights(self, surface, traffic_lights, world_to_pixel, world_to_pixels):
         """Renders the traffic lights and shows its triggers and bounding boxes if flags are enabled"""
         self.affected_traffic_light = None
 
-        for tl in list_tl:
-            world_pos = tl.get_location()
-            pos = world_to_pixel(world_pos)
+        positions = world_to_pixels(traffic_lights.transforms['location']).tolist()
+        for tl, pos in zip(traffic_lights.actors, positions):
 
             if self.args.show_triggers:
                 corners = Util.get_bounding_box(tl)
@@ -1157,16 +1207,15 @@ class World(object):
             srf = self.traffic_light_surfaces.surfaces[tl.state]
             surface.blit(srf, srf.get_rect(center=pos))
 
-    def _render_speed_limits(self, surface, list_sl, world_to_pixel, world_to_pixel_width):
+    def _render_speed_limits(self, surface, speed_limits, world_to_pixel, world_to_pixels, world_to_pixel_width):
         """Renders the speed limits by drawing two concentric circles (outer is red and inner white) and a speed limit text"""
 
         font_size = world_to_pixel_width(2)
         radius = world_to_pixel_width(2)
         font = pygame.font.SysFont('Arial', font_size)
 
-        for sl in list_sl:
-
-            x, y = world_to_pixel(sl.get_location())
+        positions = world_to_pixels(speed_limits.transforms['location']).tolist()
+        for sl, (x, y) in zip(speed_limits.actors, positions):
 
             # Render speed limit concentric circles
             white_circle_radius = int(radius * 0.75)
@@ -1194,60 +1243,62 @@ class World(object):
                 # In map mode, there is no need to rotate the text of the speed limit
                 surface.blit(font_surface, (x - radius / 2, y - radius / 2))
 
-    def _render_walkers(self, surface, list_w, world_to_pixel):
+    def _render_walkers(self, surface, walkers, world_to_pixels):
         """Renders the walkers' bounding boxes"""
-        for w in list_w:
-            color = COLOR_PLUM_0
-
-            # Compute bounding box points
-            bb = w[0].bounding_box.extent
-            corners = [
-                carla.Location(x=-bb.x, y=-bb.y),
-                carla.Location(x=bb.x, y=-bb.y),
-                carla.Location(x=bb.x, y=bb.y),
-                carla.Location(x=-bb.x, y=bb.y)]
-
-            w[1].transform(corners)
-            corners = [world_to_pixel(p) for p in corners]
-            pygame.draw.polygon(surface, color, corners)
-
-    def _render_vehicles(self, surface, list_v, world_to_pixel):
+        color = COLOR_PLUM_0
+
+        # Compute bounding box points of all the walkers at once
+        extent = walkers.bounding_boxes['extent']
+        x, y, zero = extent[:, 0:1], extent[:, 1:2], np.zeros((len(extent), 1))
+        corners = np.stack((
+            np.hstack((-x, x, x, -x)),
+            np.hstack((-y, -y, y, y)),
+            np.hstack((zero, zero, zero, zero))), axis=2)
+        corners = world_to_pixels(Util.transform_points(walkers.transforms, corners))
+
+        for walker_corners in corners.tolist():
+            pygame.draw.polygon(surface, color, walker_corners)
+
+    def _render_vehicles(self, surface, vehicles, world_to_pixels):
         """Renders the vehicles' bounding boxes"""
-        for v in list_v:
+        # Compute bounding box points of all the vehicles at once
+        extent = vehicles.bounding_boxes['extent']
+        x, y, zero = extent[:, 0:1], extent[:, 1:2], np.zeros((len(extent), 1))
+        corners = np.stack((
+            np.hstack((-x, x - 0.8, x, x - 0.8, -x, -x)),
+            np.hstack((-y, -y, zero, y, y, -y)),
+            np.hstack((zero, zero, zero, zero, zero, zero))), axis=2)
+        corners = world_to_pixels(Util.transform_points(vehicles.transforms, corners))
+
+        width = int(math.ceil(4.0 * self.map_image.scale))
+        for v, vehicle_corners in zip(vehicles.actors, corners.tolist()):
             color = COLOR_SKY_BLUE_0
-            if int(v[0].attributes['number_of_wheels']) == 2:
+            if int(v.attributes['number_of_wheels']) == 2:
                 color = COLOR_CHOCOLATE_1
-            if v[0].attributes['role_name'] == 'hero':
+            if v.attributes['role_name'] == 'hero':
                 color = COLOR_CHAMELEON_0
-            # Compute bounding box points
-            bb = v[0].bounding_box.extent
-            corners = [carla.Location(x=-bb.x, y=-bb.y),
-                       carla.Location(x=bb.x - 0.8, y=-bb.y),
-                       carla.Location(x=bb.x, y=0),
-                       carla.Location(x=bb.x - 0.8, y=bb.y),
-                       carla.Location(x=-bb.x, y=bb.y),
-                       carla.Location(x=-bb.x, y=-bb.y)
-                       ]
-            v[1].transform(corners)
-            corners = [world_to_pixel(p) for p in corners]
-            pygame.draw.lines(surface, color, False, corners, int(math.ceil(4.0 * self.map_image.scale)))
-
-    def render_actors(self, surface, vehicles, traffic_lights, speed_limits, walkers):
+            pygame.draw.lines(surface, color, False, vehicle_corners, width)
+
+    def render_actors(self, surface, vehicles, traffic_lights, speed_limits, walkers, world_to_pixel, world_to_pixels):
         """Renders all the actors"""
         # Static actors
-        self._render_traffic_lights(surface, [tl[0] for tl in traffic_lights], self.map_image.world_to_pixel)
-        self._render_speed_limits(surface, [sl[0] for sl in speed_limits], self.map_image.world_to_pixel,
+        self._render_traffic_lights(surface, traffic_lights, world_to_pixel, world_to_pixels)
+        self._render_speed_limits(surface, speed_limits, world_to_pixel, world_to_pixels,
                                   self.map_image.world_to_pixel_width)
 
         # Dynamic actors
-        self._render_vehicles(surface, vehicles, self.map_image.world_to_pixel)
-        self._render_walkers(surface, walkers, self.map_image.world_to_pixel)
+        self._render_vehicles(surface, vehicles, world_to_pixels)
+        self._render_walkers(surface, walkers, world_to_pixels)
+
+    def _create_view_surfaces(self, size):
+        """Creates the surfaces for the actors and their ids, which only cover the visible part of the map, if their size changed"""
+        if self.actors_surface is not None and self.actors_surface.get_size() == size:
+            return
+        self.actors_surface = pygame.Surface(size).convert()
+        self.actors_surface.set_colorkey(COLOR_BLACK)
 
-    def clip_surfaces(self, clipping_rect):
-        """Used to improve perfomance. Clips the surfaces in order to render only the part of the surfaces that are going to be visible"""
-        self.actors_surface.set_clip(clipping_rect)
-        self.vehicle_id_surface.set_clip(clipping_rect)
-        self.result_surface.set_clip(clipping_rect)
+        self.vehicle_id_surface = pygame.Surface(size).convert()
+        self.vehicle_id_surface.set_colorkey(COLOR_BLACK)
 
     def _compute_scale(self, scale_factor):
         """Based on the mouse wheel and mouse position, it will compute the scale and move the map so that it is zoomed in or out based on mouse position"""
@@ -1275,10 +1326,9 @@ class World(object):
         """Renders the map and all the actors in hero and map mode"""
         if self.actors_with_transforms is None:
             return
-        self.result_surface.fill(COLOR_BLACK)
 
-        # Split the actors by vehicle type id
-        vehicles, traffic_lights, speed_limits, walkers = self._split_actors()
+        # Actors split by type id
+        vehicles, traffic_lights, speed_limits, walkers = self.actors_with_transforms
 
         # Zoom in and out
         scale_factor = self._input.wheel_offset
@@ -1286,53 +1336,59 @@ class World(object):
         if self.scaled_size != self.prev_scaled_size:
             self._compute_scale(scale_factor)
 
-        # Render Actors
+        angle = 0.0 if self.hero_actor is None else self.hero_transform.rotation.yaw + 90.0
+        self.traffic_light_surfaces.rotozoom(-angle, self.map_image.scale)
+
+        if self.hero_actor is not None:
+            # Hero Mode
+            hero_location_screen = self.map_image.world_to_pixel(self.hero_transform.location)
+            hero_front = self.hero_transform.get_forward_vector()
+            translation_offset = (hero_location_screen[0] - self.hero_surface.get_width() / 2 + hero_front.x * PIXELS_AHEAD_VEHICLE,
+                                  (hero_location_screen[1] - self.hero_surface.get_height() / 2 + hero_front.y * PIXELS_AHEAD_VEHICLE))
+
+            # Only the part of the map around the hero is drawn
+            view_surface = self.hero_surface
+            view_offset = (int(translation_offset[0]), int(translation_offset[1]))
+        else:
+            # Map Mode
+            # Translation offset
+            translation_offset = (self._input.mouse_offset[0] * scale_factor + self.scale_offset[0],
+                                  self._input.mouse_offset[1] * scale_factor + self.scale_offset[1])
+            center_offset = (abs(display.get_width() - self.surface_size) / 2 * scale_factor, 0)
+
+            # Only the part of the map inside the window is drawn
+            view_surface = self.result_surface
+            view_offset = (int(-translation_offset[0] - center_offset[0]), int(-translation_offset[1]))
+
+        # Render Actors, in the pixels of the visible part of the map
+        world_to_pixel = functools.partial(self.map_image.world_to_pixel, offset=view_offset)
+        world_to_pixels = functools.partial(self.map_image.world_to_pixel_array, offset=view_offset)
+        self._create_view_surfaces(view_surface.get_size())
         self.actors_surface.fill(COLOR_BLACK)
         self.render_actors(
             self.actors_surface,
             vehicles,
             traffic_lights,
             speed_limits,
-            walkers)
+            walkers,
+            world_to_pixel,
+            world_to_pixels)
 
         # Render Ids
         self._hud.render_vehicles_ids(self.vehicle_id_surface, vehicles,
-                                      self.map_image.world_to_pixel, self.hero_actor, self.hero_transform)
+                                      world_to_pixels, self.hero_actor, self.hero_transform)
         # Show nearby actors from hero mode
         self._show_nearby_vehicles(vehicles)
 
         # Blit surfaces
-        surfaces = ((self.map_image.surface, (0, 0)),
-                    (self.actors_surface, (0, 0)),
+        view_surface.fill(COLOR_ALUMINIUM_4)
+        self.map_image.render(view_surface, view_offset)
+        surfaces = ((self.actors_surface, (0, 0)),
                     (self.vehicle_id_surface, (0, 0)),
                     )
+        Util.blits(view_surface, surfaces)
 
-        angle = 0.0 if self.hero_actor is None else self.hero_transform.rotation.yaw + 90.0
-        self.traffic_light_surfaces.rotozoom(-angle, self.map_image.scale)
-
-        center_offset = (0, 0)
         if self.hero_actor is not None:
-            # Hero Mode
-            hero_location_screen = self.map_image.world_to_pixel(self.hero_transform.location)
-            hero_front = self.hero_transform.get_forward_vector()
-            translation_offset = (hero_location_screen[0] - self.hero_surface.get_width() / 2 + hero_front.x * PIXELS_AHEAD_VEHICLE,
-                                  (hero_location_screen[1] - self.hero_surface.get_height() / 2 + hero_front.y * PIXELS_AHEAD_VEHICLE))
-
-            # Apply clipping rect
-            clipping_rect = pygame.Rect(translation_offset[0],
-                                        translation_offset[1],
-                                        self.hero_surface.get_width(),
-                                        self.hero_surface.get_height())
-            self.clip_surfaces(clipping_rect)
-
-            Util.blits(self.result_surface, surfaces)
-
-            self.border_round_surface.set_clip(clipping_rect)
-
-            self.hero_surface.fill(COLOR_ALUMINIUM_4)
-            self.hero_surface.blit(self.result_surface, (-translation_offset[0],
-                                                         -translation_offset[1]))
-
             rotated_result_surface = pygame.transform.rotozoom(self.hero_surface, angle, 0.9).convert()
 
             center = (display.get_width() / 2, display.get_height() / 2)
@@ -1341,25 +1397,14 @@ class World(object):
 
             display.blit(self.border_round_surface, (0, 0))
         else:
-            # Map Mode
-            # Translation offset
-            translation_offset = (self._input.mouse_offset[0] * scale_factor + self.scale_offset[0],
-                                  self._input.mouse_offset[1] * scale_factor + self.scale_offset[1])
-            center_offset = (abs(display.get_width() - self.surface_size) / 2 * scale_factor, 0)
-
-            # Apply clipping rect
-            clipping_rect = pygame.Rect(-translation_offset[0] - center_offset[0], -translation_offset[1],
-                                        self._hud.dim[0], self._hud.dim[1])
-            self.clip_surfaces(clipping_rect)
-            Util.blits(self.result_surface, surfaces)
-
-            display.blit(self.result_surface, (translation_offset[0] + center_offset[0],
-                                               translation_offset[1]))
+            display.blit(self.result_surface, (0, 0))
 
     def destroy(self):
         """Destroy the hero actor when class instance is destroyed"""
         if self.spawned_hero is not None:
             self.spawned_hero.destroy()
+        if self.map_image is not None:
+            self.map_image.close()
 
 # ==============================================================================
 # -- Input -----------------------------------------------------------
@@ -1619,6 +1664,12 @@ def main():
         '--show-spawn-points',
         action='store_true',
         help='show recommended spawn points')
+    argparser.add_argument(
+        '--map-processes',
+        metavar='N',
+        default=None,
+        type=int,
+        help='number of processes rendering the tiles of the map, 0 renders them in the main process (default: one per CPU)')
 
     # Parse arguments
     args = argparser.parse_args()
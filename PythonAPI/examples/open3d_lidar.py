@@ -61,8 +61,7 @@ LABEL_COLORS = np.array([
 def lidar_callback(point_cloud, point_list):
     """Prepares a point cloud with intensity
     colors ready to be consumed by Open3D"""
-    data = np.copy(np.frombuffer(point_cloud.raw_data, dtype=np.dtype('f4')))
-    data = np.reshape(data, (int(data.shape[0] / 4), 4))
+    data = point_cloud.to_numpy()
 
     # Isolate the intensity and compute a color for it
     intensity = data[:, -1]
@@ -72,8 +71,8 @@ def lidar_callback(point_cloud, point_list):
         np.interp(intensity_col, VID_RANGE, VIRIDIS[:, 1]),
         np.interp(intensity_col, VID_RANGE, VIRIDIS[:, 2])]
 
-    # Isolate the 3D data
-    points = data[:, :-1]
+    # Isolate the 3D data, copied as it is modified below
+    points = np.array(data[:, :-1])
 
     # We're negating the y to correclty visualize a world that matches
     # what we see in Unreal since Open3D uses a right-handed coordinate system
@@ -92,9 +91,7 @@ def lidar_callback(point_cloud, point_list):
 def semantic_lidar_callback(point_cloud, point_list):
     """Prepares a point cloud with semantic segmentation
     colors ready to be consumed by Open3D"""
-    data = np.frombuffer(point_cloud.raw_data, dtype=np.dtype([
-        ('x', np.float32), ('y', np.float32), ('z', np.float32),
-        ('CosAngle', np.float32), ('ObjIdx', np.uint32), ('ObjTag', np.uint32)]))
+    data = point_cloud.to_numpy()
 
     # We're negating the y to correclty visualize a world that matches
     # what we see in Unreal since Open3D uses a right-handed coordinate system
@@ -104,12 +101,12 @@ def semantic_lidar_callback(point_cloud, point_list):
     # points += np.random.uniform(-0.05, 0.05, size=points.shape)
 
     # Colorize the pointcloud based on the CityScapes color palette
-    labels = np.array(data['ObjTag'])
+    labels = np.array(data['object_tag'])
     int_color = LABEL_COLORS[labels]
 
     # # In case you want to make the color intensity depending
     # # of the incident ray angle, you can use:
-    # int_color *= np.array(data['CosAngle'])[:, None]
+    # int_color *= np.array(data['cos_inc_angle'])[:, None]
 
     point_list.points = o3d.utility.Vector3dVector(points)
     point_list.colors = o3d.utility.Vector3dVector(int_color)
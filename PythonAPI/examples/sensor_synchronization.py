@@ -13,19 +13,17 @@ The communication model for the syncronous mode in CARLA sends the snapshot
 of the world and the sensors streams in parallel.
 We provide this script as an example of how to syncrononize the sensor
 data gathering in the client.
-To to this, we create a queue that is being filled by every sensor when the
-client receives its data and the main loop is blocked until all the sensors
-have received its data.
+To to this, we use a FrameSynchronizer that gathers the data of every sensor by
+frame as the client receives it, and the main loop is blocked until all the
+sensors have received the data of the current frame, or until a timeout expires.
 This suppose that all the sensors gather information at every tick. It this is
-not the case, the clients needs to take in account at each frame how many
-sensors are going to tick at each frame.
+not the case, the bundles of the frames in which some sensors don't tick are
+returned with the missing sensors once the timeout expires.
 """
 
 import glob
 import os
 import sys
-from queue import Queue
-from queue import Empty
 
 try:
     sys.path.append(glob.glob('../carla/dist/carla-*%d.%d-%s.egg' % (
@@ -35,17 +33,14 @@ try:
 except IndexError:
     pass
 
-import carla
+try:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + '/carla')
+except IndexError:
+    pass
 
+import carla
 
-# Sensor callback.
-# This is where you receive the sensor data and
-# process it as you liked and the important part is that,
-# at the end, it should include an element into the sensor queue.
-def sensor_callback(sensor_data, sensor_queue, sensor_name):
-    # Do stuff with the sensor_data data like save it to disk
-    # Then you just need to add to the queue
-    sensor_queue.put((sensor_data.frame, sensor_name))
+from frame_synchronizer import FrameSynchronizer
 
 
 def main():
@@ -65,10 +60,11 @@ def main():
         settings.synchronous_mode = True
         world.apply_settings(settings)
 
-        # We create the sensor queue in which we keep track of the information
+        # We create the synchronizer in which we keep track of the information
         # already received. This structure is thread safe and can be
         # accessed by all the sensors callback concurrently without problem.
-        sensor_queue = Queue()
+        # It keeps at most 4 pending frames per sensor, dropping the oldest ones.
+        synchronizer = FrameSynchronizer(max_pending_frames=4)
 
         # Bluepints for the sensors
         blueprint_library = world.get_blueprint_library()
@@ -80,48 +76,52 @@ def main():
         sensor_list = []
 
         cam01 = world.spawn_actor(cam_bp, carla.Transform())
-        cam01.listen(lambda data: sensor_callback(data, sensor_queue, "camera01"))
+        synchronizer.add_sensor(cam01, "camera01")
         sensor_list.append(cam01)
 
         lidar_bp.set_attribute('points_per_second', '100000')
         lidar01 = world.spawn_actor(lidar_bp, carla.Transform())
-        lidar01.listen(lambda data: sensor_callback(data, sensor_queue, "lidar01"))
+        synchronizer.add_sensor(lidar01, "lidar01")
         sensor_list.append(lidar01)
 
         lidar_bp.set_attribute('points_per_second', '1000000')
         lidar02 = world.spawn_actor(lidar_bp, carla.Transform())
-        lidar02.listen(lambda data: sensor_callback(data, sensor_queue, "lidar02"))
+        synchronizer.add_sensor(lidar02, "lidar02")
         sensor_list.append(lidar02)
 
         radar01 = world.spawn_actor(radar_bp, carla.Transform())
-        radar01.listen(lambda data: sensor_callback(data, sensor_queue, "radar01"))
+        synchronizer.add_sensor(radar01, "radar01")
         sensor_list.append(radar01)
 
         radar02 = world.spawn_actor(radar_bp, carla.Transform())
-        radar02.listen(lambda data: sensor_callback(data, sensor_queue, "radar02"))
+        synchronizer.add_sensor(radar02, "radar02")
         sensor_list.append(radar02)
 
         # Main loop
         while True:
             # Tick the server
-            world.tick()
-            w_frame = world.get_snapshot().frame
+            w_frame = world.tick()
+            synchronizer.request(w_frame)
             print("\nWorld's frame: %d" % w_frame)
 
             # Now, we wait to the sensors data to be received.
-            # As the queue is blocking, we will wait in the queue.get() methods
-            # until all the information is processed and we continue with the next frame.
-            # We include a timeout of 1.0 s (in the get method) and if some information is
-            # not received in this time we continue.
-            try:
-                for _ in range(len(sensor_list)):
-                    s_frame = sensor_queue.get(True, 1.0)
-                    print("    Frame: %d   Sensor: %s" % (s_frame[0], s_frame[1]))
-
-            except Empty:
-                print("    Some of the sensor information is missed")
+            # The synchronizer blocks in the get() method until all the information
+            # of the frame is received and we continue with the next frame.
+            # We include a timeout of 1.0 s and if some information is not received
+            # in this time we continue with the data already received.
+            bundle = synchronizer.get(w_frame, timeout=1.0)
+            for sensor_name, sensor_data in bundle.data.items():
+                # Do stuff with the sensor_data data like save it to disk
+                if sensor_data is not None:
+                    print("    Frame: %d   Sensor: %s" % (sensor_data.frame, sensor_name))
+
+            if not bundle.complete:
+                print("    Some of the sensor information is missed: %s" % ", ".join(bundle.missing))
 
     finally:
+        for name, stats in synchronizer.stats().items():
+            print("%s: %s" % (name, stats))
+        synchronizer.close()
         world.apply_settings(original_settings)
         for sensor in sensor_list:
             sensor.destroy()
@@ -18,16 +18,28 @@ try:
 except IndexError:
     pass
 
+try:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + '/carla')
+except IndexError:
+    pass
+
 import carla
 
 import random
 import time
 
+from sensor_writer import SensorWriter
+
 
 
 def main():
     actor_list = []
 
+    # Encoding 14 PNG images per frame takes longer than a frame, so instead
+    # of saving them in the sensor callbacks, we let a pool of workers do it.
+    # If the workers fall behind, the new images are dropped (and counted).
+    writer = SensorWriter(num_workers=4, max_pending=128)
+
     # In this tutorial script, we are going to add a vehicle to the simulation
     # and let it drive in autopilot. We will also create a camera attached to
     # that vehicle, and save all the images generated by the camera to disk.
@@ -90,27 +102,27 @@ def main():
         # Register a callback for whenever a new frame is available. This step is
         # currently required to correctly receive the gbuffer textures, as it is 
         # used to determine whether the sensor is active.
-        camera.listen(lambda image: image.save_to_disk('_out/FinalColor-%06d.png' % image.frame))
+        camera.listen(lambda image: writer.write(image, '_out/FinalColor-%06d.png' % image.frame))
 
         # Here we will register the callbacks for each gbuffer texture.
         # The function "listen_to_gbuffer" behaves like the regular listen function,
         # but you must first pass it the ID of the desired gbuffer texture.
-        camera.listen_to_gbuffer(carla.GBufferTextureID.SceneColor, lambda image: image.save_to_disk('_out/GBuffer-SceneColor-%06d.png' % image.frame))
-        camera.listen_to_gbuffer(carla.GBufferTextureID.SceneDepth, lambda image: image.save_to_disk('_out/GBuffer-SceneDepth-%06d.png' % image.frame))
-        camera.listen_to_gbuffer(carla.GBufferTextureID.SceneStencil, lambda image: image.save_to_disk('_out/GBuffer-SceneStencil-%06d.png' % image.frame))
-        camera.listen_to_gbuffer(carla.GBufferTextureID.GBufferA, lambda image: image.save_to_disk('_out/GBuffer-A-%06d.png' % image.frame))
-        camera.listen_to_gbuffer(carla.GBufferTextureID.GBufferB, lambda image: image.save_to_disk('_out/GBuffer-B-%06d.png' % image.frame))
-        camera.listen_to_gbuffer(carla.GBufferTextureID.GBufferC, lambda image: image.save_to_disk('_out/GBuffer-C-%06d.png' % image.frame))
-        camera.listen_to_gbuffer(carla.GBufferTextureID.GBufferD, lambda image: image.save_to_disk('_out/GBuffer-D-%06d.png' % image.frame))
+        camera.listen_to_gbuffer(carla.GBufferTextureID.SceneColor, lambda image: writer.write(image, '_out/GBuffer-SceneColor-%06d.png' % image.frame))
+        camera.listen_to_gbuffer(carla.GBufferTextureID.SceneDepth, lambda image: writer.write(image, '_out/GBuffer-SceneDepth-%06d.png' % image.frame))
+        camera.listen_to_gbuffer(carla.GBufferTextureID.SceneStencil, lambda image: writer.write(image, '_out/GBuffer-SceneStencil-%06d.png' % image.frame))
+        camera.listen_to_gbuffer(carla.GBufferTextureID.GBufferA, lambda image: writer.write(image, '_out/GBuffer-A-%06d.png' % image.frame))
+        camera.listen_to_gbuffer(carla.GBufferTextureID.GBufferB, lambda image: writer.write(image, '_out/GBuffer-B-%06d.png' % image.frame))
+        camera.listen_to_gbuffer(carla.GBufferTextureID.GBufferC, lambda image: writer.write(image, '_out/GBuffer-C-%06d.png' % image.frame))
+        camera.listen_to_gbuffer(carla.GBufferTextureID.GBufferD, lambda image: writer.write(image, '_out/GBuffer-D-%06d.png' % image.frame))
         # Note that some gbuffer textures may not be available for a particular scene.
         # For example, the textures E and F are likely unavailable in this example,
         # which will result in them being sent as black images.
-        camera.listen_to_gbuffer(carla.GBufferTextureID.GBufferE, lambda image: image.save_to_disk('_out/GBuffer-E-%06d.png' % image.frame))
-        camera.listen_to_gbuffer(carla.GBufferTextureID.GBufferF, lambda image: image.save_to_disk('_out/GBuffer-F-%06d.png' % image.frame))
-        camera.listen_to_gbuffer(carla.GBufferTextureID.Velocity, lambda image: image.save_to_disk('_out/GBuffer-Velocity-%06d.png' % image.frame))
-        camera.listen_to_gbuffer(carla.GBufferTextureID.SSAO, lambda image: image.save_to_disk('_out/GBuffer-SSAO-%06d.png' % image.frame))
-        camera.listen_to_gbuffer(carla.GBufferTextureID.CustomDepth, lambda image: image.save_to_disk('_out/GBuffer-CustomDepth-%06d.png' % image.frame))
-        camera.listen_to_gbuffer(carla.GBufferTextureID.CustomStencil, lambda image: image.save_to_disk('_out/GBuffer-CustomStencil-%06d.png' % image.frame))
+        camera.listen_to_gbuffer(carla.GBufferTextureID.GBufferE, lambda image: writer.write(image, '_out/GBuffer-E-%06d.png' % image.frame))
+        camera.listen_to_gbuffer(carla.GBufferTextureID.GBufferF, lambda image: writer.write(image, '_out/GBuffer-F-%06d.png' % image.frame))
+        camera.listen_to_gbuffer(carla.GBufferTextureID.Velocity, lambda image: writer.write(image, '_out/GBuffer-Velocity-%06d.png' % image.frame))
+        camera.listen_to_gbuffer(carla.GBufferTextureID.SSAO, lambda image: writer.write(image, '_out/GBuffer-SSAO-%06d.png' % image.frame))
+        camera.listen_to_gbuffer(carla.GBufferTextureID.CustomDepth, lambda image: writer.write(image, '_out/GBuffer-CustomDepth-%06d.png' % image.frame))
+        camera.listen_to_gbuffer(carla.GBufferTextureID.CustomStencil, lambda image: writer.write(image, '_out/GBuffer-CustomStencil-%06d.png' % image.frame))
 
         time.sleep(10)
 
@@ -119,6 +131,9 @@ def main():
         print('destroying actors')
         camera.destroy()
         client.apply_batch([carla.command.DestroyActor(x) for x in actor_list])
+        print('writing pending images')
+        writer.close()
+        print(writer.stats())
         print('done.')
 
 
@@ -171,8 +171,7 @@ class SensorManager:
         t_start = self.timer.time()
 
         image.convert(carla.ColorConverter.Raw)
-        array = np.frombuffer(image.raw_data, dtype=np.dtype("uint8"))
-        array = np.reshape(array, (image.height, image.width, 4))
+        array = image.to_numpy()
         array = array[:, :, :3]
         array = array[:, :, ::-1]
 
@@ -189,8 +188,7 @@ class SensorManager:
         disp_size = self.display_man.get_display_size()
         lidar_range = 2.0*float(self.sensor_options['range'])
 
-        points = np.frombuffer(image.raw_data, dtype=np.dtype('f4'))
-        points = np.reshape(points, (int(points.shape[0] / 4), 4))
+        points = image.to_numpy()
         lidar_data = np.array(points[:, :2])
         lidar_data *= min(disp_size) / lidar_range
         lidar_data += (0.5 * disp_size[0], 0.5 * disp_size[1])
@@ -215,9 +213,8 @@ class SensorManager:
         disp_size = self.display_man.get_display_size()
         lidar_range = 2.0*float(self.sensor_options['range'])
 
-        points = np.frombuffer(image.raw_data, dtype=np.dtype('f4'))
-        points = np.reshape(points, (int(points.shape[0] / 6), 6))
-        lidar_data = np.array(points[:, :2])
+        points = image.to_numpy()
+        lidar_data = np.column_stack((points['x'], points['y']))
         lidar_data *= min(disp_size) / lidar_range
         lidar_data += (0.5 * disp_size[0], 0.5 * disp_size[1])
         lidar_data = np.fabs(lidar_data)  # pylint: disable=E1111
@@ -237,8 +234,7 @@ class SensorManager:
 
     def save_radar_image(self, radar_data):
         t_start = self.timer.time()
-        points = np.frombuffer(radar_data.raw_data, dtype=np.dtype('f4'))
-        points = np.reshape(points, (len(radar_data), 4))
+        points = radar_data.to_numpy()
 
         t_end = self.timer.time()
         self.time_processing += (t_end-t_start)
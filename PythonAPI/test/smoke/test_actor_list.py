@@ -0,0 +1,110 @@
+# Copyright (c) 2019 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+import carla
+import math
+import random
+import time
+
+from . import SyncSmokeTest
+
+
+class TestActorList(SyncSmokeTest):
+    def setUp(self):
+        super(TestActorList, self).setUp()
+        self.world = self.client.reload_world()
+        # workaround: give time to UE4 to clean memory after loading (old assets)
+        time.sleep(5)
+        self.settings = self.world.get_settings()
+        settings = carla.WorldSettings(
+            no_rendering_mode=False,
+            synchronous_mode=True,
+            fixed_delta_seconds=0.05)
+        self.world.apply_settings(settings)
+
+        spawn_points = self.world.get_map().get_spawn_points()[:20]
+        vehicles = self.world.get_blueprint_library().filter('vehicle.*')
+        batch = [carla.command.SpawnActor(random.choice(vehicles), t) for t in spawn_points]
+        response = self.client.apply_batch_sync(batch, False)
+        self.assertFalse(any(x.error for x in response))
+        self.ids = [x.actor_id for x in response]
+
+        # Let the vehicles fall, so they have some velocity
+        for _ in range(10):
+            self.world.tick()
+
+    def tearDown(self):
+        self.client.apply_batch_sync([carla.command.DestroyActor(x) for x in self.ids], False)
+        super(TestActorList, self).tearDown()
+
+    def assertVectorAlmostEqual(self, row, vector, msg=None):
+        self.assertAlmostEqual(row[0], vector.x, places=3, msg=msg)
+        self.assertAlmostEqual(row[1], vector.y, places=3, msg=msg)
+        self.assertAlmostEqual(row[2], vector.z, places=3, msg=msg)
+
+    def assertRotationAlmostEqual(self, row, rotation, msg=None):
+        self.assertAlmostEqual(row[0], rotation.pitch, places=3, msg=msg)
+        self.assertAlmostEqual(row[1], rotation.yaw, places=3, msg=msg)
+        self.assertAlmostEqual(row[2], rotation.roll, places=3, msg=msg)
+
+    def test_bulk_queries(self):
+        print("TestActorList.test_bulk_queries")
+        actors = self.world.get_actors(self.ids)
+        self.assertEqual(len(actors), len(self.ids))
+
+        ids = actors.get_ids()
+        transforms = actors.get_transforms()
+        velocities = actors.get_velocities()
+        bounding_boxes = actors.get_bounding_boxes()
+        self.assertEqual(ids.shape, (len(actors),))
+        self.assertEqual(transforms.shape, (len(actors),))
+        self.assertEqual(velocities.shape, (len(actors), 3))
+        self.assertEqual(bounding_boxes.shape, (len(actors),))
+
+        for i, actor in enumerate(actors):
+            self.assertEqual(ids[i], actor.id)
+            transform = actor.get_transform()
+            self.assertVectorAlmostEqual(transforms['location'][i], transform.location, msg=actor.id)
+            self.assertRotationAlmostEqual(transforms['rotation'][i], transform.rotation, msg=actor.id)
+            self.assertVectorAlmostEqual(velocities[i], actor.get_velocity(), msg=actor.id)
+            bounding_box = actor.bounding_box
+            self.assertVectorAlmostEqual(bounding_boxes['location'][i], bounding_box.location, msg=actor.id)
+            self.assertVectorAlmostEqual(bounding_boxes['extent'][i], bounding_box.extent, msg=actor.id)
+            self.assertRotationAlmostEqual(bounding_boxes['rotation'][i], bounding_box.rotation, msg=actor.id)
+
+    def test_destroyed_actors(self):
+        print("TestActorList.test_destroyed_actors")
+        actors = self.world.get_actors(self.ids)
+        destroyed_id = self.ids[0]
+        self.client.apply_batch_sync([carla.command.DestroyActor(destroyed_id)], True)
+        self.ids = self.ids[1:]
+
+        # The list still has the destroyed actor, with NaN values instead of the origin
+        ids = actors.get_ids().tolist()
+        transforms = actors.get_transforms()
+        velocities = actors.get_velocities()
+        for i, actor_id in enumerate(ids):
+            destroyed = actor_id == destroyed_id
+            for value in transforms['location'][i].tolist() + velocities[i].tolist():
+                self.assertEqual(math.isnan(value), destroyed, msg=actor_id)
+
+    def test_snapshot_to_numpy(self):
+        print("TestActorList.test_snapshot_to_numpy")
+        snapshot = self.world.get_snapshot()
+        actors = snapshot.to_numpy()
+        self.assertEqual(len(actors), len(snapshot))
+        self.assertEqual(actors['id'].tolist(), sorted(actors['id'].tolist()))
+        self.assertTrue(set(self.ids) <= set(actors['id'].tolist()))
+
+        for row in actors:
+            actor_snapshot = snapshot.find(int(row['id']))
+            self.assertIsNotNone(actor_snapshot)
+            transform = actor_snapshot.get_transform()
+            self.assertVectorAlmostEqual(row['location'], transform.location, msg=row['id'])
+            self.assertRotationAlmostEqual(row['rotation'], transform.rotation, msg=row['id'])
+            self.assertVectorAlmostEqual(row['velocity'], actor_snapshot.get_velocity(), msg=row['id'])
+            self.assertVectorAlmostEqual(row['angular_velocity'], actor_snapshot.get_angular_velocity(), msg=row['id'])
+            self.assertVectorAlmostEqual(row['acceleration'], actor_snapshot.get_acceleration(), msg=row['id'])
@@ -4,6 +4,7 @@
 # This work is licensed under the terms of the MIT license.
 # For a copy, see <https://opensource.org/licenses/MIT>.
 
+import numpy as np
 from numpy import random
 from . import SmokeTest
 import time
@@ -31,15 +32,16 @@ class TestDeterminism(SmokeTest):
             num_actors1 = len(record1.vehicle_position_list)
             num_actors2 = len(record2.vehicle_position_list)
             self.assertEqual(num_actors1, num_actors2, msg="Number of actors mismatch")
-            for j in range(0, num_actors1):
+            mismatches = np.nonzero(np.any(record1.vehicle_position_list != record2.vehicle_position_list, axis=1))[0]
+            if len(mismatches):
+                j = mismatches[0]
                 loc1 = record1.vehicle_position_list[j]
                 loc2 = record2.vehicle_position_list[j]
-                self.assertEqual(loc1, loc2, msg="Actor location missmatch at frame %s. %s != %s"
+                self.fail("Actor location missmatch at frame %s. %s != %s"
                     % (str(record1.frame), str(loc1), str(loc2)))
 
     def spawn_vehicles(self, world, blueprint_transform_list):
         traffic_manager = self.client.get_trafficmanager(TM_PORT)
-        vehicle_actor_list = []
 
         SpawnActor = carla.command.SpawnActor
         SetAutopilot = carla.command.SetAutopilot
@@ -55,21 +57,23 @@ class TestDeterminism(SmokeTest):
             if not response.error:
                 vehicle_actor_ids.append(response.actor_id)
 
-        vehicle_actor_list = world.get_actors(vehicle_actor_ids)
+        # In the order of the batch, so each position is the same vehicle in every run
+        return vehicle_actor_ids
 
-        return vehicle_actor_list
-
-    def run_simulation(self, world, vehicle_actor_list):
+    def run_simulation(self, world, vehicle_actor_ids):
         simulation_record = []
+        vehicle_ids = np.array(vehicle_actor_ids)
         ticks = 1
         while True:
             if ticks == NUM_TICKS:
                 break
             else:
-                position_list = []
-                for vehicle in vehicle_actor_list:
-                    location = vehicle.get_location()
-                    position_list.append(location)
+                # Locations of all the vehicles at once, matched by id to vehicle_actor_ids
+                actors = world.get_snapshot().to_numpy()
+                order = np.argsort(actors['id'])
+                rows = order[np.minimum(np.searchsorted(actors['id'][order], vehicle_ids), len(order) - 1)]
+                self.assertTrue(np.array_equal(actors['id'][rows], vehicle_ids), msg="Vehicle missing from the snapshot")
+                position_list = actors['location'][rows]
                 simulation_record.append(FrameRecord(ticks, position_list))
                 ticks = ticks + 1
                 world.tick()
@@ -128,8 +132,8 @@ class TestDeterminism(SmokeTest):
         traffic_manager.set_hybrid_physics_mode(True)
 
         # run simulation 1
-        vehicle_actor_list = self.spawn_vehicles(world, blueprint_transform_list)
-        record_run1 = self.run_simulation(world, vehicle_actor_list)
+        vehicle_actor_ids = self.spawn_vehicles(world, blueprint_transform_list)
+        record_run1 = self.run_simulation(world, vehicle_actor_ids)
         traffic_manager.shut_down()
 
         # reset for simulation 2
@@ -143,8 +147,8 @@ class TestDeterminism(SmokeTest):
         traffic_manager.set_hybrid_physics_mode(True)
 
         #run simulation 2
-        vehicle_actor_list = self.spawn_vehicles(world, blueprint_transform_list)
-        record_run2 = self.run_simulation(world, vehicle_actor_list)
+        vehicle_actor_ids = self.spawn_vehicles(world, blueprint_transform_list)
+        record_run2 = self.run_simulation(world, vehicle_actor_ids)
         traffic_manager.shut_down()
 
         self.client.reload_world()
@@ -0,0 +1,141 @@
+# Copyright (c) 2019 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+import fnmatch
+import itertools
+import os
+import sys
+
+import carla
+
+import numpy as np
+
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..')
+sys.path.append(os.path.join(ROOT, 'PythonAPI', 'carla'))
+
+from agents.navigation.basic_agent import BasicAgent
+
+XODR_PATH = os.path.join(
+    ROOT, 'Unreal', 'CarlaUE4', 'Plugins', 'CarlaTools', 'Content', 'MapGenerator', 'Misc', 'OpenDrive',
+    'TemplateOpenDrive.xodr')
+
+# The agents share their helpers by world id, so every test uses a new one
+WORLD_IDS = itertools.count(1000)
+
+
+class FakeActor(object):
+    def __init__(self, world, actor_id, transform, extent):
+        self.id = actor_id
+        self.type_id = 'vehicle.test'
+        self.bounding_box = carla.BoundingBox(carla.Location(), extent)
+        self._world = world
+        self._transform = transform
+
+    def get_world(self):
+        return self._world
+
+    def get_transform(self):
+        location = self._transform.location
+        return carla.Transform(carla.Location(location.x, location.y, location.z), self._transform.rotation)
+
+    def get_location(self):
+        return self.get_transform().location
+
+    def get_velocity(self):
+        return carla.Vector3D()
+
+    def get_control(self):
+        return carla.VehicleControl()
+
+
+class FakeActorSnapshot(object):
+    def __init__(self, actor):
+        self._actor = actor
+
+    def get_transform(self):
+        return self._actor.get_transform()
+
+
+class FakeActorList(list):
+    def filter(self, wildcard_pattern):
+        return FakeActorList(actor for actor in self if fnmatch.fnmatchcase(actor.type_id, wildcard_pattern))
+
+    def get_ids(self):
+        return np.array([actor.id for actor in self], dtype=np.uint32)
+
+
+class FakeSnapshot(object):
+    def __init__(self, world):
+        self.frame = 1
+        self.id = 1
+        self._actors = world.actors
+
+    def find(self, actor_id):
+        actor = self._actors.get(actor_id)
+        return None if actor is None else FakeActorSnapshot(actor)
+
+    def to_numpy(self):
+        return np.array([(actor_id,) for actor_id in sorted(self._actors)], dtype=[('id', np.uint32)])
+
+
+class FakeWorld(object):
+    def __init__(self, wmap):
+        self.id = next(WORLD_IDS)
+        self.actors = dict()
+        self._map = wmap
+
+    def get_map(self):
+        return self._map
+
+    def get_snapshot(self):
+        return FakeSnapshot(self)
+
+    def get_actors(self, actor_ids=None):
+        return FakeActorList(self.actors[actor_id] for actor_id in actor_ids if actor_id in self.actors)
+
+    def spawn(self, transform, extent):
+        actor = self.actors[len(self.actors) + 1] = FakeActor(self, len(self.actors) + 1, transform, extent)
+        return actor
+
+
+class TestVehicleObstacleDetected(unittest.TestCase):
+    EXTENT = carla.Vector3D(2.5, 1.0, 0.8)
+    MAX_DISTANCE = 10.0
+
+    def setUp(self):
+        with open(XODR_PATH) as xodr_file:
+            self.map = carla.Map('TemplateOpenDrive', xodr_file.read())
+        self.ego_waypoint = self.map.get_waypoint_xodr(1, -1, 2.0)
+
+    def detect(self, distance, snapshot_perception):
+        """Places a vehicle ahead of the ego, at a distance between their centers, and runs the detection"""
+        world = FakeWorld(self.map)
+        ego = world.spawn(self.ego_waypoint.transform, self.EXTENT)
+        # Slightly off the center of the lane, or it would be straight ahead, at an angle of 0
+        target_transform = self.ego_waypoint.next(distance)[0].transform
+        right = target_transform.get_right_vector()
+        target_transform = carla.Transform(carla.Location(
+            target_transform.location.x + 0.2 * right.x, target_transform.location.y + 0.2 * right.y,
+            target_transform.location.z), target_transform.rotation)
+        target = world.spawn(target_transform, self.EXTENT)
+
+        agent = BasicAgent(ego, opt_dict={'snapshot_perception': snapshot_perception}, map_inst=self.map)
+        detected, obstacle, _ = agent._vehicle_obstacle_detected(max_distance=self.MAX_DISTANCE)
+        return detected and obstacle.id == target.id
+
+    def test_distance_from_the_front(self):
+        # The distances are measured from the front of the ego, so vehicles whose center is
+        # farther than max_distance from the center of the ego can still be obstacles
+        for snapshot_perception in (False, True):
+            distance = self.MAX_DISTANCE + self.EXTENT.x - 0.5
+            self.assertTrue(self.detect(distance, snapshot_perception), msg=snapshot_perception)
+
+    def test_too_far(self):
+        for snapshot_perception in (False, True):
+            distance = self.MAX_DISTANCE + self.EXTENT.x + 0.5
+            self.assertFalse(self.detect(distance, snapshot_perception), msg=snapshot_perception)
@@ -0,0 +1,151 @@
+# Copyright (c) 2019 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+import os
+import random
+import sys
+
+import carla
+
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..')
+sys.path.append(os.path.join(ROOT, 'PythonAPI', 'carla'))
+
+from agents.navigation.controller import FleetPIDController, VehiclePIDController
+
+ARGS_LATERAL = {'K_P': 1.95, 'K_I': 0.05, 'K_D': 0.2, 'dt': 0.05}
+ARGS_LONGITUDINAL = {'K_P': 1.0, 'K_I': 0.05, 'K_D': 0.1, 'dt': 0.05}
+
+
+class FakeVehicle(object):
+    def __init__(self, world, actor_id):
+        self.id = actor_id
+        self.transform = carla.Transform()
+        self.velocity = carla.Vector3D()
+        self._world = world
+
+    def get_world(self):
+        return self._world
+
+    def get_control(self):
+        return carla.VehicleControl()
+
+    def get_transform(self):
+        return self.transform
+
+    def get_velocity(self):
+        return self.velocity
+
+
+class FakeSnapshot(object):
+    def __init__(self, vehicles):
+        self._vehicles = {vehicle.id: vehicle for vehicle in vehicles}
+
+    def find(self, actor_id):
+        # The vehicles have the get_transform and get_velocity of a carla.ActorSnapshot
+        return self._vehicles.get(actor_id)
+
+
+class FakeWorld(object):
+    def __init__(self):
+        self.vehicles = []
+
+    def get_snapshot(self):
+        return FakeSnapshot(self.vehicles)
+
+
+class FakeClient(object):
+    def __init__(self, world):
+        self._world = world
+        self.batches = []
+
+    def get_world(self):
+        return self._world
+
+    def apply_batch(self, batch):
+        self.batches.append(batch)
+
+
+class FakeWaypoint(object):
+    def __init__(self, transform):
+        self.transform = transform
+
+
+class TestFleetPIDController(unittest.TestCase):
+    def setUp(self):
+        self.world = FakeWorld()
+        self.client = FakeClient(self.world)
+        self.random = random.Random(42)
+
+    def move(self, vehicle):
+        """Moves a vehicle to a new random state close to the previous one"""
+        location = vehicle.transform.location
+        rotation = vehicle.transform.rotation
+        vehicle.transform = carla.Transform(
+            carla.Location(x=location.x + self.random.uniform(0.0, 1.5), y=location.y + self.random.uniform(-0.5, 0.5)),
+            carla.Rotation(pitch=self.random.uniform(-3.0, 3.0), yaw=rotation.yaw + self.random.uniform(-10.0, 10.0)))
+        vehicle.velocity = carla.Vector3D(
+            self.random.uniform(0.0, 12.0), self.random.uniform(-2.0, 2.0), self.random.uniform(-0.5, 0.5))
+
+    def target(self, vehicle):
+        """Returns a waypoint a few meters ahead of a vehicle, on a sloped and banked road"""
+        location = vehicle.transform.location
+        return FakeWaypoint(carla.Transform(
+            carla.Location(x=location.x + self.random.uniform(2.0, 6.0), y=location.y + self.random.uniform(-2.0, 2.0)),
+            carla.Rotation(pitch=self.random.uniform(-5.0, 5.0), yaw=self.random.uniform(-30.0, 30.0),
+                           roll=self.random.uniform(-5.0, 5.0))))
+
+    def assertControlAlmostEqual(self, control, expected, msg=None):
+        self.assertAlmostEqual(control.throttle, expected.throttle, places=5, msg=msg)
+        self.assertAlmostEqual(control.steer, expected.steer, places=5, msg=msg)
+        self.assertAlmostEqual(control.brake, expected.brake, places=5, msg=msg)
+
+    def test_same_controls(self):
+        offsets = [0, 0.75, -1.5]
+        vehicles = [FakeVehicle(self.world, actor_id) for actor_id in range(1, len(offsets) + 1)]
+        self.world.vehicles = vehicles
+        fleet = FleetPIDController(self.client, ARGS_LATERAL, ARGS_LONGITUDINAL)
+        controllers = []
+        for vehicle, offset in zip(vehicles, offsets):
+            fleet.add_vehicle(vehicle, offset)
+            controllers.append(VehiclePIDController(vehicle, ARGS_LATERAL, ARGS_LONGITUDINAL, offset=offset))
+        self.assertEqual(fleet.actor_ids, [1, 2, 3])
+
+        # More steps than the size of the error buffers, so they wrap around
+        for step in range(25):
+            for vehicle in vehicles:
+                self.move(vehicle)
+            target_speeds = [self.random.uniform(0.0, 50.0) for _ in vehicles]
+            waypoints = [self.target(vehicle) for vehicle in vehicles]
+
+            controls = fleet.run_step(target_speeds, waypoints, snapshot=self.world.get_snapshot())
+            for i, controller in enumerate(controllers):
+                expected = controller.run_step(target_speeds[i], waypoints[i])
+                self.assertControlAlmostEqual(controls[i], expected, msg='step {}, vehicle {}'.format(step, i))
+
+        self.assertEqual(len(self.client.batches), 25)
+        self.assertEqual([command.actor_id for command in self.client.batches[-1]], [1, 2, 3])
+
+    def test_missing_vehicle(self):
+        vehicles = [FakeVehicle(self.world, actor_id) for actor_id in (1, 2)]
+        fleet = FleetPIDController(self.client, ARGS_LATERAL, ARGS_LONGITUDINAL)
+        for vehicle in vehicles:
+            fleet.add_vehicle(vehicle)
+        controller = VehiclePIDController(vehicles[0], ARGS_LATERAL, ARGS_LONGITUDINAL)
+
+        # The second vehicle is not in the snapshot, and it doesn't change the control of the first one
+        for _ in range(5):
+            self.move(vehicles[0])
+            waypoints = [self.target(vehicles[0]), self.target(vehicles[1])]
+            controls = fleet.run_step(30.0, waypoints, snapshot=FakeSnapshot(vehicles[:1]), apply=False)
+            self.assertIsNone(controls[1])
+            self.assertControlAlmostEqual(controls[0], controller.run_step(30.0, waypoints[0]))
+        self.assertEqual(self.client.batches, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
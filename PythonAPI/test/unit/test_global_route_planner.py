@@ -0,0 +1,101 @@
+# Copyright (c) 2019 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+import os
+import pickle
+import random
+import shutil
+import sys
+import tempfile
+
+import carla
+
+import networkx as nx
+
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..')
+sys.path.append(os.path.join(ROOT, 'PythonAPI', 'carla'))
+
+from agents.navigation.global_route_planner import _GRAPH_CACHE_VERSION, GlobalRoutePlanner
+
+XODR_PATH = os.path.join(
+    ROOT, 'Unreal', 'CarlaUE4', 'Plugins', 'CarlaTools', 'Content', 'MapGenerator', 'Misc', 'OpenDrive',
+    'TemplateOpenDrive.xodr')
+
+
+def route_keys(route):
+    return [(wp.road_id, wp.lane_id, round(wp.s, 3), road_option) for wp, road_option in route]
+
+
+class TestTraceRoutes(unittest.TestCase):
+    def setUp(self):
+        with open(XODR_PATH) as xodr_file:
+            self.map = carla.Map('TemplateOpenDrive', xodr_file.read())
+        self.planner = GlobalRoutePlanner(self.map, 2.0)
+
+    def pairs(self, num_origins, num_destinations):
+        random.seed(0)
+        locations = [wp.transform.location for wp in self.map.generate_waypoints(5.0)]
+        pairs = []
+        for origin in random.sample(locations, num_origins):
+            for destination in random.sample(locations, num_destinations):
+                try:
+                    self.planner.trace_route(origin, destination)
+                except nx.NetworkXNoPath:
+                    continue
+                pairs.append((origin, destination))
+        return pairs
+
+    def test_same_routes_as_trace_route(self):
+        pairs = self.pairs(6, 6)
+        self.assertGreater(len(pairs), 0)
+        routes = self.planner.trace_routes(pairs)
+        self.assertEqual(len(routes), len(pairs))
+        for i, (origin, destination) in enumerate(pairs):
+            self.assertEqual(route_keys(routes[i]), route_keys(self.planner.trace_route(origin, destination)))
+
+    def test_same_routes_with_processes(self):
+        pairs = self.pairs(4, 4)
+        routes = self.planner.trace_routes(pairs)
+        self.assertEqual([route_keys(route) for route in self.planner.trace_routes(pairs, processes=2)],
+                         [route_keys(route) for route in routes])
+
+
+class TestGraphCache(unittest.TestCase):
+    def setUp(self):
+        with open(XODR_PATH) as xodr_file:
+            self.map = carla.Map('TemplateOpenDrive', xodr_file.read())
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.planner = GlobalRoutePlanner(self.map, 2.0, cache_dir=self.cache_dir)
+        self.cache_path = self.planner._graph_cache_path(self.cache_dir)
+        locations = [wp.transform.location for wp in self.map.generate_waypoints(20.0)]
+        self.origin, self.destination = locations[0], locations[-1]
+
+    def assertSameGraph(self, planner):
+        self.assertEqual(sorted(planner._graph.edges()), sorted(self.planner._graph.edges()))
+        self.assertEqual(route_keys(planner.trace_route(self.origin, self.destination)),
+                         route_keys(self.planner.trace_route(self.origin, self.destination)))
+
+    def test_load(self):
+        self.assertTrue(os.path.isfile(self.cache_path))
+        planner = GlobalRoutePlanner(self.map, 2.0, cache_dir=self.cache_dir)
+        self.assertSameGraph(planner)
+
+    def test_damaged_cache(self):
+        with open(self.cache_path, 'rb') as cache_file:
+            graph_cache = pickle.load(cache_file)
+        missing_field = {key: value for key, value in graph_cache.items() if key != 'point_s'}
+        bad_nodes = dict(graph_cache, nodes=[1, 2, 3])
+        for contents in (b'not a pickle', pickle.dumps([_GRAPH_CACHE_VERSION]), pickle.dumps(missing_field),
+                         pickle.dumps(bad_nodes)):
+            with open(self.cache_path, 'wb') as cache_file:
+                cache_file.write(contents)
+            # The graph is built again, and the cache replaced by a valid one
+            self.assertSameGraph(GlobalRoutePlanner(self.map, 2.0, cache_dir=self.cache_dir))
+            with open(self.cache_path, 'rb') as cache_file:
+                self.assertEqual(sorted(pickle.load(cache_file)), sorted(graph_cache))
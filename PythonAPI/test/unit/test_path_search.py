@@ -0,0 +1,67 @@
+# Copyright (c) 2019 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+import math
+import os
+import random
+import sys
+
+import networkx as nx
+
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'carla'))
+
+from agents.navigation.path_search import PATH_SEARCH_BACKENDS
+
+
+def random_graph(seed, num_nodes=60, num_edges=180):
+    """
+    Random directed graph with the attributes of the planner graph. The edge lengths are never
+    shorter than the distance between their nodes, so the A* heuristic is admissible.
+    """
+    rng = random.Random(seed)
+    graph = nx.DiGraph()
+    for node in range(num_nodes):
+        graph.add_node(node, vertex=(rng.uniform(0, 100), rng.uniform(0, 100), rng.uniform(0, 5)))
+    while graph.number_of_edges() < num_edges:
+        n1, n2 = rng.sample(range(num_nodes), 2)
+        distance = math.sqrt(sum((a - b) ** 2 for a, b in zip(graph.nodes[n1]['vertex'], graph.nodes[n2]['vertex'])))
+        graph.add_edge(n1, n2, length=distance * rng.uniform(1.0, 2.0))
+    return graph
+
+
+def path_length(graph, path):
+    return sum(graph[n1][n2]['length'] for n1, n2 in zip(path[:-1], path[1:]))
+
+
+class TestPathSearch(unittest.TestCase):
+    def test_shortest_path_length(self):
+        for seed in range(5):
+            graph = random_graph(seed)
+            rng = random.Random(seed)
+            pairs = [tuple(rng.sample(list(graph.nodes), 2)) for _ in range(40)]
+            for name, engine in sorted(PATH_SEARCH_BACKENDS.items()):
+                path_search = engine(graph)
+                for source, target in pairs:
+                    try:
+                        expected = nx.dijkstra_path_length(graph, source, target, weight='length')
+                    except nx.NetworkXNoPath:
+                        with self.assertRaises(nx.NetworkXNoPath):
+                            path_search.search(source, target)
+                        continue
+                    path = path_search.search(source, target)
+                    self.assertEqual(path[0], source)
+                    self.assertEqual(path[-1], target)
+                    for n1, n2 in zip(path[:-1], path[1:]):
+                        self.assertTrue(graph.has_edge(n1, n2))
+                    self.assertAlmostEqual(path_length(graph, path), expected, places=6,
+                                           msg='{} from {} to {}'.format(name, source, target))
+
+    def test_same_node(self):
+        graph = random_graph(0)
+        for name, engine in sorted(PATH_SEARCH_BACKENDS.items()):
+            self.assertEqual(engine(graph).search(3, 3), [3], msg=name)
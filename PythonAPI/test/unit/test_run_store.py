@@ -0,0 +1,207 @@
+# Copyright (c) 2019 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'util'))
+
+from run_store import RunFormatError, RunReader, RunWriter, _descr_to_dtype, compare_arrays, compare_runs, content_hash
+
+SEMANTIC_LIDAR_DTYPE = np.dtype([
+    ('x', np.float32), ('y', np.float32), ('z', np.float32), ('cos_inc_angle', np.float32),
+    ('object_idx', np.uint32), ('object_tag', np.uint32)])
+
+SNAPSHOT_DTYPE = np.dtype([('id', np.uint32), ('location', np.float32, (3,)), ('alive', np.bool_)])
+
+
+def lidar_frame(frame):
+    return np.random.RandomState(frame).rand(100, 4).astype(np.float32)
+
+
+def semantic_lidar_frame(frame):
+    points = np.zeros(20, dtype=SEMANTIC_LIDAR_DTYPE)
+    points['x'] = frame
+    points['object_idx'] = np.arange(20)
+    return points
+
+
+class RunStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, streams):
+        """Writes a run with streams, a dict of {stream: {frame: array}}, and returns its reader"""
+        path = os.path.join(self.directory, name)
+        with RunWriter(path) as writer:
+            for stream, frames in streams.items():
+                for frame, array in frames.items():
+                    writer.append(stream, frame, array)
+        reader = RunReader(path)
+        self.addCleanup(reader.close)
+        return reader
+
+
+class TestRoundTrip(RunStoreTestCase):
+    def test_plain_arrays(self):
+        frames = {frame: lidar_frame(frame) for frame in range(1, 6)}
+        run = self.write('plain.run', {'lidar': frames, 'actor': {0: np.arange(11.0)}})
+        self.assertEqual(run.streams, ['lidar', 'actor'])
+        self.assertEqual(run.frames('lidar'), [1, 2, 3, 4, 5])
+        for frame, array in frames.items():
+            stored = run.get('lidar', frame)
+            self.assertEqual(stored.dtype, array.dtype)
+            self.assertTrue(np.array_equal(stored, array))
+            self.assertEqual(run.hash('lidar', frame), content_hash(array))
+        self.assertTrue(np.array_equal(run.get('actor', 0), np.arange(11.0)))
+
+    def test_structured_arrays(self):
+        snapshot = np.zeros(3, dtype=SNAPSHOT_DTYPE)
+        snapshot['id'] = [24, 25, 26]
+        snapshot['location'] = np.arange(9).reshape(3, 3)
+        snapshot['alive'] = [True, False, True]
+        run = self.write('structured.run', {
+            'semantic_lidar': {frame: semantic_lidar_frame(frame) for frame in range(3)},
+            'snapshot': {7: snapshot}})
+        self.assertEqual(run.get('semantic_lidar', 2).dtype, SEMANTIC_LIDAR_DTYPE)
+        self.assertTrue(np.array_equal(run.get('semantic_lidar', 2), semantic_lidar_frame(2)))
+        self.assertEqual(run.get('snapshot', 7).dtype, SNAPSHOT_DTYPE)
+        self.assertTrue(np.array_equal(run.get('snapshot', 7), snapshot))
+        self.assertEqual(run.stack('semantic_lidar').shape, (3, 20))
+
+    def test_empty_arrays(self):
+        run = self.write('empty.run', {
+            'lidar': {1: np.zeros((0, 4), dtype=np.float32)},
+            'semantic_lidar': {1: np.zeros(0, dtype=SEMANTIC_LIDAR_DTYPE)}})
+        self.assertEqual(run.get('lidar', 1).shape, (0, 4))
+        self.assertEqual(run.get('lidar', 1).dtype, np.float32)
+        self.assertEqual(run.get('semantic_lidar', 1).dtype, SEMANTIC_LIDAR_DTYPE)
+        self.assertEqual(run.get('semantic_lidar', 1).shape, (0,))
+
+    def test_aligned_arrays(self):
+        run = self.write('aligned.run', {'odd': {frame: np.arange(frame, dtype=np.uint8) for frame in range(1, 5)}})
+        for frame in run.frames('odd'):
+            self.assertEqual(run.entry('odd', frame).offset % 64, 0)
+
+    def test_descr_to_dtype(self):
+        for dtype in (np.dtype(np.float32), np.dtype('>i8'), SEMANTIC_LIDAR_DTYPE, SNAPSHOT_DTYPE,
+                      np.dtype([('inner', SNAPSHOT_DTYPE), ('matrix', np.float64, (2, 3))])):
+            # The index stores the descriptions as JSON, which turns their tuples into lists
+            descr = np.lib.format.dtype_to_descr(dtype)
+            if isinstance(descr, list):
+                descr = [list(field) for field in descr]
+            self.assertEqual(_descr_to_dtype(descr), dtype)
+
+
+class TestContentHash(unittest.TestCase):
+    def test_hash(self):
+        array = lidar_frame(1)
+        self.assertEqual(content_hash(array), content_hash(array.copy()))
+        self.assertEqual(content_hash(array), content_hash(np.asfortranarray(array)))
+        changed = array.copy()
+        changed[0, 0] += 1.0
+        self.assertNotEqual(content_hash(array), content_hash(changed))
+        # Same bytes, but different dtype or shape
+        self.assertNotEqual(content_hash(array), content_hash(array.view(np.uint32)))
+        self.assertNotEqual(content_hash(array), content_hash(array.reshape(-1)))
+        self.assertNotEqual(content_hash(np.zeros(0, np.float32)), content_hash(np.zeros(0, np.float64)))
+
+
+class TestCompareRuns(RunStoreTestCase):
+    def runs(self, perturbation=0.0, missing_frame=None):
+        lidar = {frame: lidar_frame(frame) for frame in range(1, 6)}
+        semantic_lidar = {frame: semantic_lidar_frame(frame) for frame in range(1, 6)}
+        run_a = self.write('a.run', {'lidar': lidar, 'semantic_lidar': semantic_lidar})
+        lidar = {frame: array.copy() for frame, array in lidar.items() if frame != missing_frame}
+        lidar[3][0, 0] += perturbation
+        run_b = self.write('b.run', {'lidar': lidar, 'semantic_lidar': semantic_lidar})
+        return run_a, run_b
+
+    def test_identical(self):
+        result = compare_runs(*self.runs())
+        self.assertTrue(result.equivalent)
+        self.assertEqual(result.identical, 10)
+        self.assertEqual(result.similar, 0)
+        self.assertEqual(result.mismatches, [])
+
+    def test_within_tolerance(self):
+        result = compare_runs(*self.runs(perturbation=0.001), tolerance=0.01)
+        self.assertTrue(result.equivalent)
+        self.assertEqual(result.identical, 9)
+        self.assertEqual(result.similar, 1)
+        self.assertAlmostEqual(result.max_error, 0.001, places=5)
+
+    def test_over_tolerance(self):
+        result = compare_runs(*self.runs(perturbation=1.0), tolerance=0.01)
+        self.assertFalse(result.equivalent)
+        self.assertEqual(result.mismatches, [('lidar', 3)])
+        self.assertAlmostEqual(result.max_error, 1.0, places=5)
+
+    def test_nan(self):
+        nan = float('nan')
+        self.assertEqual(compare_arrays(np.array([1.0, 2.0]), np.array([1.0, nan]), 0.01), float('inf'))
+        self.assertEqual(compare_arrays(np.array([1.0, nan]), np.array([1.0, 2.0]), 0.01), float('inf'))
+        self.assertEqual(compare_arrays(np.array([1.0, nan]), np.array([1.0, nan]), 0.01), 0.0)
+        self.assertEqual(compare_arrays(np.array([np.inf]), np.array([np.inf]), 0.01), 0.0)
+        points = semantic_lidar_frame(1)
+        diverged = points.copy()
+        diverged['z'][3] = nan
+        self.assertEqual(compare_arrays(points, diverged, 0.01), float('inf'))
+
+        run_a, _ = self.runs()
+        lidar = {frame: lidar_frame(frame) for frame in range(1, 6)}
+        lidar[2][1, 1] = nan
+        run_b = self.write('nan.run', {'lidar': lidar, 'semantic_lidar': {
+            frame: semantic_lidar_frame(frame) for frame in range(1, 6)}})
+        result = compare_runs(run_a, run_b, tolerance=0.01)
+        self.assertFalse(result.equivalent)
+        self.assertEqual(result.similar, 0)
+        self.assertEqual(result.mismatches, [('lidar', 2)])
+
+    def test_missing_frame(self):
+        run_a, run_b = self.runs(missing_frame=4)
+        for result in (compare_runs(run_a, run_b), compare_runs(run_b, run_a)):
+            self.assertFalse(result.equivalent)
+            self.assertEqual(result.identical, 9)
+            self.assertEqual(result.mismatches, [('lidar', 4)])
+
+    def test_missing_stream(self):
+        run_a, _ = self.runs()
+        run_b = self.write('c.run', {'lidar': {frame: lidar_frame(frame) for frame in range(1, 6)}})
+        result = compare_runs(run_a, run_b)
+        self.assertEqual(result.identical, 5)
+        self.assertEqual(result.mismatches, [('semantic_lidar', frame) for frame in range(1, 6)])
+        result = compare_runs(run_a, run_b, stop_on_mismatch=True)
+        self.assertEqual(result.mismatches, [('semantic_lidar', 1)])
+
+
+class TestRunFormat(RunStoreTestCase):
+    def test_not_a_run(self):
+        path = os.path.join(self.directory, 'bad.run')
+        with open(path, 'wb') as bad_file:
+            bad_file.write(b'x' * 40)
+        with self.assertRaises(RunFormatError):
+            RunReader(path)
+
+    def test_writer_not_closed(self):
+        path = os.path.join(self.directory, 'open.run')
+        writer = RunWriter(path)
+        writer.append('lidar', 1, lidar_frame(1))
+        writer._file.flush()
+        with self.assertRaises(RunFormatError):
+            RunReader(path)
+        writer.close()
+        with RunReader(path) as run:
+            self.assertEqual(run.frames('lidar'), [1])
@@ -17,7 +17,6 @@ import os
 import sys
 import argparse
 import time
-import filecmp
 import shutil
 
 import numpy as np
@@ -32,6 +31,9 @@ except IndexError:
 
 import carla
 
+from repetition_runner import DeterminismCheck, ServerPool, parse_endpoints, run_repetitions
+from run_store import RunWriter
+
 
 class Scenario():
     def __init__(self, client, world, save_snapshots_mode=False):
@@ -42,13 +44,13 @@ class Scenario():
         self.active = False
         self.prefix = ""
         self.save_snapshots_mode = save_snapshots_mode
-        self.snapshots = []
+        self.run_writer = None
 
     def init_scene(self, prefix, settings = None, spectator_tr = None):
         self.prefix = prefix
         self.actor_list = []
         self.active = True
-        self.snapshots = []
+        self.run_writer = RunWriter(self.get_filename())
 
         self.reload_world(settings, spectator_tr)
 
@@ -63,9 +65,6 @@ class Scenario():
 
         self.actor_list.append((name, actor))
 
-        if self.save_snapshots_mode:
-            self.snapshots.append(np.empty((0,11), float))
-
     def wait(self, frames=100):
         for _i in range(0, frames):
             self.world.tick()
@@ -75,6 +74,7 @@ class Scenario():
             actor[1].destroy()
 
         self.active = False
+        self.close_run()
 
     def reload_world(self, settings = None, spectator_tr = None):
         self.client.reload_world()
@@ -87,38 +87,38 @@ class Scenario():
         spectator = self.world.get_spectator()
         spectator.set_transform(spectator_tr)
 
-    def save_snapshot(self, actor):
-        snapshot = self.world.get_snapshot()
+    def save_snapshot(self, snapshot, actors, actor):
+        # The rows of the actors are sorted by id
+        row = actors[np.searchsorted(actors['id'], actor.id)]
 
-        actor_snapshot = np.array([
-                float(snapshot.frame - self.init_timestamp['frame0']), \
-                snapshot.timestamp.elapsed_seconds - self.init_timestamp['time0'], \
-                actor.get_location().x, actor.get_location().y, actor.get_location().z, \
-                actor.get_velocity().x, actor.get_velocity().y, actor.get_velocity().z, \
-                actor.get_angular_velocity().x, actor.get_angular_velocity().y, actor.get_angular_velocity().z])
+        actor_snapshot = np.concatenate((
+                [float(snapshot.frame - self.init_timestamp['frame0']),
+                 snapshot.timestamp.elapsed_seconds - self.init_timestamp['time0']],
+                row['location'], row['velocity'], row['angular_velocity']))
         return actor_snapshot
 
     def save_snapshots(self):
-        if not self.save_snapshots_mode:
+        if not self.save_snapshots_mode or not self.active:
             return
 
-        for i in range (0, len(self.actor_list)):
-            self.snapshots[i] = np.vstack((self.snapshots[i], self.save_snapshot(self.actor_list[i][1])))
-
-    def save_snapshots_to_disk(self):
-        if not self.save_snapshots_mode:
-            return
+        # The state of all the actors is read at once
+        snapshot = self.world.get_snapshot()
+        actors = snapshot.to_numpy()
+        for actor in self.actor_list:
+            actor_snapshot = self.save_snapshot(snapshot, actors, actor[1])
+            self.run_writer.append(actor[0], int(actor_snapshot[0]), actor_snapshot)
 
-        for i, actor in enumerate(self.actor_list):
-            np.savetxt(self.get_filename(actor[0]), self.snapshots[i])
+    def close_run(self):
+        if self.run_writer is not None:
+            self.run_writer.close()
+            self.run_writer = None
 
-    def get_filename_with_prefix(self, prefix, actor_id=None, frame=None):
-        add_id = "" if actor_id is None else "_" + actor_id
-        add_frame = "" if frame is None else ("_%04d") % frame
-        return prefix + add_id + add_frame + ".out"
+    def get_filename_with_prefix(self, prefix, suffix=None):
+        add_suffix = "" if suffix is None else "_" + suffix
+        return prefix + add_suffix + ".run"
 
-    def get_filename(self, actor_id=None, frame=None):
-        return self.get_filename_with_prefix(self.prefix, actor_id, frame)
+    def get_filename(self, suffix=None):
+        return self.get_filename_with_prefix(self.prefix, suffix)
 
     def run_simulation(self, prefix, run_settings, spectator_tr, tics = 200):
         original_settings = self.world.get_settings()
@@ -131,8 +131,10 @@ class Scenario():
             self.save_snapshots()
         t_end = time.perf_counter()
 
+        # Stop recording before going back to asynchronous mode, or the frames
+        # that follow would be stored and compared too
+        self.active = False
         self.world.apply_settings(original_settings)
-        self.save_snapshots_to_disk()
         self.clear_scene()
 
         return t_end - t_start
@@ -313,83 +315,28 @@ class CarWalkerCollision(Scenario):
 
 
 class CollisionScenarioTester():
-    def __init__(self, scene, output_path):
-        self.scene = scene
-        self.world = self.scene.world
-        self.client = self.scene.client
-        self.scenario_name = self.scene.__class__.__name__
+    def __init__(self, scenes, output_path):
+        # One instance of the scenario per server, the repetitions run in all of them at once
+        self.scenes = scenes
+        self.world = self.scenes[0].world
+        self.scenario_name = self.scenes[0].__class__.__name__
         self.output_path = output_path
 
-    def compare_files(self, file_i, file_j):
-        check_ij = filecmp.cmp(file_i, file_j)
-
-        if check_ij:
-            return True
-
-        data_i = np.loadtxt(file_i)
-        data_j = np.loadtxt(file_j)
-
-        max_error = np.amax(np.abs(data_i-data_j))
-
-        return max_error < 0.01
-
-    def check_simulations(self, rep_prefixes, gen_prefix):
-        repetitions = len(rep_prefixes)
-        mat_check = np.zeros((repetitions, repetitions), int)
-
-        for i in range(0, repetitions):
-            mat_check[i][i] = 1
-            for j in range(0, i):
-                sim_check = True
-                for actor in self.scene.actor_list:
-                    actor_id = actor[0]
-                    file_i = self.scene.get_filename_with_prefix(rep_prefixes[i], actor_id)
-                    file_j = self.scene.get_filename_with_prefix(rep_prefixes[j], actor_id)
-
-                    check_ij = self.compare_files(file_i, file_j)
-                    sim_check = sim_check and check_ij
-                mat_check[i][j] = int(sim_check)
-                mat_check[j][i] = int(sim_check)
+    def save_simulations(self, check, prefix):
+        scene = self.scenes[0]
+        groups = check.groups
 
-        determinism = np.sum(mat_check,axis=1)
-        #max_rep_equal = np.amax(determinism)
-        max_rep_equal_idx = np.argmax(determinism)
-        min_rep_equal_idx = np.argmin(determinism)
+        # The first run of the biggest set of equivalent runs is the reference,
+        # and the first one of the smallest set the failed one
+        file_reference = scene.get_filename_with_prefix(prefix, "reference")
+        shutil.copyfile(groups[0][0], file_reference)
 
-        determinism_set = list(set(determinism))
-        determinism_set.sort(reverse=True)
-
-        #print(determinism)
-        #print(np.argmax(determinism))
-        #print(np.argmin(determinism))
-
-        self.save_simulations(rep_prefixes, gen_prefix, max_rep_equal_idx, min_rep_equal_idx)
-
-        return determinism_set
-
-    def save_simulations(self, rep_prefixes, prefix, max_idx, min_idx):
-        for actor in self.scene.actor_list:
-            actor_id = actor[0]
-            reference_id = "reference_" + actor_id
-            file_repetition = self.scene.get_filename_with_prefix(rep_prefixes[max_idx], actor_id)
-            file_reference  = self.scene.get_filename_with_prefix(prefix, reference_id)
-
-            shutil.copyfile(file_repetition, file_reference)
-
-        if min_idx != max_idx:
-            for actor in self.scene.actor_list:
-                actor_id = actor[0]
-                failed_id = "failed_" + actor_id
-                file_repetition = self.scene.get_filename_with_prefix(rep_prefixes[min_idx], actor_id)
-                file_failed     = self.scene.get_filename_with_prefix(prefix, failed_id)
-
-                shutil.copyfile(file_repetition, file_failed)
-
-        for r_prefix in rep_prefixes:
-            for actor in self.scene.actor_list:
-                actor_id = actor[0]
-                file_repetition = self.scene.get_filename_with_prefix(r_prefix, actor_id)
+        if len(groups) > 1:
+            file_failed = scene.get_filename_with_prefix(prefix, "failed")
+            shutil.copyfile(groups[-1][0], file_failed)
 
+        for paths in groups:
+            for file_repetition in paths:
                 os.remove(file_repetition)
 
     def test_scenario(self, fps=20, fps_phys=100, repetitions = 1, sim_tics = 100):
@@ -407,14 +354,23 @@ class CollisionScenarioTester():
 
         spectator_tr = carla.Transform(carla.Location(120, -256, 10), carla.Rotation(yaw=180))
 
-        t_comp = 0
-        sim_prefixes = []
-        for i in range(0, repetitions):
+        def run_repetition(scene, i):
             prefix_rep = prefix + "_rep" + str(i)
-            t_comp += self.scene.run_simulation(prefix_rep, config_settings, spectator_tr, tics=sim_tics)
-            sim_prefixes.append(prefix_rep)
+            t_comp = scene.run_simulation(prefix_rep, config_settings, spectator_tr, tics=sim_tics)
+            return scene.get_filename_with_prefix(prefix_rep), t_comp
+
+        # Each repetition is compared with the previous ones as soon as it finishes
+        check = DeterminismCheck(tolerance=0.01)
+        try:
+            results = run_repetitions(self.scenes, repetitions, run_repetition,
+                                      lambda i, result: check.add(result[0]))
+        finally:
+            check.close()
+        t_comp = sum(result[1] for result in results)
 
-        determ_repet = self.check_simulations(sim_prefixes, prefix)
+        self.save_simulations(check, prefix)
+
+        determ_repet = check.determinism_set()
         output_str += "Deterministic Repetitions: %r / %2d" % (determ_repet, repetitions)
         output_str += "  -> Comp. Time per frame: %.0f" % (t_comp/repetitions*sim_tics)
 
@@ -427,18 +383,15 @@ class CollisionScenarioTester():
 
 def main(arg):
     """Main function of the script"""
-    client = carla.Client(arg.host, arg.port)
-    client.set_timeout(30.0)
-    world = client.get_world()
-    pre_settings = world.get_settings()
-    world = client.load_world("Town03")
+    endpoints = parse_endpoints(arg.servers, arg.host, arg.port) if arg.servers else [(arg.host, arg.port)]
 
-    spectator_transform = carla.Transform(carla.Location(120, -256, 5), carla.Rotation(yaw=180))
-    spectator_transform.location.z += 5
-    spectator = world.get_spectator()
-    spectator.set_transform(spectator_transform)
+    with ServerPool(endpoints, town="Town03") as pool:
+        for _client, world in pool.servers:
+            spectator_transform = carla.Transform(carla.Location(120, -256, 5), carla.Rotation(yaw=180))
+            spectator_transform.location.z += 5
+            spectator = world.get_spectator()
+            spectator.set_transform(spectator_transform)
 
-    try:
         # Setting output temporal folder
         output_path = os.path.dirname(os.path.realpath(__file__))
         output_path = os.path.join(output_path, "_collisions") + os.path.sep
@@ -447,13 +400,13 @@ def main(arg):
 
 
         test_list = [
-            CollisionScenarioTester(TwoSpawnedCars(client, world, True), output_path),
-            CollisionScenarioTester(TwoCarsSlowSpeedCollision(client, world, True), output_path),
-            CollisionScenarioTester(TwoCarsHighSpeedCollision(client, world, True), output_path),
-            CollisionScenarioTester(CarBikeCollision(client, world, True), output_path),
-            CollisionScenarioTester(CarWalkerCollision(client, world, True), output_path),
-            CollisionScenarioTester(ThreeCarsSlowSpeedCollision(client, world, True), output_path),
-            CollisionScenarioTester(ThreeCarsHighSpeedCollision(client, world, True), output_path),
+            CollisionScenarioTester([TwoSpawnedCars(client, world, True) for client, world in pool.servers], output_path),
+            CollisionScenarioTester([TwoCarsSlowSpeedCollision(client, world, True) for client, world in pool.servers], output_path),
+            CollisionScenarioTester([TwoCarsHighSpeedCollision(client, world, True) for client, world in pool.servers], output_path),
+            CollisionScenarioTester([CarBikeCollision(client, world, True) for client, world in pool.servers], output_path),
+            CollisionScenarioTester([CarWalkerCollision(client, world, True) for client, world in pool.servers], output_path),
+            CollisionScenarioTester([ThreeCarsSlowSpeedCollision(client, world, True) for client, world in pool.servers], output_path),
+            CollisionScenarioTester([ThreeCarsHighSpeedCollision(client, world, True) for client, world in pool.servers], output_path),
         ]
 
         repetitions = 10
@@ -472,10 +425,6 @@ def main(arg):
         #shutil.rmtree(path)
 
 
-    finally:
-        world.apply_settings(pre_settings)
-
-
 
 if __name__ == "__main__":
 
@@ -492,6 +441,11 @@ if __name__ == "__main__":
         default=2000,
         type=int,
         help='TCP port of CARLA Simulator (default: 2000)')
+    argparser.add_argument(
+        '--servers',
+        metavar='H:P,H:P',
+        default='',
+        help='comma separated host:port of several CARLA Simulators to run the repetitions in parallel (default: --host and --port)')
     argparser.add_argument(
         '--filter',
         metavar='PATTERN',
@@ -17,7 +17,6 @@ import os
 import sys
 import argparse
 import time
-import filecmp
 import shutil
 from queue import Queue
 from queue import Empty
@@ -34,6 +33,9 @@ except IndexError:
 
 import carla
 
+from repetition_runner import DeterminismCheck, ServerPool, parse_endpoints, run_repetitions
+from run_store import RunWriter
+
 
 class Scenario():
     def __init__(self, client, world, save_snapshots_mode=False):
@@ -44,7 +46,7 @@ class Scenario():
         self.active = False
         self.prefix = ""
         self.save_snapshots_mode = save_snapshots_mode
-        self.snapshots = []
+        self.run_writer = None
         self.sensor_list = []
         self.sensor_queue = Queue()
 
@@ -52,7 +54,7 @@ class Scenario():
         self.prefix = prefix
         self.actor_list = []
         self.active = True
-        self.snapshots = []
+        self.run_writer = RunWriter(self.get_filename())
         self.sensor_list = []
         self.sensor_queue = Queue()
 
@@ -69,9 +71,6 @@ class Scenario():
 
         self.actor_list.append((name, actor))
 
-        if self.save_snapshots_mode:
-            self.snapshots.append(np.empty((0,11), float))
-
     def wait(self, frames=100):
         for _i in range(0, frames):
             self.world.tick()
@@ -80,13 +79,16 @@ class Scenario():
                     self.sensor_queue.get(True, 1.0)
 
     def clear_scene(self):
+        # Stop storing sensor data before closing the run
+        self.active = False
+
         for sensor in self.sensor_list:
             sensor[1].destroy()
 
         for actor in self.actor_list:
             actor[1].destroy()
 
-        self.active = False
+        self.close_run()
 
     def reload_world(self, settings = None, spectator_tr = None):
         self.client.reload_world()
@@ -99,38 +101,38 @@ class Scenario():
         spectator = self.world.get_spectator()
         spectator.set_transform(spectator_tr)
 
-    def save_snapshot(self, actor):
-        snapshot = self.world.get_snapshot()
+    def save_snapshot(self, snapshot, actors, actor):
+        # The rows of the actors are sorted by id
+        row = actors[np.searchsorted(actors['id'], actor.id)]
 
-        actor_snapshot = np.array([
-                float(snapshot.frame - self.init_timestamp['frame0']), \
-                snapshot.timestamp.elapsed_seconds - self.init_timestamp['time0'], \
-                actor.get_location().x, actor.get_location().y, actor.get_location().z, \
-                actor.get_velocity().x, actor.get_velocity().y, actor.get_velocity().z, \
-                actor.get_angular_velocity().x, actor.get_angular_velocity().y, actor.get_angular_velocity().z])
+        actor_snapshot = np.concatenate((
+                [float(snapshot.frame - self.init_timestamp['frame0']),
+                 snapshot.timestamp.elapsed_seconds - self.init_timestamp['time0']],
+                row['location'], row['velocity'], row['angular_velocity']))
         return actor_snapshot
 
     def save_snapshots(self):
         if not self.save_snapshots_mode:
             return
 
-        for i in range (0, len(self.actor_list)):
-            self.snapshots[i] = np.vstack((self.snapshots[i], self.save_snapshot(self.actor_list[i][1])))
-
-    def save_snapshots_to_disk(self):
-        if not self.save_snapshots_mode:
-            return
+        # The state of all the actors is read at once
+        snapshot = self.world.get_snapshot()
+        actors = snapshot.to_numpy()
+        for actor in self.actor_list:
+            actor_snapshot = self.save_snapshot(snapshot, actors, actor[1])
+            self.run_writer.append(actor[0], int(actor_snapshot[0]), actor_snapshot)
 
-        for i, actor in enumerate(self.actor_list):
-            np.savetxt(self.get_filename(actor[0]), self.snapshots[i])
+    def close_run(self):
+        if self.run_writer is not None:
+            self.run_writer.close()
+            self.run_writer = None
 
-    def get_filename_with_prefix(self, prefix, actor_id=None, frame=None):
-        add_id = "" if actor_id is None else "_" + actor_id
-        add_frame = "" if frame is None else ("_%04d") % frame
-        return prefix + add_id + add_frame + ".out"
+    def get_filename_with_prefix(self, prefix, suffix=None):
+        add_suffix = "" if suffix is None else "_" + suffix
+        return prefix + add_suffix + ".run"
 
-    def get_filename(self, actor_id=None, frame=None):
-        return self.get_filename_with_prefix(self.prefix, actor_id, frame)
+    def get_filename(self, suffix=None):
+        return self.get_filename_with_prefix(self.prefix, suffix)
 
     def run_simulation(self, prefix, run_settings, spectator_tr, tics = 200):
         original_settings = self.world.get_settings()
@@ -144,8 +146,10 @@ class Scenario():
             self.save_snapshots()
         t_end = time.perf_counter()
 
+        # Stop recording before going back to asynchronous mode, or the frames
+        # that follow would be stored and compared too
+        self.active = False
         self.world.apply_settings(original_settings)
-        self.save_snapshots_to_disk()
         self.clear_scene()
 
         return t_end - t_start
@@ -168,35 +172,27 @@ class Scenario():
         if not self.active:
             return
 
-        points = np.frombuffer(lidar_data.raw_data, dtype=np.dtype('f4'))
-        points = np.reshape(points, (int(points.shape[0] / 4), 4))
-
         frame = lidar_data.frame - self.init_timestamp['frame0']
-        np.savetxt(self.get_filename(name, frame), points)
+        self.run_writer.append(name, frame, lidar_data.to_numpy())
         self.sensor_queue.put((lidar_data.frame, name))
 
     def add_semlidar_snapshot(self, lidar_data, name="SemLiDAR"):
         if not self.active:
             return
 
-        data = np.frombuffer(lidar_data.raw_data, dtype=np.dtype([
-            ('x', np.float32), ('y', np.float32), ('z', np.float32),
-            ('CosAngle', np.float32), ('ObjIdx', np.uint32), ('ObjTag', np.uint32)]))
-        points = np.array([data['x'], data['y'], data['z'], data['CosAngle'], data['ObjTag']]).T
+        data = lidar_data.to_numpy()
+        points = np.column_stack((data['x'], data['y'], data['z'], data['cos_inc_angle'], data['object_tag']))
 
         frame = lidar_data.frame - self.init_timestamp['frame0']
-        np.savetxt(self.get_filename(name, frame), points)
+        self.run_writer.append(name, frame, points)
         self.sensor_queue.put((lidar_data.frame, name))
 
     def add_radar_snapshot(self, radar_data, name="Radar"):
         if not self.active:
             return
 
-        points = np.frombuffer(radar_data.raw_data, dtype=np.dtype('f4'))
-        points = np.reshape(points, (int(points.shape[0] / 4), 4))
-
         frame = radar_data.frame - self.init_timestamp['frame0']
-        np.savetxt(self.get_filename(name, frame), points)
+        self.run_writer.append(name, frame, radar_data.to_numpy())
         self.sensor_queue.put((radar_data.frame, name))
 
     def sensor_syncronization(self):
@@ -340,61 +336,13 @@ class SpawnAllRaycastSensors(Scenario):
         self.wait(1)
 
 class SensorScenarioTester():
-    def __init__(self, scene, output_path):
-        self.scene = scene
-        self.world = self.scene.world
-        self.client = self.scene.client
-        self.scenario_name = self.scene.__class__.__name__
+    def __init__(self, scenes, output_path):
+        # One instance of the scenario per server, the repetitions run in all of them at once
+        self.scenes = scenes
+        self.world = self.scenes[0].world
+        self.scenario_name = self.scenes[0].__class__.__name__
         self.output_path = output_path
 
-    def compare_files(self, file_i, file_j):
-
-        # First, we check if the files are exactly equal,
-        # if they are the simulations are equivalent
-        check_ij = filecmp.cmp(file_i, file_j)
-        if check_ij:
-            return True
-
-        # If not, if we have different number of points
-        # the simulations are not equivalent
-        data_i = np.loadtxt(file_i)
-        data_j = np.loadtxt(file_j)
-        if data_i.shape != data_j.shape:
-            return False
-
-        # If they have the same number of points but there is
-        # a small diference, the simulations could be equivalent
-        # differing only in floaring-point arithmetic errors
-        max_error = np.amax(np.abs(data_i-data_j))
-
-        return max_error < 0.01
-
-    def check_simulations(self, rep_prefixes, sim_tics):
-        repetitions = len(rep_prefixes)
-        mat_check = np.zeros((repetitions, repetitions), int)
-
-        for i in range(0, repetitions):
-            mat_check[i][i] = 1
-            for j in range(0, i):
-                sim_check = True
-                for f_idx in range(1, sim_tics):
-                    for sensor in self.scene.sensor_list:
-                        file_i = self.scene.get_filename_with_prefix(rep_prefixes[i], sensor[0], f_idx)
-                        file_j = self.scene.get_filename_with_prefix(rep_prefixes[j], sensor[0], f_idx)
-
-                        check_ij = self.compare_files(file_i, file_j)
-                        sim_check = sim_check and check_ij
-
-                mat_check[i][j] = int(sim_check)
-                mat_check[j][i] = int(sim_check)
-
-        determinism = np.sum(mat_check,axis=1)
-
-        determinism_set = list(set(determinism))
-        determinism_set.sort(reverse=True)
-
-        return determinism_set
-
     def test_scenario(self, repetitions = 1, sim_tics = 100):
         output_str = "Testing Determinism in %s -> " % (self.scenario_name)
 
@@ -406,16 +354,26 @@ class SensorScenarioTester():
 
         spectator_tr = carla.Transform(carla.Location(160, -205, 10), carla.Rotation(yaw=180))
 
-        sim_prefixes = []
-        t_comp = 0
-        for i in range(0, repetitions):
+        def run_repetition(scene, i):
             prefix_rep = prefix + "_rep_" + ("%03d" % i)
-            t_comp += self.scene.run_simulation(prefix_rep, config_settings, spectator_tr, tics=sim_tics)
-            sim_prefixes.append(prefix_rep)
+            t_comp = scene.run_simulation(prefix_rep, config_settings, spectator_tr, tics=sim_tics)
+            return scene.get_filename_with_prefix(prefix_rep), t_comp
 
-        determ_repet = self.check_simulations(sim_prefixes, sim_tics)
+        # Each repetition is compared with the previous ones as soon as it finishes
+        check = DeterminismCheck(tolerance=0.01)
+        t_start = time.perf_counter()
+        try:
+            results = run_repetitions(self.scenes, repetitions, run_repetition,
+                                      lambda i, result: check.add(result[0]))
+        finally:
+            check.close()
+        t_wall = time.perf_counter() - t_start
+        t_comp = sum(result[1] for result in results)
+
+        determ_repet = check.determinism_set()
         output_str += "Deterministic Repetitions: %r / %2d" % (determ_repet, repetitions)
         output_str += "  -> Comp. FPS: %.0f" % ((repetitions*sim_tics)/t_comp)
+        output_str += "  -> Wall time: %.1f s" % t_wall
 
         if determ_repet[0] != repetitions:
             print("Error!!! Scenario %s is not deterministic: %d / %d" % (self.scenario_name, determ_repet[0], repetitions))
@@ -425,13 +383,9 @@ class SensorScenarioTester():
 
 def main(arg):
     """Main function of the script"""
-    client = carla.Client(arg.host, arg.port)
-    client.set_timeout(30.0)
-    world = client.get_world()
-    pre_settings = world.get_settings()
-    world = client.load_world("Town03")
+    endpoints = parse_endpoints(arg.servers, arg.host, arg.port) if arg.servers else [(arg.host, arg.port)]
 
-    try:
+    with ServerPool(endpoints, town="Town03") as pool:
         # Setting output temporal folder
         output_path = os.path.dirname(os.path.realpath(__file__))
         output_path = os.path.join(output_path, "_sensors") + os.path.sep
@@ -439,11 +393,11 @@ def main(arg):
             os.mkdir(output_path)
 
         test_list = [
-            SensorScenarioTester(SpawnAllRaycastSensors(client, world), output_path),
-            SensorScenarioTester(SpawnLidarNoDropff(client, world), output_path),
-            SensorScenarioTester(SpawnLidarWithDropff(client, world), output_path),
-            SensorScenarioTester(SpawnSemanticLidar(client, world), output_path),
-            SensorScenarioTester(SpawnRadar(client, world), output_path)
+            SensorScenarioTester([SpawnAllRaycastSensors(client, world) for client, world in pool.servers], output_path),
+            SensorScenarioTester([SpawnLidarNoDropff(client, world) for client, world in pool.servers], output_path),
+            SensorScenarioTester([SpawnLidarWithDropff(client, world) for client, world in pool.servers], output_path),
+            SensorScenarioTester([SpawnSemanticLidar(client, world) for client, world in pool.servers], output_path),
+            SensorScenarioTester([SpawnRadar(client, world) for client, world in pool.servers], output_path)
         ]
 
         repetitions = 10
@@ -457,9 +411,6 @@ def main(arg):
         # Remove all the output files
         #shutil.rmtree(path)
 
-    finally:
-        world.apply_settings(pre_settings)
-
 
 
 if __name__ == "__main__":
@@ -477,6 +428,11 @@ if __name__ == "__main__":
         default=2000,
         type=int,
         help='TCP port of CARLA Simulator (default: 2000)')
+    argparser.add_argument(
+        '--servers',
+        metavar='H:P,H:P',
+        default='',
+        help='comma separated host:port of several CARLA Simulators to run the repetitions in parallel (default: --host and --port)')
     argparser.add_argument(
         '--filter',
         metavar='PATTERN',
@@ -0,0 +1,227 @@
+# Copyright (c) 2020 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Parallel execution of the repetitions of the determinism checks.
+
+The repetitions of a scenario are independent, so they can run at the same time in several
+CARLA servers. Each server has its own instance of the scenario, and the runs are compared
+against each other as soon as they finish, while the rest of the repetitions are still running:
+
+    with ServerPool([('localhost', 2000), ('localhost', 3000)], town='Town03') as pool:
+        scenes = [MyScenario(client, world) for client, world in pool.servers]
+        check = DeterminismCheck(tolerance=0.01)
+        run_repetitions(scenes, 10, run_repetition, lambda index, path: check.add(path))
+        print(check.determinism_set())
+"""
+
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import carla
+
+from run_store import RunReader, compare_runs
+
+
+def parse_endpoints(servers, default_host='localhost', default_port=2000):
+    """
+    Returns the list of (host, port) pairs of a comma separated list of servers, like
+    'localhost:2000,localhost:3000,192.168.0.10'. Missing hosts and ports take the default ones.
+    """
+    endpoints = []
+    for server in servers.split(','):
+        server = server.strip()
+        if not server:
+            continue
+        host, _, port = server.rpartition(':') if ':' in server else (server, None, None)
+        endpoints.append((host or default_host, int(port) if port else default_port))
+    return endpoints
+
+
+class ServerPool(object):
+    """
+    Context manager that connects to several CARLA servers at once, optionally loading the same
+    town in all of them, and restores their original settings on exit.
+    """
+
+    def __init__(self, endpoints, town=None, timeout=30.0):
+        """
+        :param endpoints: list of (host, port) pairs of the servers
+        :param town: name of the map to load in every server. None keeps the current one
+        :param timeout: timeout of the clients, in seconds
+        """
+        self.endpoints = list(endpoints)
+        self.town = town
+        self.timeout = timeout
+        self.servers = []  # type: list[tuple[carla.Client, carla.World]]
+        self._settings = []  # type: list[tuple[carla.Client, carla.WorldSettings]]
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        # Loading a map takes a while, so all the servers load it at the same time
+        try:
+            self.servers = run_parallel(self._connect, self.endpoints)
+        except Exception:
+            # The servers that did connect may have loaded the town already
+            self._restore_settings(ignore_errors=True)
+            raise
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self._restore_settings()
+
+    def _connect(self, endpoint):
+        client = carla.Client(*endpoint)
+        client.set_timeout(self.timeout)
+        world = client.get_world()
+        # Kept before loading the town, so they are restored even if a later step fails
+        with self._lock:
+            self._settings.append((client, world.get_settings()))
+        if self.town is not None:
+            world = client.load_world(self.town)
+        return client, world
+
+    def _restore_settings(self, ignore_errors=False):
+        """
+        Applies the original settings to the servers that were connected
+
+            :param ignore_errors: whether or not to go on with the rest of the servers when
+                one of them fails, to avoid hiding the error that is being handled
+        """
+        with self._lock:
+            settings, self._settings = self._settings, []
+        for client, original_settings in settings:
+            try:
+                # The world is asked again, as the one from before loading the town expired
+                client.get_world().apply_settings(original_settings)
+            except Exception:  # pylint: disable=broad-except
+                if not ignore_errors:
+                    raise
+
+
+def run_parallel(function, items):
+    """Calls the function with each item in its own thread, returning the results in order"""
+    results = [None] * len(items)
+    errors = []
+
+    def work(index, item):
+        try:
+            results[index] = function(item)
+        except Exception as error:  # pylint: disable=broad-except
+            errors.append(error)
+
+    threads = [threading.Thread(target=work, args=(index, item)) for index, item in enumerate(items)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+def run_repetitions(scenes, repetitions, run_repetition, on_result=None):
+    """
+    Runs the repetitions of a scenario concurrently, each scene running one repetition at a
+    time in its own thread, and returns the list with the result of each repetition.
+
+        :param scenes: instances of the scenario, one per server
+        :param repetitions: number of repetitions
+        :param run_repetition: function called as run_repetition(scene, index) to run a
+            repetition, from the thread of the scene
+        :param on_result: function called as on_result(index, result) when a repetition
+            finishes, in the order they finish, from the calling thread. Repetitions keep
+            running in the meantime
+    """
+    pending = queue.Queue()
+    for index in range(repetitions):
+        pending.put(index)
+    finished = queue.Queue()
+    stop = threading.Event()
+
+    def work(scene):
+        while not stop.is_set():
+            try:
+                index = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                finished.put((index, run_repetition(scene, index), None))
+            except Exception as error:  # pylint: disable=broad-except
+                finished.put((index, None, error))
+                return
+
+    threads = [threading.Thread(target=work, args=(scene,)) for scene in scenes]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    results = [None] * repetitions
+    try:
+        for _ in range(repetitions):
+            index, result, error = finished.get()
+            if error is not None:
+                raise error
+            results[index] = result
+            if on_result is not None:
+                on_result(index, result)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    return results
+
+
+class DeterminismCheck(object):
+    """
+    DeterminismCheck groups the run files of the repetitions of a scenario into sets of
+    equivalent runs as they are added. The first run is the reference, and each new run is
+    compared with the first run of each set until it matches one, so deterministic scenarios
+    need a single comparison per repetition instead of comparing every pair of them.
+    """
+
+    def __init__(self, tolerance=0.01, streams=None):
+        """
+        :param tolerance: maximum difference between the values of equivalent runs
+        :param streams: names of the streams to compare. By default, all of them
+        """
+        self.tolerance = tolerance
+        self.streams = streams
+        self._groups = []  # type: list[tuple[RunReader, list[str]]]
+
+    def add(self, path):
+        """Adds a run file, returning whether or not it is equivalent to the reference"""
+        run = RunReader(path)
+        for group_index, (first_run, paths) in enumerate(self._groups):
+            comparison = compare_runs(first_run, run, self.tolerance, self.streams, stop_on_mismatch=True)
+            if comparison.equivalent:
+                paths.append(path)
+                run.close()
+                return group_index == 0
+        # Keeps the first run of each set open to compare the next ones
+        self._groups.append((run, [path]))
+        return len(self._groups) == 1
+
+    @property
+    def groups(self):
+        """Lists with the paths of the sets of equivalent runs, the biggest ones first"""
+        return sorted((paths for _, paths in self._groups), key=len, reverse=True)
+
+    def determinism_set(self):
+        """
+        Sizes of the sets of equivalent runs, sorted from the biggest to the smallest. The check
+        passed if there is a single value equal to the number of repetitions
+        """
+        return sorted(set(len(paths) for _, paths in self._groups), reverse=True)
+
+    def close(self):
+        """Closes the run files kept open"""
+        for run, _ in self._groups:
+            run.close()
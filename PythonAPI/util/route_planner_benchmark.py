@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2020 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Benchmark of the shortest path engines of the GlobalRoutePlanner.
+
+For every town, the road graph is built once and each engine is then measured on the same
+random pairs of spawn points: its preprocessing time, its query throughput and how many of
+its routes are longer than the exact shortest route, computed with Dijkstra.
+"""
+
+from __future__ import print_function
+
+import argparse
+import glob
+import os
+import random
+import sys
+import time
+
+try:
+    sys.path.append(glob.glob('../carla/dist/carla-*%d.%d-%s.egg' % (
+        sys.version_info.major,
+        sys.version_info.minor,
+        'win-amd64' if os.name == 'nt' else 'linux-x86_64'))[0])
+except IndexError:
+    pass
+
+try:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + '/carla')
+except IndexError:
+    pass
+
+import networkx as nx
+
+import carla
+from agents.navigation.global_route_planner import GlobalRoutePlanner
+from agents.navigation.path_search import PATH_SEARCH_BACKENDS
+
+
+def route_length(graph, route):
+    """Sum of the edge lengths of a route given as a list of nodes"""
+    return sum(graph[n1][n2]['length'] for n1, n2 in zip(route[:-1], route[1:]))
+
+
+def benchmark_town(world, args):
+    """Runs all the engines on the map currently loaded by the world"""
+    wmap = world.get_map()
+    start = time.time()
+    grp = GlobalRoutePlanner(wmap, args.resolution)
+    graph = grp.get_graph()
+    print('  Graph built in {:.2f}s: {} nodes, {} edges'.format(
+        time.time() - start, graph.number_of_nodes(), graph.number_of_edges()))
+
+    # Pairs of graph nodes, taken from the localization of random spawn points
+    spawn_points = wmap.get_spawn_points()
+    rng = random.Random(args.seed)
+    pairs = []
+    skipped = 0
+    for _ in range(args.queries):
+        origin, destination = rng.sample(spawn_points, 2)
+        origin_edge, destination_edge = grp.localize(origin.location), grp.localize(destination.location)
+        if origin_edge is None or destination_edge is None:
+            # Not on any road segment of the graph
+            skipped += 1
+            continue
+        pairs.append((origin_edge[0], destination_edge[0]))
+    if skipped:
+        print('  Skipped {} pairs of spawn points that are not on the graph'.format(skipped))
+
+    # Exact route lengths, used as reference
+    reference = []
+    for source, target in pairs:
+        try:
+            reference.append(nx.dijkstra_path_length(graph, source, target, weight='length'))
+        except nx.NetworkXNoPath:
+            reference.append(None)
+
+    print('  {:<26} {:>12} {:>12} {:>10}'.format('engine', 'preprocess', 'queries/s', 'longer'))
+    for name in args.engines:
+        start = time.time()
+        grp.set_path_search(name)
+        preprocess = time.time() - start
+        path_search = grp.get_path_search()
+
+        longer = 0
+        start = time.time()
+        for (source, target), expected in zip(pairs, reference):
+            try:
+                route = path_search.search(source, target)
+            except nx.NetworkXNoPath:
+                route = None
+            if route is not None and expected is not None and route_length(graph, route) > expected:
+                longer += 1
+        elapsed = time.time() - start
+
+        print('  {:<26} {:>11.3f}s {:>12.1f} {:>10}'.format(
+            name, preprocess, len(pairs) / max(elapsed, 1e-9), longer))
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument(
+        '--host', metavar='H', default='127.0.0.1',
+        help='IP of the host server (default: 127.0.0.1)')
+    argparser.add_argument(
+        '-p', '--port', metavar='P', default=2000, type=int,
+        help='TCP port to listen to (default: 2000)')
+    argparser.add_argument(
+        '--maps', nargs='+', default=None,
+        help='Towns to benchmark (default: all the available ones)')
+    argparser.add_argument(
+        '--engines', nargs='+', default=sorted(PATH_SEARCH_BACKENDS), choices=sorted(PATH_SEARCH_BACKENDS),
+        help='Shortest path engines to benchmark (default: all)')
+    argparser.add_argument(
+        '-n', '--queries', metavar='N', default=500, type=int,
+        help='Amount of random routes per town (default: 500)')
+    argparser.add_argument(
+        '--resolution', default=2.0, type=float,
+        help='Sampling resolution of the route planner (default: 2.0)')
+    argparser.add_argument(
+        '--seed', default=0, type=int,
+        help='Seed of the random routes (default: 0)')
+    args = argparser.parse_args()
+
+    client = carla.Client(args.host, args.port)
+    client.set_timeout(60.0)
+
+    maps = args.maps or sorted(set(m.split('/')[-1] for m in client.get_available_maps()))
+    for town in maps:
+        print('{}:'.format(town))
+        world = client.load_world(town)
+        benchmark_town(world, args)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print('\ndone.')
@@ -0,0 +1,284 @@
+# Copyright (c) 2020 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Binary storage of the data recorded by a simulation run, used by the determinism checks.
+
+A run is stored in a single file with the arrays of any amount of streams (a sensor, the
+snapshots of an actor...) for each frame:
+
+    with RunWriter('_out/run_000.run') as writer:
+        writer.append('0_LiDAR', frame, lidar_data.to_numpy())
+
+    with RunReader('_out/run_000.run') as run_a, RunReader('_out/run_001.run') as run_b:
+        print(compare_runs(run_a, run_b, tolerance=0.01).equivalent)
+
+The file is a sequence of raw arrays, each one aligned so it can be memory mapped, followed by
+an index with the frame, offset, dtype, shape and hash of the content of every array:
+
+    header | array | padding | array | padding | ... | JSON index | index offset | magic
+
+Reading a frame maps it from the file without copying it, and two frames with the same hash
+are known to be equal without reading them at all.
+"""
+
+import collections
+import hashlib
+import json
+import struct
+import threading
+
+import numpy as np
+
+
+MAGIC = b'CARLARUN'
+VERSION = 1
+ALIGNMENT = 64
+
+_HEADER = struct.Struct('<8sI4x')
+_FOOTER = struct.Struct('<Q8s')
+
+
+class RunFormatError(ValueError):
+    """Raised when a file is not a valid run file"""
+
+
+FrameEntry = collections.namedtuple('FrameEntry', ['offset', 'dtype', 'shape', 'hash'])
+
+
+def content_hash(array):
+    """Returns the hash of the dtype, shape and bytes of an array"""
+    array = np.ascontiguousarray(array)
+    digest = hashlib.sha1(str((array.dtype.str, array.dtype.descr, array.shape)).encode('utf-8'))
+    digest.update(array.reshape(-1).view(np.uint8).data if array.size else b'')
+    return digest.hexdigest()
+
+
+class RunWriter(object):
+    """
+    RunWriter appends the per-frame arrays of a run to a file. Appending is thread safe, so it
+    can be called from the callbacks of several sensors. The index is written when the writer
+    is closed, and the file can not be read before that.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path of the file, it is overwritten if it exists
+        """
+        self.path = path
+        self._file = open(path, 'wb')
+        self._file.write(_HEADER.pack(MAGIC, VERSION))
+        self._offset = _HEADER.size
+        self._index = collections.OrderedDict()  # type: collections.OrderedDict[str, dict[int, list]]
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+    def append(self, stream, frame, array):
+        """
+        Stores the array of a stream for a frame, returning its hash. A second array of the same
+        stream and frame replaces the first one.
+
+            :param stream: name of the stream
+            :param frame: frame number
+            :param array: numpy.ndarray, simple or structured, of any shape
+        """
+        array = np.ascontiguousarray(array)
+        digest = content_hash(array)
+        entry = [0, np.lib.format.dtype_to_descr(array.dtype), list(array.shape), digest]
+        with self._lock:
+            if self._file is None:
+                raise ValueError('RunWriter is closed')
+            padding = -self._offset % ALIGNMENT
+            self._file.write(b'\0' * padding)
+            entry[0] = self._offset + padding
+            self._file.write(array.reshape(-1).view(np.uint8).data if array.size else b'')
+            self._offset = entry[0] + array.nbytes
+            self._index.setdefault(stream, dict())[int(frame)] = entry
+        return digest
+
+    def close(self):
+        """Writes the index and closes the file"""
+        with self._lock:
+            if self._file is None:
+                return
+            index = {'version': VERSION, 'streams': collections.OrderedDict(
+                (stream, [[frame] + entry for frame, entry in sorted(frames.items())])
+                for stream, frames in self._index.items())}
+            self._file.write(json.dumps(index).encode('utf-8'))
+            self._file.write(_FOOTER.pack(self._offset, MAGIC))
+            self._file.close()
+            self._file = None
+
+
+class RunReader(object):
+    """
+    RunReader gives access to the arrays of a run file written by a RunWriter. Arrays are
+    read-only views of a memory map of the file.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path of the file
+        """
+        self.path = path
+        with open(path, 'rb') as run_file:
+            header = run_file.read(_HEADER.size)
+            if len(header) != _HEADER.size or _HEADER.unpack(header)[0] != MAGIC:
+                raise RunFormatError("'%s' is not a run file" % path)
+            run_file.seek(-_FOOTER.size, 2)
+            index_offset, magic = _FOOTER.unpack(run_file.read(_FOOTER.size))
+            if magic != MAGIC:
+                raise RunFormatError("'%s' is incomplete, its writer was not closed" % path)
+            run_file.seek(index_offset)
+            index = json.loads(run_file.read()[:-_FOOTER.size].decode('utf-8'))
+
+        self._streams = collections.OrderedDict()  # type: collections.OrderedDict[str, dict[int, FrameEntry]]
+        for stream, entries in index['streams'].items():
+            frames = self._streams[stream] = dict()
+            for frame, offset, descr, shape, digest in entries:
+                frames[frame] = FrameEntry(offset, _descr_to_dtype(descr), tuple(shape), digest)
+        self._data = np.memmap(path, dtype=np.uint8, mode='r') if index_offset > _HEADER.size else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+    @property
+    def streams(self):
+        """Names of the streams, in the order they were first appended"""
+        return list(self._streams)
+
+    def frames(self, stream):
+        """Sorted list with the frames of a stream"""
+        return sorted(self._streams[stream])
+
+    def entry(self, stream, frame):
+        """Returns the FrameEntry of a stream and frame, or None if there is no such array"""
+        return self._streams.get(stream, {}).get(frame)
+
+    def hash(self, stream, frame):
+        """Returns the content hash of the array of a stream and frame"""
+        return self._streams[stream][frame].hash
+
+    def get(self, stream, frame):
+        """Returns the array of a stream and frame, mapped from the file"""
+        entry = self._streams[stream][frame]
+        count = int(np.prod(entry.shape))
+        if count == 0:
+            return np.zeros(entry.shape, dtype=entry.dtype)
+        data = self._data[entry.offset:entry.offset + count * entry.dtype.itemsize]
+        return data.view(entry.dtype).reshape(entry.shape)
+
+    def stack(self, stream):
+        """
+        Returns a single array with the arrays of all the frames of a stream stacked along a
+        new first axis, for streams with one small array per frame, like actor snapshots
+        """
+        return np.stack([self.get(stream, frame) for frame in self.frames(stream)])
+
+    def close(self):
+        """Releases the memory map of the file, which stays open while any of its arrays is alive"""
+        self._data = None
+
+
+RunComparison = collections.namedtuple('RunComparison', ['equivalent', 'identical', 'similar', 'mismatches', 'max_error'])
+RunComparison.__doc__ = """
+Result of compare_runs. 'identical' is the number of frames with equal hashes, 'similar' the
+number of frames that differ by less than the tolerance, 'mismatches' the list of (stream, frame)
+pairs that are missing in one of the runs or differ more than that, and 'max_error' the maximum
+difference found between the arrays that were compared element by element.
+"""
+
+
+def compare_arrays(array_a, array_b, tolerance):
+    """
+    Returns the maximum absolute difference between two arrays of the same dtype and shape, or
+    None if they can not be compared. The fields of structured arrays are compared one by one,
+    and a NaN in only one of the arrays is an infinite difference.
+    """
+    if array_a.dtype != array_b.dtype or array_a.shape != array_b.shape:
+        return None
+    if array_a.size == 0:
+        return 0.0
+    fields = array_a.dtype.names or [None]
+    max_error = 0.0
+    for field in fields:
+        column_a = array_a if field is None else array_a[field]
+        column_b = array_b if field is None else array_b[field]
+        if column_a.dtype.kind == 'b':
+            error = float(np.any(column_a != column_b))
+        else:
+            column_a = column_a.astype(np.float64)
+            column_b = column_b.astype(np.float64)
+            with np.errstate(invalid='ignore'):
+                difference = np.abs(column_a - column_b)
+            # NaN in both runs, or the same infinity, are equal. A NaN in a single run is not
+            difference[(column_a == column_b) | (np.isnan(column_a) & np.isnan(column_b))] = 0.0
+            difference[np.isnan(difference)] = np.inf
+            error = float(np.max(difference))
+        max_error = max(max_error, error)
+        if not max_error < tolerance:
+            # It isn't going to get any better
+            break
+    return max_error
+
+
+def compare_runs(run_a, run_b, tolerance=0.01, streams=None, stop_on_mismatch=False):
+    """
+    Compares two runs frame by frame and returns a RunComparison. Frames with the same hash are
+    equal and they are not read. The rest are compared element by element, and they are similar
+    if their maximum absolute difference is below the tolerance.
+
+        :param run_a: RunReader of the first run
+        :param run_b: RunReader of the second run
+        :param tolerance: maximum difference allowed between the values of two similar frames
+        :param streams: names of the streams to compare. By default, the streams of both runs
+        :param stop_on_mismatch: whether or not to stop at the first mismatch
+    """
+    if streams is None:
+        streams = run_a.streams + [stream for stream in run_b.streams if stream not in run_a.streams]
+    identical = similar = 0
+    mismatches = []
+    max_error = 0.0
+    for stream in streams:
+        frames_a = set(run_a.frames(stream)) if stream in run_a.streams else set()
+        frames_b = set(run_b.frames(stream)) if stream in run_b.streams else set()
+        for frame in sorted(frames_a | frames_b):
+            entry_a, entry_b = run_a.entry(stream, frame), run_b.entry(stream, frame)
+            if entry_a is not None and entry_b is not None and entry_a.hash == entry_b.hash:
+                identical += 1
+                continue
+            error = None
+            if entry_a is not None and entry_b is not None:
+                error = compare_arrays(run_a.get(stream, frame), run_b.get(stream, frame), tolerance)
+            if error is not None:
+                max_error = max(max_error, error)
+                if error < tolerance:
+                    similar += 1
+                    continue
+            mismatches.append((stream, frame))
+            if stop_on_mismatch:
+                return RunComparison(False, identical, similar, mismatches, max_error)
+    return RunComparison(not mismatches, identical, similar, mismatches, max_error)
+
+
+def _descr_to_dtype(descr):
+    """Inverse of numpy.lib.format.dtype_to_descr, after a round trip through JSON"""
+    if not isinstance(descr, list):
+        return np.dtype(descr)
+    fields = []
+    for field in descr:
+        name, field_descr = field[0], field[1]
+        field_dtype = _descr_to_dtype(field_descr) if isinstance(field_descr, list) else field_descr
+        fields.append((name, field_dtype) + tuple(tuple(shape) for shape in field[2:]))
+    return np.dtype(fields)